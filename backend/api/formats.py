@@ -0,0 +1,120 @@
+"""
+Response builders for /magic/convert.
+
+- json (default): ConvertResponse with base64 PNGs (or WebPs)
+- png: the worksheet PNG alone, metadata in X-* headers
+- svg / pdf: the vector worksheet alone, metadata in X-* headers
+- multipart: multipart/mixed with a JSON meta part followed by one part per artifact
+- zip: stored (uncompressed, PNGs are already compressed) ZIP with meta.json + artifacts
+
+The binary formats stream the encoded bytes as-is: no base64, no extra copies.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import zipfile
+from typing import Dict, Iterator, List
+
+from fastapi.responses import Response, StreamingResponse
+
+from backend.services.magic import WorksheetArtifacts, artifact_filename, artifact_media_type
+
+FORMATS = ("json", "png", "svg", "pdf", "multipart", "zip")
+
+#single-file formats and the artifact they return
+_SINGLE = {"png": "worksheet_png", "svg": "worksheet_svg", "pdf": "worksheet_pdf"}
+
+
+def meta_headers(artifacts: WorksheetArtifacts) -> Dict[str, str]:
+	m = artifacts.meta
+	return {
+		"X-Image-Width": str(m.width),
+		"X-Image-Height": str(m.height),
+		"X-Image-Colors": str(m.colors),
+		"X-Num-Regions": str(m.num_regions),
+	}
+
+
+def _multipart_chunks(artifacts: WorksheetArtifacts, boundary: str) -> Iterator[bytes]:
+	meta = json.dumps(artifacts.meta.model_dump()).encode("utf-8")
+	yield (f"--{boundary}\r\nContent-Type: application/json\r\n"
+		f"Content-Disposition: inline; name=\"meta\"\r\nContent-Length: {len(meta)}\r\n\r\n").encode("ascii")
+	yield meta
+	for name, body in artifacts.items().items():
+		yield (f"\r\n--{boundary}\r\nContent-Type: {artifact_media_type(name, body)}\r\n"
+			f"Content-Disposition: attachment; name=\"{name}\"; filename=\"{artifact_filename(name, body)}\"\r\n"
+			f"Content-Length: {len(body)}\r\n\r\n").encode("ascii")
+		yield body
+	yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+
+class _ChunkSink:
+	"""Write-only, non-seekable file object collecting zipfile output chunks."""
+
+	def __init__(self):
+		self.chunks: List[bytes] = []
+
+	def write(self, data) -> int:
+		self.chunks.append(bytes(data) if not isinstance(data, bytes) else data)
+		return len(data)
+
+	def flush(self) -> None:
+		pass
+
+	def drain(self) -> List[bytes]:
+		out, self.chunks = self.chunks, []
+		return out
+
+
+class ZipStream:
+	"""Stored ZIP written entry by entry: add() and close() return the bytes to send next."""
+
+	def __init__(self):
+		self._sink = _ChunkSink()
+		self._zf = zipfile.ZipFile(self._sink, mode="w", compression=zipfile.ZIP_STORED)
+
+	def add(self, name: str, data: bytes) -> List[bytes]:
+		self._zf.writestr(name, data)
+		return self._sink.drain()
+
+	def close(self) -> List[bytes]:
+		self._zf.close()
+		return self._sink.drain()
+
+
+def iter_zip(files: Dict[str, bytes]) -> Iterator[bytes]:
+	"""Stream a stored ZIP of files entry by entry (no whole-archive buffer)."""
+	zs = ZipStream()
+	for name, data in files.items():
+		yield from zs.add(name, data)
+	yield from zs.close()
+
+
+def _zip_files(artifacts: WorksheetArtifacts) -> Dict[str, bytes]:
+	files = {"meta.json": json.dumps(artifacts.meta.model_dump()).encode("utf-8")}
+	for name, body in artifacts.items().items():
+		files[artifact_filename(name, body)] = body
+	return files
+
+
+def build_response(artifacts: WorksheetArtifacts, fmt: str, headers: Dict[str, str] | None = None):
+	"""Return the response object for fmt; json returns the ConvertResponse model."""
+	headers = dict(headers or {})
+	if fmt == "json":
+		return artifacts.to_response()
+	headers.update(meta_headers(artifacts))
+	if fmt in _SINGLE:
+		name = _SINGLE[fmt]
+		body = getattr(artifacts, name)
+		if body is None:
+			raise ValueError(f"Artifact {name} was not produced")
+		return Response(content=body, media_type=artifact_media_type(name, body), headers=headers)
+	if fmt == "multipart":
+		boundary = "magic-" + secrets.token_hex(12)
+		return StreamingResponse(_multipart_chunks(artifacts, boundary), media_type=f"multipart/mixed; boundary={boundary}", headers=headers)
+	if fmt == "zip":
+		headers["Content-Disposition"] = 'attachment; filename="worksheet.zip"'
+		return StreamingResponse(iter_zip(_zip_files(artifacts)), media_type="application/zip", headers=headers)
+	raise ValueError(f"Unknown format: {fmt}")
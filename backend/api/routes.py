@@ -1,14 +1,37 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
 import logging
+import random
+import time
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Query
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from backend.api.schemas import ConvertRequestOptions, ConvertResponse
-from backend.services.magic import convert_image_bytes_to_worksheet
+from backend.api.formats import ZipStream, build_response
+from pydantic import ValidationError
+
+from backend.api.schemas import OUTPUTS, ConvertRequestOptions, ConvertResponse, PaletteColors, SweepRequest, SweepResponse
+from backend.config import settings
+from backend.services.admission import ImageTooLargeError, memory_admission
+from backend.services.cache import cache_key, result_cache
+from backend.services.executor import QueueFullError, conversion_executor
+from backend.services.frames import changed_frames, convert_frame, frame_count, frame_options
+from backend.services.jobs import Job, job_manager
+from backend.services.magic import WorksheetArtifacts, artifact_filename, progressive_preview_options, render_worksheet_artifacts, with_output
+from backend.services.metrics import conversions_total, observe_pipeline
+from backend.services.palettes import BUILTIN_PALETTES, bgr_to_hex, palette_registry
+from backend.services.sweep import sweep_variants
+from backend.services.startup import readiness
+from backend.services.profiling import profiled_call, save_profile
+from backend.services.timing import server_timing
+from backend.ops.vector import PngPagesPdf
 
 
 router = APIRouter()
 
+_OUTPUTS_PATTERN = "^({0})(,({0}))*$".format("|".join(OUTPUTS))
+
 
 @router.get("/health")
 def health():
@@ -16,36 +39,542 @@ def health():
 	return {"status": "ok"}
 
 
-@router.post("/magic/convert", response_model=ConvertResponse)
-async def magic_convert(
-	file: UploadFile = File(..., description="Input image file (jpg/png/webp)."),
+@router.get("/ready")
+def ready(response: Response):
+	"""Readiness check: 503 until every conversion worker is warmed up (services.startup)."""
+	state = readiness.snapshot()
+	if not state["ready"]:
+		response.status_code = 503
+		response.headers["Retry-After"] = "1"
+	return state
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+	if not if_none_match:
+		return False
+	tags = [t.strip() for t in if_none_match.split(",")]
+	#weak comparison: W/"x" matches "x"
+	return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+@router.get("/magic/executor")
+def magic_executor_stats():
+	"""Conversion pool status (workers, in-flight, rejected)."""
+	return conversion_executor.stats()
+
+
+@router.get("/magic/admission")
+def magic_admission_stats():
+	"""Memory admission status (budget, bytes reserved, waiting, outcome counters)."""
+	return memory_admission.stats()
+
+
+@router.get("/magic/cache")
+def magic_cache_stats():
+	"""Result cache counters (hits, misses, evictions, sizes)."""
+	return result_cache.stats()
+
+
+def convert_options(
 	colors: int = Query(9, ge=2, le=24),
 	max_size: int = Query(1024, ge=128, le=4096),
 	thickness: int = Query(2, ge=1, le=10),
 	min_area: int = Query(80, ge=1, le=10000),
 	merge_area: int = Query(200, ge=1, le=100000),
+	merge_engine: str = Query("pixel", pattern="^(pixel|bulk)$", description="pixel: relabel the pixels of small components (original rule); bulk: merge whole small components (fewer specks, different output)."),
 	outline_mode: str = Query("union", pattern="^(labels|union)$"),
+	kmeans_sample: int = Query(100000, ge=0, le=16_777_216),
+	kmeans_space: str = Query("bgr", pattern="^(bgr|lab)$"),
 	include_preview: bool = Query(True),
 	return_pdf: bool = Query(False),
-):
+	return_svg: bool = Query(False),
+	page_size: str = Query("A4", pattern="^(A4|A3)$"),
+	memory_budget_mb: int = Query(0, ge=0, le=65536),
+	outputs: Optional[str] = Query(None, pattern=_OUTPUTS_PATTERN, description="Comma-separated artifacts to produce: worksheet, preview, labels, legend, svg, pdf or meta (metadata only)."),
+	raster_format: str = Query("png", pattern="^(png|webp)$", description="Raster artifacts as palette-indexed png or lossless webp."),
+	compression: int = Query(1, ge=0, le=9, description="0 fastest/largest .. 9 smallest/slowest raster artifacts."),
+	palette: Optional[str] = Query(None, description="Fixed palette instead of k-means: a name from /magic/palettes, or comma-separated rrggbb colors."),
+) -> ConvertRequestOptions:
+	"""Query parameters shared by every conversion endpoint."""
 	try:
-		data = await file.read()
-		if not data:
-			raise ValueError("Empty file upload. Please choose an image file.")
-		if not data:
-			raise ValueError("Empty file upload. Please choose an image file.")
-		opts = ConvertRequestOptions(
+		return ConvertRequestOptions(
 			colors=colors,
 			max_size=max_size,
 			thickness=thickness,
 			min_area=min_area,
 			merge_area=merge_area,
+			merge_engine=merge_engine,
 			outline_mode=outline_mode,
+			kmeans_sample=kmeans_sample,
+			kmeans_space=kmeans_space,
 			include_preview=include_preview,
 			return_pdf=return_pdf,
+			return_svg=return_svg,
+			page_size=page_size,
+			memory_budget_mb=memory_budget_mb,
+			outputs=outputs.split(",") if outputs else None,
+			raster_format=raster_format,
+			compression=compression,
+			palette=_resolve_palette(palette),
 		)
-		result = convert_image_bytes_to_worksheet(data, opts)
-		return result
+	except ValidationError as e:
+		raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+
+def _resolve_palette(value: Optional[str]) -> Optional[List[str]]:
+	"""Registered palette name -> its colors; an inline list gets its '#' prefixes."""
+	if not value:
+		return None
+	if "," in value:
+		return [c if c.startswith("#") else f"#{c}" for c in value.split(",")]
+	colors = palette_registry.get(value)
+	if colors is None:
+		raise HTTPException(status_code=404, detail=f"Unknown palette: {value}")
+	return colors
+
+
+def _want_profile(request: Request) -> bool:
+	if not settings.PROFILE_ALLOWED:
+		return False
+	if request.headers.get("x-magic-profile") == "1":
+		return True
+	return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+async def _convert_cached(key: str, data: bytes, opts: ConvertRequestOptions, profile: bool = False,
+		init_palette=None) -> Tuple[WorksheetArtifacts, Dict[str, str]]:
+	"""Artifacts for (data, opts) from the cache or the worker pool.
+	Returns (artifacts, headers) with X-Cache, Server-Timing and, when profiled, X-Profile
+	(X-Admission: tiled|downscaled when memory admission had to degrade the run, never cached).
+	init_palette warm-starts k-means (key must then differ from the cold run's key).
+	"""
+	t0 = time.perf_counter()
+	artifacts = result_cache.get(key)
+	if artifacts is not None:
+		conversions_total.inc(source="cache")
+		return artifacts, {"X-Cache": "hit", "Server-Timing": server_timing({}, {"cache": (time.perf_counter() - t0) * 1000.0})}
+	headers = {"X-Cache": "miss"}
+	async with memory_admission.admit(data, opts) as (run_opts, degraded):
+		if profile:
+			artifacts, folded = await conversion_executor.run(profiled_call, render_worksheet_artifacts, data, run_opts)
+			headers["X-Profile"] = save_profile(folded, settings.PROFILE_DIR, settings.PROFILE_MAX_FILES)
+		else:
+			artifacts = await conversion_executor.run(render_worksheet_artifacts, data, run_opts, None, init_palette)
+	if degraded:
+		#ran with other options to fit the memory budget: not the result key stands for
+		headers["X-Admission"] = degraded
+	else:
+		result_cache.put(key, artifacts)
+	conversions_total.inc(source="pipeline")
+	observe_pipeline(artifacts.timings, artifacts.meta.num_regions, artifacts.meta.merge_iterations)
+	headers["Server-Timing"] = server_timing(artifacts.timings, {"total": (time.perf_counter() - t0) * 1000.0})
+	return artifacts, headers
+
+
+@router.post("/magic/convert", response_model=ConvertResponse)
+async def magic_convert(
+	request: Request,
+	response: Response,
+	file: UploadFile = File(..., description="Input image file (jpg/png/webp)."),
+	opts: ConvertRequestOptions = Depends(convert_options),
+	fmt: str = Query("json", alias="format", pattern="^(json|png|svg|pdf|multipart|zip)$", description="Response format: json (base64 files), png/svg/pdf (worksheet only), multipart (multipart/mixed) or zip."),
+):
+	try:
+		data = await file.read()
+		if not data:
+			raise ValueError("Empty file upload. Please choose an image file.")
+		if fmt in ("png", "pdf", "svg"):
+			#single-file formats always get their file, whatever outputs= says
+			opts = with_output(opts, "worksheet" if fmt == "png" else fmt)
+		key = cache_key(data, opts)
+		etag = f'"{key}"' if fmt == "json" else f'"{key}-{fmt}"'
+		#results are content-addressed, so a client that already holds this ETag has the exact bytes
+		if _etag_matches(request.headers.get("if-none-match"), etag):
+			return Response(status_code=304, headers={"ETag": etag})
+		artifacts, headers = await _convert_cached(key, data, opts, profile=_want_profile(request))
+		if "X-Admission" not in headers:
+			headers["ETag"] = etag
+		response.headers.update(headers)
+		return build_response(artifacts, fmt, headers)
+	except QueueFullError as e:
+		raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+	except ImageTooLargeError as e:
+		raise HTTPException(status_code=413, detail=str(e))
 	except Exception as e:
 		logging.exception("/magic/convert failed: %s", e)
 		raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/magic/convert/batch")
+async def magic_convert_batch(
+	files: List[UploadFile] = File(..., description="Input image files, converted with the same options."),
+	opts: ConvertRequestOptions = Depends(convert_options),
+):
+	"""Convert many images in parallel and stream one NDJSON line per image as soon as it is done.
+
+	Each line is {"index", "filename", "ok", "cached", "result"} on success or
+	{"index", "filename", "ok": false, "error"} on failure; one bad image never fails the batch.
+	"""
+	if len(files) > settings.BATCH_MAX_FILES:
+		raise HTTPException(status_code=400, detail=f"Too many files: {len(files)} (max {settings.BATCH_MAX_FILES}).")
+	items = [(i, f.filename or f"file{i}", await f.read()) for i, f in enumerate(files)]
+	#keep the batch to one conversion per worker so other requests still get a turn
+	slots = asyncio.Semaphore(conversion_executor.workers)
+
+	async def convert_one(index: int, filename: str, data: bytes) -> dict:
+		line = {"index": index, "filename": filename}
+		try:
+			if not data:
+				raise ValueError("Empty file upload.")
+			async with slots:
+				artifacts, headers = await _convert_cached(cache_key(data, opts), data, opts)
+			line.update(ok=True, cached=headers["X-Cache"] == "hit", result=artifacts.to_response().model_dump())
+		except QueueFullError as e:
+			line.update(ok=False, error=str(e), retry_after=e.retry_after)
+		except Exception as e:
+			logging.warning("/magic/convert/batch item %s (%s) failed: %s", index, filename, e)
+			line.update(ok=False, error=str(e))
+		return line
+
+	async def stream():
+		tasks = [asyncio.create_task(convert_one(*item)) for item in items]
+		try:
+			for done in asyncio.as_completed(tasks):
+				yield json.dumps(await done) + "\n"
+		finally:
+			for t in tasks:
+				t.cancel()
+
+	return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def _sse(event: str, payload: dict) -> str:
+	return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@router.post("/magic/convert/stream")
+async def magic_convert_stream(
+	file: UploadFile = File(..., description="Input image file (jpg/png/webp)."),
+	opts: ConvertRequestOptions = Depends(convert_options),
+):
+	"""Progressive conversion as Server-Sent Events.
+
+	- event "preview": worksheet + preview at 256 px (same JSON shape as /magic/convert), sent first
+	- event "result": the full result, k-means warm-started from the preview palette
+	- event "error": {"detail"} when the full run fails
+	A max_size of 256 or less skips the preview event.
+	"""
+	data = await file.read()
+	if not data:
+		raise HTTPException(status_code=400, detail="Empty file upload. Please choose an image file.")
+	low_opts = progressive_preview_options(opts)
+	preview = None
+	if low_opts is not None:
+		try:
+			preview, _ = await _convert_cached(cache_key(data, low_opts), data, low_opts)
+		except QueueFullError as e:
+			raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+		except ImageTooLargeError as e:
+			raise HTTPException(status_code=413, detail=str(e))
+		except Exception as e:
+			logging.exception("/magic/convert/stream failed: %s", e)
+			raise HTTPException(status_code=400, detail=str(e))
+
+	async def events():
+		if preview is not None:
+			yield _sse("preview", preview.to_response().model_dump(exclude_none=True))
+		#a preview served from the disk cache has no palette: cold start
+		init = preview.palette if preview is not None else None
+		try:
+			key = cache_key(data, opts, variant="warm" if init is not None else "")
+			artifacts, _ = await _convert_cached(key, data, opts, init_palette=init)
+			yield _sse("result", artifacts.to_response().model_dump())
+		except Exception as e:
+			logging.warning("/magic/convert/stream full run failed: %s", e)
+			yield _sse("error", {"detail": str(e)})
+
+	return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/magic/convert/frames")
+async def magic_convert_frames(
+	file: UploadFile = File(..., description="Animated GIF/WebP or multi-page TIFF (a still image is one frame)."),
+	opts: ConvertRequestOptions = Depends(convert_options),
+	fmt: str = Query("zip", alias="format", pattern="^(zip|pdf)$", description="zip: a folder of artifacts per frame; pdf: one worksheet page per frame."),
+	max_frames: int = Query(settings.FRAMES_MAX, ge=1, le=settings.FRAMES_MAX, description="Convert at most this many frames, from the first."),
+	skip_threshold: float = Query(0.5, ge=0, le=255, description="Frames differing from the last converted one by at most this mean gray level (on a 64 px thumbnail) reuse its result."),
+):
+	"""One worksheet per frame, numbered with one palette shared by all frames (see services.frames),
+	streamed as the frames are converted.
+
+	- zip: frame_0001/worksheet.png, ... (the outputs asked for), legend.png once (it is the same
+	  for every frame) and meta.json last: {"frames", "palette", "items": [{"index", "reused", meta}]}
+	- pdf: one page per frame with the raster worksheet, fitted to page_size; repeated frames share their image
+	"""
+	data = await file.read()
+	if not data:
+		raise HTTPException(status_code=400, detail="Empty file upload. Please choose an image file.")
+	if fmt == "pdf":
+		opts = with_output(opts, "worksheet").model_copy(update={"raster_format": "png"})
+	try:
+		n = frame_count(data, max_frames)
+	except ValueError as e:
+		#past the decompression-bomb limit: refused like /magic/convert's memory admission does
+		raise HTTPException(status_code=413, detail=str(e))
+
+	async def chunks():
+		async with memory_admission.admit(data, opts) as (run_opts, _):
+			run_opts = await conversion_executor.run(frame_options, data, run_opts, max_frames)
+			#decoded and compared on a thread of this request, only changed frames go to the pool
+			frames = changed_frames(data, run_opts, max_frames, skip_threshold)
+			writer = PngPagesPdf(run_opts.page_size) if fmt == "pdf" else ZipStream()
+			items = []
+			artifacts = None
+			error = None
+			#index of the frame the current artifacts were converted for
+			source = 0
+			try:
+				while True:
+					try:
+						item = await asyncio.to_thread(next, frames, None)
+						if item is None:
+							break
+						index, img = item
+						if img is not None:
+							artifacts = await conversion_executor.run(convert_frame, img, run_opts)
+							source = index
+						del img
+					except Exception as e:
+						if not items:
+							#nothing sent yet: the request fails with a status code
+							raise
+						#the response is already going out as 200: end it with an explicit error entry
+						logging.warning("/magic/convert/frames stopped at frame %s: %s", len(items), e)
+						error = {"frame": len(items), "detail": str(e)}
+						break
+					reused = source != index
+					items.append({"index": index, "reused": reused, **artifacts.meta.model_dump()})
+					if fmt == "pdf":
+						out = writer.add_page(artifacts.worksheet_png, key=source)
+					else:
+						out = []
+						for name, body in artifacts.items().items():
+							if name == "legend_png":
+								if len(items) == 1:
+									out += writer.add(artifact_filename(name, body), body)
+							else:
+								out += writer.add(f"frame_{index + 1:04d}/{artifact_filename(name, body)}", body)
+					for chunk in out:
+						yield chunk
+				if fmt == "zip":
+					meta = {"frames": len(items), "palette": bgr_to_hex(artifacts.palette), "items": items}
+					if error is not None:
+						meta["error"] = error
+						for chunk in writer.add("error.json", json.dumps(error).encode("utf-8")):
+							yield chunk
+					for chunk in writer.add("meta.json", json.dumps(meta).encode("utf-8")):
+						yield chunk
+				elif error is not None:
+					for chunk in writer.add_text_page([f"Conversion stopped at frame {error['frame'] + 1} of {n}:", error["detail"]]):
+						yield chunk
+				for chunk in writer.close():
+					yield chunk
+			finally:
+				try:
+					frames.close()
+				except ValueError:
+					#still decoding in its thread after a disconnect; it stops at its next frame
+					pass
+
+	stream = chunks()
+	#the first frame is converted before the response starts, so its errors get a status code
+	try:
+		first = await stream.__anext__()
+	except QueueFullError as e:
+		raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+	except ImageTooLargeError as e:
+		raise HTTPException(status_code=413, detail=str(e))
+	except Exception as e:
+		logging.exception("/magic/convert/frames failed: %s", e)
+		raise HTTPException(status_code=400, detail=str(e))
+
+	async def body():
+		yield first
+		async for chunk in stream:
+			yield chunk
+
+	ext, media_type = ("pdf", "application/pdf") if fmt == "pdf" else ("zip", "application/zip")
+	headers = {"Content-Disposition": f'attachment; filename="worksheets.{ext}"', "X-Frame-Count": str(n)}
+	return StreamingResponse(body(), media_type=media_type, headers=headers)
+
+
+_INT_LIST = r"^\d+(,\d+)*$"
+
+
+def sweep_request(
+	colors: str = Query("9", pattern=_INT_LIST, description="Comma-separated color counts, e.g. 4,6,8,10,12."),
+	merge_area: str = Query("200", pattern=_INT_LIST, description="Comma-separated merge areas."),
+	min_area: str = Query("80", pattern=_INT_LIST, description="Comma-separated minimum numbered areas."),
+	thickness: str = Query("2", pattern=_INT_LIST, description="Comma-separated outline thicknesses."),
+	outline_mode: str = Query("union", pattern="^(labels|union)(,(labels|union))*$"),
+	max_size: int = Query(1024, ge=128, le=4096),
+	kmeans_sample: int = Query(100000, ge=0, le=16_777_216),
+	kmeans_space: str = Query("bgr", pattern="^(bgr|lab)$"),
+	merge_engine: str = Query("pixel", pattern="^(pixel|bulk)$"),
+	thumb_size: int = Query(256, ge=64, le=1024),
+	thumbs: str = Query("worksheet,preview", pattern="^((worksheet|preview)(,(worksheet|preview))*)?$"),
+) -> SweepRequest:
+	"""Query parameters of /magic/sweep: the swept options take comma-separated lists."""
+	try:
+		req = SweepRequest(
+			colors=colors.split(","),
+			merge_area=merge_area.split(","),
+			min_area=min_area.split(","),
+			thickness=thickness.split(","),
+			outline_mode=outline_mode.split(","),
+			max_size=max_size,
+			kmeans_sample=kmeans_sample,
+			kmeans_space=kmeans_space,
+			merge_engine=merge_engine,
+			thumb_size=thumb_size,
+			thumbs=thumbs.split(",") if thumbs else [],
+		)
+	except ValidationError as e:
+		raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+	n = len(req.colors) * len(req.merge_area) * len(req.min_area) * len(req.thickness) * len(req.outline_mode)
+	if n > settings.SWEEP_MAX_VARIANTS:
+		raise HTTPException(status_code=400, detail=f"Too many variants: {n} (max {settings.SWEEP_MAX_VARIANTS}).")
+	return req
+
+
+@router.post("/magic/sweep", response_model=SweepResponse)
+async def magic_sweep(
+	file: UploadFile = File(..., description="Input image file (jpg/png/webp)."),
+	req: SweepRequest = Depends(sweep_request),
+):
+	"""Try a grid of options on one image: returns thumbnails + metadata for every combination.
+
+	Decoding, k-means (per colors), smoothing, merging (per merge_area), regions and outlines
+	are computed once and shared by all variants that need them.
+	"""
+	try:
+		data = await file.read()
+		if not data:
+			raise ValueError("Empty file upload. Please choose an image file.")
+		#costed like its largest variant; a sweep cannot be tiled or shrunk
+		largest = ConvertRequestOptions(max_size=req.max_size, colors=max(req.colors), kmeans_sample=req.kmeans_sample, outputs=["worksheet", "preview"])
+		async with memory_admission.admit(data, largest, degrade=False):
+			return await conversion_executor.run(sweep_variants, data, req)
+	except QueueFullError as e:
+		raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+	except ImageTooLargeError as e:
+		raise HTTPException(status_code=413, detail=str(e))
+	except Exception as e:
+		logging.exception("/magic/sweep failed: %s", e)
+		raise HTTPException(status_code=400, detail=str(e))
+
+
+def _job_view(job: Job) -> dict:
+	view = job.to_dict()
+	view.pop("key")
+	view["status_url"] = f"/magic/jobs/{job.id}"
+	view["result_url"] = f"/magic/jobs/{job.id}/result" if job.status == "done" else None
+	return view
+
+
+@router.get("/magic/palettes")
+def magic_palettes():
+	"""Built-in and uploaded palettes usable as palette=<name>."""
+	return palette_registry.list()
+
+
+@router.get("/magic/palettes/{name}")
+def magic_palette(name: str):
+	colors = palette_registry.get(name)
+	if colors is None:
+		raise HTTPException(status_code=404, detail=f"Unknown palette: {name}")
+	return {"name": name, "colors": colors}
+
+
+@router.put("/magic/palettes/{name}")
+def magic_palette_put(name: str, body: PaletteColors, response: Response):
+	"""Create or replace a user palette (colors in legend order)."""
+	try:
+		created = palette_registry.put(name, body.colors)
+	except ValueError as e:
+		raise HTTPException(status_code=409 if name in BUILTIN_PALETTES else 400, detail=str(e))
+	response.status_code = 201 if created else 200
+	return {"name": name, "colors": body.colors}
+
+
+@router.delete("/magic/palettes/{name}")
+def magic_palette_delete(name: str):
+	if not palette_registry.delete(name):
+		raise HTTPException(status_code=404, detail=f"Unknown user palette: {name}")
+	return {"name": name, "deleted": True}
+
+
+@router.get("/magic/jobs")
+def magic_jobs_stats():
+	"""Job queue counters (queued, running, done, failed, cancelled, rejected, expired)."""
+	return job_manager.stats()
+
+
+@router.post("/magic/jobs", status_code=202)
+async def magic_jobs_submit(
+	file: UploadFile = File(..., description="Input image file (jpg/png/webp)."),
+	opts: ConvertRequestOptions = Depends(convert_options),
+):
+	"""Queue a conversion and return at once; poll the status URL, then fetch the result URL."""
+	data = await file.read()
+	if not data:
+		raise HTTPException(status_code=400, detail="Empty file upload. Please choose an image file.")
+	try:
+		job = job_manager.submit(data, opts)
+	except QueueFullError as e:
+		raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+	return JSONResponse(_job_view(job), status_code=202, headers={"Location": f"/magic/jobs/{job.id}"})
+
+
+@router.get("/magic/jobs/{job_id}")
+def magic_jobs_status(job_id: str):
+	"""Status, current stage and progress (finished stages / planned stages) of a job."""
+	job = job_manager.get(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Unknown or expired job.")
+	return _job_view(job)
+
+
+@router.get("/magic/jobs/{job_id}/result")
+def magic_jobs_result(
+	job_id: str,
+	request: Request,
+	fmt: str = Query("json", alias="format", pattern="^(json|png|svg|pdf|multipart|zip)$", description="Same formats as /magic/convert."),
+):
+	job = job_manager.get(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Unknown or expired job.")
+	if job.status != "done":
+		raise HTTPException(status_code=409, detail=f"Job is {job.status}." + (f" {job.error}" if job.error else ""))
+	etag = f'"{job.key}"' if fmt == "json" else f'"{job.key}-{fmt}"'
+	if _etag_matches(request.headers.get("if-none-match"), etag):
+		return Response(status_code=304, headers={"ETag": etag})
+	artifacts = job_manager.result(job_id)
+	if artifacts is None:
+		raise HTTPException(status_code=404, detail="Job result expired.")
+	try:
+		response = build_response(artifacts, fmt, {"ETag": etag})
+	except ValueError as e:
+		raise HTTPException(status_code=400, detail=str(e))
+	if fmt == "json":
+		return JSONResponse(response.model_dump(), headers={"ETag": etag})
+	return response
+
+
+@router.delete("/magic/jobs/{job_id}")
+def magic_jobs_cancel(job_id: str):
+	"""Cancel a queued or running job (a running job stops at its next stage), or delete a finished one."""
+	job = job_manager.cancel(job_id)
+	if job is None:
+		raise HTTPException(status_code=404, detail="Unknown or expired job.")
+	return _job_view(job)
@@ -6,23 +6,52 @@ Notes on defaults and ranges we enforce:
 - max_size: default 1024 (downscale for performance), 128..4096 allowed
 - thickness: default 2, 1..10 allowed
 - min_area: default 80 px^2 to skip tiny noisy regions, 1..10000 allowed
+- kmeans_sample: default 100000 pixels used to fit the palette, 0 = every pixel
+- kmeans_space: default 'bgr', or 'lab' to cluster in CIE Lab
 - include_preview: default True
-- return_pdf: default False (enable later when PDF support is added)
+- return_pdf: default False, vector PDF of the worksheet (traced outlines, numbers, legend)
+- return_svg: default False, same worksheet as SVG
+- page_size: default 'A4' (or 'A3') for the PDF page
+- memory_budget_mb: default 0 (no limit); otherwise the pipeline runs in row bands sized
+  to keep the estimated peak memory of the request under this budget
+- outputs: default None (worksheet + legend, plus the flags above); when set, exactly the
+  listed artifacts are produced and include_preview/return_* are ignored. 'meta' alone
+  returns only the metadata
+- raster_format: default 'png' (palette PNGs), or 'webp' for lossless WebP
+- compression: default 1 (fast), 0..9 zlib level of the PNGs / effort of the WebPs
+- palette: default None (k-means palette of `colors` colors); a list of 2..64 '#rrggbb'
+  colors maps every pixel to the nearest of them instead (no k-means, colors is ignored)
+
+SweepRequest lists several values per option (same ranges as above); every combination
+is one variant of the sweep.
 """
 
 from __future__ import annotations
 	
-from typing import Optional, Annotated
+import itertools
+from typing import Dict, List, Optional, Annotated
 from typing import Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
 #just to list the classes
 __all__ = [
+	"OUTPUTS",
 	"ConvertRequestOptions",
 	"ImageMeta",
 	"ConvertResponse",
+	"PaletteColors",
+	"SweepRequest",
+	"SweepVariant",
+	"SweepResponse",
 ]
 
+#values accepted by the outputs= selector, in canonical order
+OUTPUTS = ("worksheet", "preview", "labels", "legend", "svg", "pdf", "meta")
+
+HEX_COLOR = r"^#[0-9a-fA-F]{6}$"
+
+Output = Literal["worksheet", "preview", "labels", "legend", "svg", "pdf", "meta"]
+
 
 class ConvertRequestOptions(BaseModel):
 	"""Options provided with the uploaded image."""
@@ -32,9 +61,30 @@ class ConvertRequestOptions(BaseModel):
 	thickness: Annotated[int, Field(2, ge=1, le=10, description="Outline thickness in pixels.")]
 	min_area: Annotated[int, Field(80, ge=1, le=10000, description="Minimum region area in px^2 to receive a number.")]
 	merge_area: Annotated[int, Field(200, ge=1, le=100000, description="Minimum area (px^2) to keep as a standalone region; smaller connected components will be merged into a neighboring label before numbering.")]
+	merge_engine: Annotated[Literal["pixel", "bulk"], Field("pixel", description="Micro-region merge: 'pixel' relabels the pixels of small components from their 3x3 neighbourhood (the original rule), 'bulk' moves whole small components into the neighbour they share the longest border with (fewer leftover specks, different output).")]
 	outline_mode: Annotated[str, Field("union", description="Outline generation strategy: 'labels' for only label boundaries, or 'union' for union(labels, canny).")]
+	kmeans_sample: Annotated[int, Field(100000, ge=0, le=16_777_216, description="Number of sampled pixels used to fit the k-means palette (0 = all pixels). Every pixel is still assigned to its nearest color.")]
+	kmeans_space: Annotated[Literal["bgr", "lab"], Field("bgr", description="Color space for k-means: 'bgr' or 'lab' (perceptual).")]
 	include_preview: bool = Field(True, description="Include color preview image in response.")
-	return_pdf: bool = Field(False, description="Also return a PDF (if supported/enabled).")
+	return_pdf: bool = Field(False, description="Also return a vector PDF of the worksheet.")
+	return_svg: bool = Field(False, description="Also return a vector SVG of the worksheet.")
+	page_size: Annotated[Literal["A4", "A3"], Field("A4", description="PDF page size (the worksheet is fitted and centered).")]
+	memory_budget_mb: Annotated[int, Field(0, ge=0, le=65536, description="Per-request memory budget in MiB (0 = no limit). Above it the image is processed in row bands with halo overlap.")]
+	outputs: Optional[List[Output]] = Field(None, description="Artifacts to produce (overrides include_preview/return_*); stages no listed output needs are skipped.")
+	raster_format: Annotated[Literal["png", "webp"], Field("png", description="Encoding of the raster artifacts: palette-indexed 'png' or lossless 'webp'.")]
+	compression: Annotated[int, Field(1, ge=0, le=9, description="Speed/size trade-off of the raster artifacts: 0 fastest/largest .. 9 smallest/slowest.")]
+	palette: Optional[List[Annotated[str, Field(pattern=HEX_COLOR)]]] = Field(None, min_length=2, max_length=64, description="Fixed '#rrggbb' palette to map pixels to instead of fitting k-means (colors is then ignored).")
+
+	@field_validator("palette")
+	@classmethod
+	def _lower_hex(cls, v):
+		return None if v is None else [c.lower() for c in v]
+
+	@field_validator("outputs")
+	@classmethod
+	def _canonical_outputs(cls, v):
+		#dedup + fixed order, so equivalent selections share a cache key
+		return None if v is None else [o for o in OUTPUTS if o in v]
 
 
 class ImageMeta(BaseModel):
@@ -42,18 +92,81 @@ class ImageMeta(BaseModel):
 	height: int = Field(..., ge=1)
 	colors: int = Field(..., ge=1)
 	num_regions: int = Field(..., ge=0)
+	numbers_overflow: int = Field(0, ge=0, description="Numbers drawn over other numbers for lack of room on the raster worksheet.")
+	merge_iterations: Optional[int] = Field(None, ge=0, description="Passes run by merge_engine=bulk (None with the pixel engine); its time is the merge stage timing.")
+	merge_converged: Optional[bool] = Field(None, description="False when the bulk merge stopped at its pass cap with small regions left.")
 
 
 class ConvertResponse(BaseModel):
 	"""
   Response payload for the conversion endpoint.
-	Images are base64-encoded PNGs, so the frontend can easily render or download them.
+	Images are base64-encoded PNGs (WebPs with raster_format=webp, under the same field names),
+	so the frontend can easily render or download them.
 	"""
 
-	worksheet_png: str = Field(..., description="Base64-encoded PNG of the worksheet (numbers + outline + legend).")
+	worksheet_png: Optional[str] = Field(None, description="Base64-encoded PNG of the worksheet (numbers + outline + legend), unless left out by outputs.")
 	preview_png: Optional[str] = Field(None, description="Base64-encoded PNG of the quantized preview (optional).")
 	labels_png: Optional[str] = Field(None, description="Base64-encoded PNG of the label map (optional/debug).")
 	legend_png: Optional[str] = Field(None, description="Base64-encoded PNG of the color legend (numbers and colors).")
+	worksheet_svg: Optional[str] = Field(None, description="Base64-encoded SVG of the worksheet (when return_svg).")
+	worksheet_pdf: Optional[str] = Field(None, description="Base64-encoded PDF of the worksheet (when return_pdf).")
+	meta: ImageMeta
+
+
+
+
+class PaletteColors(BaseModel):
+	"""Body of PUT /magic/palettes/{name}: colors in legend order."""
+
+	colors: List[Annotated[str, Field(pattern=HEX_COLOR)]] = Field(..., min_length=2, max_length=64)
+
+	@field_validator("colors")
+	@classmethod
+	def _lower_hex(cls, v):
+		return [c.lower() for c in v]
+
+
+SWEEP_AXES = ("colors", "merge_area", "min_area", "thickness", "outline_mode")
+
+
+class SweepRequest(BaseModel):
+	"""Option grid of a parameter sweep: every combination of the listed values is a variant."""
+
+	colors: List[Annotated[int, Field(ge=2, le=24)]] = Field([9], min_length=1)
+	merge_area: List[Annotated[int, Field(ge=1, le=100000)]] = Field([200], min_length=1)
+	min_area: List[Annotated[int, Field(ge=1, le=10000)]] = Field([80], min_length=1)
+	thickness: List[Annotated[int, Field(ge=1, le=10)]] = Field([2], min_length=1)
+	outline_mode: List[Literal["labels", "union"]] = Field(["union"], min_length=1)
+	max_size: Annotated[int, Field(1024, ge=128, le=4096)]
+	kmeans_sample: Annotated[int, Field(100000, ge=0, le=16_777_216)]
+	kmeans_space: Annotated[Literal["bgr", "lab"], Field("bgr")]
+	merge_engine: Annotated[Literal["pixel", "bulk"], Field("pixel")]
+	thumb_size: Annotated[int, Field(256, ge=64, le=1024, description="Longest side of the variant thumbnails.")]
+	thumbs: List[Literal["worksheet", "preview"]] = Field(["worksheet", "preview"], description="Thumbnails per variant (none = metadata only).")
+
+	@field_validator(*SWEEP_AXES, "thumbs")
+	@classmethod
+	def _sorted_unique(cls, v):
+		return sorted(set(v))
+
+	def variants(self) -> List[ConvertRequestOptions]:
+		"""One ConvertRequestOptions per combination, colors varying slowest."""
+		return [
+			ConvertRequestOptions(max_size=self.max_size, kmeans_sample=self.kmeans_sample, kmeans_space=self.kmeans_space, merge_engine=self.merge_engine,
+				**dict(zip(SWEEP_AXES, values)))
+			for values in itertools.product(*(getattr(self, axis) for axis in SWEEP_AXES))
+		]
+
+
+class SweepVariant(BaseModel):
+	options: Dict[str, int | str] = Field(..., description="The swept option values of this variant.")
 	meta: ImageMeta
+	worksheet_png: Optional[str] = Field(None, description="Base64-encoded PNG thumbnail of the worksheet.")
+	preview_png: Optional[str] = Field(None, description="Base64-encoded PNG thumbnail of the merged color regions.")
 
 
+class SweepResponse(BaseModel):
+	width: int = Field(..., ge=1)
+	height: int = Field(..., ge=1)
+	variants: List[SweepVariant]
+	timings: Dict[str, float] = Field(default_factory=dict, description="Wall ms per stage, summed over variants.")
@@ -0,0 +1,59 @@
+"""
+Deterministic synthetic test images for benchmarks.
+
+kinds:
+- flat: a few large flat-colored shapes (few regions)
+- gradient: smooth gradients with soft shapes
+- noisy: photo-like content, gradients + many small shapes + texture + sensor noise
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+KINDS = ("flat", "gradient", "noisy")
+
+
+def synthetic_image(size: int, kind: str = "noisy", seed: int = 0) -> np.ndarray:
+	"""BGR uint8 image of shape (size, round(size * 4 / 3), 3), same pixels for the same arguments."""
+	import cv2
+
+	if kind not in KINDS:
+		raise ValueError(f"Unknown image kind: {kind}")
+	rng = np.random.default_rng(seed)
+	h, w = size, max(1, round(size * 4 / 3))
+	if kind == "flat":
+		img = np.full((h, w, 3), 235, dtype=np.uint8)
+		n_shapes = 12
+	else:
+		yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+		yy /= max(1, h - 1)
+		xx /= max(1, w - 1)
+		img = np.stack([xx * 200 + 30, yy * 180 + 40, (1 - xx) * 120 + yy * 100], axis=-1)
+		img = np.clip(img, 0, 255).astype(np.uint8)
+		n_shapes = 20 if kind == "gradient" else 400
+	for _ in range(n_shapes):
+		color = tuple(int(c) for c in rng.integers(0, 256, 3))
+		cx, cy = int(rng.integers(0, w)), int(rng.integers(0, h))
+		r = int(rng.integers(max(2, size // 60), max(3, size // 6)))
+		if rng.random() < 0.5:
+			cv2.circle(img, (cx, cy), r, color, -1)
+		else:
+			cv2.rectangle(img, (cx - r, cy - r // 2), (cx + r, cy + r // 2), color, -1)
+	if kind == "gradient":
+		img = cv2.GaussianBlur(img, (0, 0), max(1.0, size / 128))
+	elif kind == "noisy":
+		texture = rng.normal(0, 1, (max(1, h // 8), max(1, w // 8), 3)).astype(np.float32)
+		texture = cv2.resize(texture, (w, h), interpolation=cv2.INTER_CUBIC) * 18
+		noise = rng.normal(0, 8, (h, w, 3)).astype(np.float32)
+		img = np.clip(img.astype(np.float32) + texture + noise, 0, 255).astype(np.uint8)
+	return img
+
+
+def encode_jpeg(img_bgr: np.ndarray, quality: int = 90) -> bytes:
+	import cv2
+
+	ok, buf = cv2.imencode(".jpg", img_bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+	if not ok:
+		raise RuntimeError("JPEG encoding failed")
+	return buf.tobytes()
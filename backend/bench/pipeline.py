@@ -0,0 +1,215 @@
+"""
+Per-stage benchmark of the ops pipeline, with regression gating.
+
+Run from the repo root:
+  python -m backend.bench.pipeline --sizes 256 1024 --kinds flat noisy --out bench.json
+  python -m backend.bench.pipeline --save-baseline backend/bench/baseline.json
+  python -m backend.bench.pipeline --baseline backend/bench/baseline.json --threshold 0.25
+
+Every case (image kind x size) starts from a deterministic synthetic JPEG 1.5x larger
+than max_size. Each stage is timed in isolation on the output of the previous stages
+(best of --repeat runs), then run once more under tracemalloc to report its peak
+memory (NumPy/OpenCV array allocations). "full" is render_worksheet_artifacts end to end.
+
+With --baseline, the exit code is 1 when any stage is slower than baseline by more
+than --threshold (relative) and --min-ms (absolute, to ignore timer noise).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from backend.api.schemas import ConvertRequestOptions
+from backend.bench.images import KINDS, encode_jpeg, synthetic_image
+from backend.ops.io import decode_image_bgr, downscale_max_side, encode_indexed
+from backend.ops.outline import outline_union
+from backend.ops.placing import place_numbers
+from backend.ops.quantize import quantize_bgr_kmeans
+from backend.ops.render import index_worksheet, legend_viz, worksheet_gray, worksheet_palette
+from backend.ops.segments import extract_regions, median_smooth_labels, merge_micro_regions
+from backend.ops.vector import trace_label_boundaries
+from backend.services.magic import render_worksheet_artifacts
+
+DEFAULT_SIZES = [256, 512, 1024, 2048, 4096]
+
+Stage = Tuple[str, Callable[[Dict], Dict]]
+
+
+def _stages(opts: ConvertRequestOptions) -> List[Stage]:
+	"""(name, fn) pairs; fn reads its inputs from ctx and returns the outputs to store."""
+
+	def decode(ctx):
+		return {"img_full": decode_image_bgr(ctx["jpeg"], max_side=opts.max_size)}
+
+	def downscale(ctx):
+		return {"img": downscale_max_side(ctx["img_full"], opts.max_size)}
+
+	def quantize(ctx):
+		q, labels, palette = quantize_bgr_kmeans(ctx["img"], opts.colors, sample_size=opts.kmeans_sample, space=opts.kmeans_space)
+		return {"quant": q, "labels_raw": labels, "palette": palette}
+
+	def smooth(ctx):
+		return {"labels_smooth": median_smooth_labels(ctx["labels_raw"], ksize=3)}
+
+	def merge(ctx):
+		return {"labels": merge_micro_regions(ctx["labels_smooth"], opts.merge_area, engine=opts.merge_engine)}
+
+	def outline(ctx):
+		return {"edges": outline_union(ctx["labels"], ctx["img"], thickness=opts.thickness)}
+
+	def regions(ctx):
+		return {"regions": extract_regions(ctx["labels"], opts.min_area)}
+
+	def placement(ctx):
+		return {"places": place_numbers(ctx["regions"], outline_mask=ctx["edges"], with_radius=True)}
+
+	def render(ctx):
+		sheet_palette = worksheet_palette(ctx["palette"])
+		gray = worksheet_gray(ctx["edges"], ctx["places"])
+		sheet = index_worksheet(gray, legend_viz(ctx["palette"], box_size=32), sheet_palette, ctx["palette"].shape[0], inplace=True)
+		return {"sheet": sheet, "sheet_palette": sheet_palette}
+
+	def encode(ctx):
+		return {"png": encode_indexed(ctx["sheet"], ctx["sheet_palette"], opts.raster_format, opts.compression)}
+
+	def vector(ctx):
+		return {"polylines": trace_label_boundaries(ctx["labels"])}
+
+	def full(ctx):
+		return {"artifacts": render_worksheet_artifacts(ctx["jpeg"], opts)}
+
+	return [
+		("decode", decode),
+		("downscale", downscale),
+		("quantize", quantize),
+		("smooth", smooth),
+		("merge", merge),
+		("outline", outline),
+		("regions", regions),
+		("placement", placement),
+		("render", render),
+		("encode", encode),
+		("vector", vector),
+		("full", full),
+	]
+
+
+def bench_case(kind: str, size: int, opts: ConvertRequestOptions, repeat: int = 3, seed: int = 0) -> Dict[str, Dict]:
+	"""Timings {stage: {"ms", "peak_mb"}} for one synthetic image."""
+	src = synthetic_image(int(size * 1.5), kind, seed=seed)
+	ctx: Dict = {"jpeg": encode_jpeg(src)}
+	del src
+	out: Dict[str, Dict] = {}
+	for name, fn in _stages(opts):
+		best = float("inf")
+		for _ in range(max(1, repeat)):
+			t0 = time.perf_counter()
+			produced = fn(ctx)
+			best = min(best, time.perf_counter() - t0)
+		tracemalloc.start()
+		base, _ = tracemalloc.get_traced_memory()
+		fn(ctx)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		ctx.update(produced)
+		out[name] = {"ms": round(best * 1000.0, 2), "peak_mb": round((peak - base) / 2**20, 2)}
+	out["_info"] = {"width": int(ctx["img"].shape[1]), "height": int(ctx["img"].shape[0]), "regions": len(ctx["regions"])}
+	return out
+
+
+def run(sizes: List[int], kinds: List[str], repeat: int, opts_overrides: Dict | None = None) -> Dict:
+	results: Dict[str, Dict] = {}
+	for kind in kinds:
+		for size in sizes:
+			opts = ConvertRequestOptions(max_size=size, **(opts_overrides or {}))
+			results[f"{kind}/{size}"] = bench_case(kind, size, opts, repeat=repeat)
+	import cv2
+
+	return {
+		"meta": {
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"opencv": cv2.__version__,
+			"machine": platform.machine(),
+			"platform": platform.platform(),
+			"repeat": repeat,
+		},
+		"results": results,
+	}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = 0.2, min_ms: float = 2.0) -> List[Dict]:
+	"""Stages slower than baseline by more than threshold (relative) and min_ms (absolute)."""
+	regressions = []
+	for case, stages in current["results"].items():
+		base_stages = baseline.get("results", {}).get(case)
+		if not base_stages:
+			continue
+		for stage, cur in stages.items():
+			if stage.startswith("_") or stage not in base_stages:
+				continue
+			base_ms = base_stages[stage]["ms"]
+			if cur["ms"] > base_ms * (1.0 + threshold) and cur["ms"] - base_ms > min_ms:
+				regressions.append({
+					"case": case,
+					"stage": stage,
+					"baseline_ms": base_ms,
+					"ms": cur["ms"],
+					"ratio": round(cur["ms"] / base_ms, 3) if base_ms else float("inf"),
+				})
+	return regressions
+
+
+def print_table(report: Dict) -> None:
+	for case, stages in report["results"].items():
+		info = stages.get("_info", {})
+		print(f"\n{case}  ({info.get('width')}x{info.get('height')}, {info.get('regions')} regions)")
+		print(f"  {'stage':<16}{'ms':>10}{'peak MB':>10}")
+		for stage, r in stages.items():
+			if stage.startswith("_"):
+				continue
+			print(f"  {stage:<16}{r['ms']:>10.1f}{r['peak_mb']:>10.1f}")
+
+
+def main(argv: List[str] | None = None) -> int:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+	parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--colors", type=int, default=9)
+	parser.add_argument("--out", help="Write results JSON here.")
+	parser.add_argument("--save-baseline", help="Write results JSON here as the new baseline.")
+	parser.add_argument("--baseline", help="Compare against this baseline JSON and fail on regressions.")
+	parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown per stage (0.2 = 20%%).")
+	parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore slowdowns smaller than this many ms.")
+	args = parser.parse_args(argv)
+
+	report = run(args.sizes, args.kinds, args.repeat, {"colors": args.colors})
+	print_table(report)
+	for path in (args.out, args.save_baseline):
+		if path:
+			with open(path, "w", encoding="utf-8") as f:
+				json.dump(report, f, indent=2)
+	if args.baseline:
+		with open(args.baseline, encoding="utf-8") as f:
+			baseline = json.load(f)
+		regressions = compare(report, baseline, args.threshold, args.min_ms)
+		if regressions:
+			print(f"\n{len(regressions)} stage(s) regressed past {args.threshold:.0%}:")
+			for r in regressions:
+				print(f"  {r['case']:<16}{r['stage']:<16}{r['baseline_ms']:>9.1f} -> {r['ms']:.1f} ms ({r['ratio']}x)")
+			return 1
+		print("\nNo regressions against baseline.")
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Benchmark: full k-means vs sampled fit + vectorized assignment.
+
+Run from the repo root:
+  python -m backend.bench.quantize [--sizes 512 1024 2048] [--colors 9]
+
+For each image and size it reports fit time and palette quality (mean squared
+error between the quantized and original image, lower is better) for the full
+fit and for each sample size.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from backend.bench.images import synthetic_image
+from backend.ops.quantize import quantize_bgr_kmeans
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def _photo(size: int) -> np.ndarray | None:
+	import cv2
+
+	path = ROOT / "img" / "chicken_joe.jpg"
+	img = cv2.imread(str(path), cv2.IMREAD_COLOR)
+	if img is None:
+		return None
+	h, w = img.shape[:2]
+	scale = size / float(max(h, w))
+	return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _mse(a: np.ndarray, b: np.ndarray) -> float:
+	d = a.astype(np.float32) - b.astype(np.float32)
+	return float((d * d).mean())
+
+
+def run(sizes: list[int], colors: int, samples: list[int], space: str) -> list[dict]:
+	rows = []
+	for size in sizes:
+		for name, img in (("photo", _photo(size)), ("noisy", synthetic_image(size, "noisy"))):
+			if img is None:
+				continue
+			for sample in [0] + samples:
+				t0 = time.perf_counter()
+				quant, _, _ = quantize_bgr_kmeans(img, colors, sample_size=sample, space=space)
+				elapsed = (time.perf_counter() - t0) * 1000.0
+				rows.append({
+					"image": name,
+					"size": size,
+					"pixels": int(img.shape[0] * img.shape[1]),
+					"sample": sample,
+					"ms": round(elapsed, 1),
+					"mse": round(_mse(quant, img), 2),
+				})
+	return rows
+
+
+def main(argv: list[str] | None = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1024, 2048])
+	parser.add_argument("--colors", type=int, default=9)
+	parser.add_argument("--samples", type=int, nargs="+", default=[20000, 100000])
+	parser.add_argument("--space", choices=["bgr", "lab"], default="bgr")
+	args = parser.parse_args(argv)
+	rows = run(args.sizes, args.colors, args.samples, args.space)
+	print(f"{'image':<16}{'size':>6}{'sample':>9}{'ms':>10}{'mse':>10}{'mse vs full':>13}")
+	full = {}
+	for r in rows:
+		key = (r["image"], r["size"])
+		if r["sample"] == 0:
+			full[key] = r["mse"]
+		ratio = r["mse"] / full[key] if full.get(key) else 1.0
+		print(f"{r['image']:<16}{r['size']:>6}{r['sample'] or 'all':>9}{r['ms']:>10}{r['mse']:>10}{ratio:>12.3f}x")
+
+
+if __name__ == "__main__":
+	main()
@@ -1 +1,93 @@
-#constants/environments
\ No newline at end of file
+#constants/environments
+"""
+Runtime settings, read once from environment variables (with defaults).
+
+- MAGIC_CACHE_MEMORY_BYTES: in-memory result cache budget (0 disables it)
+- MAGIC_CACHE_DIR: directory for the on-disk result cache (unset disables it)
+- MAGIC_CACHE_DISK_BYTES: on-disk result cache budget
+- MAGIC_EXECUTOR: "thread" (default) or "process" pool for conversions
+- MAGIC_WORKERS: number of conversion workers (default: CPU count, max 8)
+- MAGIC_QUEUE_DEPTH: conversions allowed to wait for a worker before 503 (default: 2 x workers)
+- MAGIC_CV_THREADS: OpenCV/BLAS threads per conversion worker (default: CPU count / workers,
+  at least 1)
+- MAGIC_WARMUP: convert a synthetic image on every worker before /ready reports ready (default 1)
+- MAGIC_WARMUP_TIMEOUT: seconds the workers get to start (and warm up) before /ready reports
+  the start-up as failed (default 120)
+- MAGIC_MEMORY_BUDGET_MB: memory shared by the conversions in flight (default: half the
+  physical memory, 0 disables admission control)
+- MAGIC_ADMISSION_TIMEOUT: seconds a conversion may wait for memory before 503 (default 30)
+- MAGIC_BATCH_MAX_FILES: max images per /magic/convert/batch request (default 50)
+- MAGIC_SWEEP_MAX_VARIANTS: max option combinations per /magic/sweep request (default 48)
+- MAGIC_PALETTES_MAX: user palettes kept by the /magic/palettes registry (default 256)
+- MAGIC_FRAMES_MAX: max frames converted per /magic/convert/frames request (default 300)
+- MAGIC_PROFILE_ALLOWED: enable profiling: the X-Magic-Profile: 1 request header and
+  MAGIC_PROFILE_SAMPLE_RATE (default 0, opt-in)
+- MAGIC_PROFILE_SAMPLE_RATE: fraction of conversions profiled at random (default 0)
+- MAGIC_PROFILE_DIR: where folded-stack profiles are written (default: <tmp>/magic-profiles)
+- MAGIC_PROFILE_MAX_FILES: profiles kept in MAGIC_PROFILE_DIR, older ones deleted (default 100)
+- MAGIC_JOBS_STORE: "memory" (default) or "disk" store for /magic/jobs records and results
+- MAGIC_JOBS_DIR: directory of the disk job store (default: <tmp>/magic-jobs)
+- MAGIC_JOBS_TTL: seconds a finished job and its result are kept (default 3600)
+- MAGIC_JOBS_MAX_QUEUED: jobs allowed to wait for a worker before 503 (default 64)
+- MAGIC_JOBS_MEMORY_BYTES: results kept by the memory job store, oldest evicted first (default 256 MiB)
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+
+
+def env_int(name: str, default: int) -> int:
+	value = os.environ.get(name)
+	if value is None or value.strip() == "":
+		return default
+	try:
+		return int(value)
+	except ValueError:
+		raise ValueError(f"Environment variable {name} must be an integer, got {value!r}")
+
+
+def env_str(name: str, default: str | None = None) -> str | None:
+	value = os.environ.get(name)
+	if value is None or value.strip() == "":
+		return default
+	return value
+
+
+CACHE_MEMORY_BYTES = env_int("MAGIC_CACHE_MEMORY_BYTES", 256 * 1024 * 1024)
+CACHE_DIR = env_str("MAGIC_CACHE_DIR")
+CACHE_DISK_BYTES = env_int("MAGIC_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024)
+
+EXECUTOR_KIND = env_str("MAGIC_EXECUTOR", "thread")
+EXECUTOR_WORKERS = max(1, env_int("MAGIC_WORKERS", min(8, os.cpu_count() or 1)))
+EXECUTOR_QUEUE_DEPTH = max(0, env_int("MAGIC_QUEUE_DEPTH", 2 * EXECUTOR_WORKERS))
+CV_THREADS = max(1, env_int("MAGIC_CV_THREADS", (os.cpu_count() or 1) // EXECUTOR_WORKERS))
+WARMUP = env_int("MAGIC_WARMUP", 1) != 0
+WARMUP_TIMEOUT_SECONDS = max(1, env_int("MAGIC_WARMUP_TIMEOUT", 120))
+
+def _half_physical_memory_mb() -> int:
+	try:
+		return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**21
+	except (AttributeError, ValueError, OSError):
+		return 0
+
+
+MEMORY_BUDGET_MB = max(0, env_int("MAGIC_MEMORY_BUDGET_MB", _half_physical_memory_mb()))
+ADMISSION_TIMEOUT_SECONDS = max(0, env_int("MAGIC_ADMISSION_TIMEOUT", 30))
+
+BATCH_MAX_FILES = max(1, env_int("MAGIC_BATCH_MAX_FILES", 50))
+SWEEP_MAX_VARIANTS = max(1, env_int("MAGIC_SWEEP_MAX_VARIANTS", 48))
+PALETTES_MAX = max(0, env_int("MAGIC_PALETTES_MAX", 256))
+FRAMES_MAX = max(1, env_int("MAGIC_FRAMES_MAX", 300))
+
+PROFILE_ALLOWED = env_int("MAGIC_PROFILE_ALLOWED", 0) != 0
+PROFILE_SAMPLE_RATE = float(env_str("MAGIC_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = env_str("MAGIC_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "magic-profiles"))
+PROFILE_MAX_FILES = max(1, env_int("MAGIC_PROFILE_MAX_FILES", 100))
+
+JOBS_STORE = env_str("MAGIC_JOBS_STORE", "memory")
+JOBS_DIR = env_str("MAGIC_JOBS_DIR", os.path.join(tempfile.gettempdir(), "magic-jobs"))
+JOBS_TTL_SECONDS = max(1, env_int("MAGIC_JOBS_TTL", 3600))
+JOBS_MAX_QUEUED = max(0, env_int("MAGIC_JOBS_MAX_QUEUED", 64))
+JOBS_MEMORY_BYTES = max(0, env_int("MAGIC_JOBS_MEMORY_BYTES", 256 * 1024 * 1024))
@@ -10,6 +10,8 @@ When executed directly, we add the project root to sys.path so that
 
 import os
 import sys
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 if __package__ in (None, ""):
@@ -17,18 +19,43 @@ if __package__ in (None, ""):
   if ROOT not in sys.path:
     sys.path.insert(0, ROOT)
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+#startup cost: everything imported from here until the app exists (reported by /ready)
+_IMPORT_T0 = time.perf_counter()
+
+#before anything imports numpy: BLAS reads its thread count once, at load time
+from backend.services.startup import limit_native_threads, readiness, warm_up
+limit_native_threads()
+
+import asyncio
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-import cv2
-import numpy as np
-from io import BytesIO
-from PIL import Image
+from fastapi.responses import PlainTextResponse
 
 #note: Uvicorn discovers the app through the "backend.main:app" syntax
 #meaning is that it's looking for the "app" object in "backend.main"
 from backend.api.routes import router
+from backend.services.admission import memory_admission
+from backend.services.cache import result_cache
+from backend.services.executor import conversion_executor
+from backend.services.jobs import job_manager
+from backend.services.metrics import CallbackGauge, in_flight, registry, request_seconds, requests_total
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  #start conversion workers before serving, stop them on shutdown
+  conversion_executor.start()
+  job_manager.start()
+  #workers spin up and warm up in the background: /health answers at once, /ready once all are warm
+  warming = asyncio.create_task(warm_up(conversion_executor, readiness))
+  yield
+  warming.cancel()
+  await job_manager.shutdown()
+  conversion_executor.shutdown()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
   CORSMiddleware,
@@ -39,6 +66,60 @@ app.add_middleware(
 
 app.include_router(router) #inlucde the router in the app, litteraly
 
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+  route = request.url.path if request.url.path in ROUTE_PATHS else "other"
+  in_flight.inc(route=route)
+  t0 = time.perf_counter()
+
+  def finish(status: int):
+    in_flight.dec(route=route)
+    #parametrized routes (/magic/jobs/{job_id}) are labelled by their template once matched
+    matched = request.scope.get("route")
+    label = matched.path if route == "other" and getattr(matched, "path", None) in ROUTE_PATHS else route
+    requests_total.inc(route=label, status=str(status))
+    request_seconds.observe(time.perf_counter() - t0, route=label)
+
+  try:
+    response = await call_next(request)
+  except BaseException:
+    finish(500)
+    raise
+  body = response.body_iterator
+
+  async def observed_body():
+    #streaming routes (batch, stream, frames, zip/multipart) do their work while the body goes out
+    try:
+      async for chunk in body:
+        yield chunk
+    finally:
+      finish(response.status_code)
+
+  response.body_iterator = observed_body()
+  return response
+
+
+registry.register(CallbackGauge("magic_cache", "Result cache counters and sizes.", ("stat",),
+  lambda: {(k,): float(v) for k, v in result_cache.stats().items()}))
+registry.register(CallbackGauge("magic_jobs", "Job queue counters.", ("stat",),
+  lambda: {(k,): float(v) for k, v in job_manager.stats().items()}))
+registry.register(CallbackGauge("magic_admission", "Memory admission budget, usage and outcomes.", ("stat",),
+  lambda: {(k,): float(v) for k, v in memory_admission.stats().items()}))
+registry.register(CallbackGauge("magic_executor", "Conversion pool state.", ("stat",),
+  lambda: {(k,): float(v) for k, v in conversion_executor.stats().items() if isinstance(v, (int, float))}))
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+  """Prometheus text exposition."""
+  return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+#metrics: label requests by route path, anything unknown is "other" (bounded cardinality)
+ROUTE_PATHS = {getattr(r, "path", "") for r in app.routes}
+
+readiness.mark("imports", time.perf_counter() - _IMPORT_T0)
+
 #dev mode: simple way to execute main.py
 if __name__ == "__main__":
   try:
@@ -0,0 +1,229 @@
+"""
+Number rendering from a glyph atlas.
+
+Numbers are rasterized once per font scale (anti-aliased putText on a black tile, cropped
+to the ink), then laid out and stamped in bulk:
+
+- layout: largest regions first, each number centered on its placement point at the largest
+  scale that fits the region's inscribed radius. A candidate box is rejected when it covers
+  an outline pixel or another number (grid index); the number then tries shifted positions
+  and smaller scales. A number that only fits over an outline is drawn there anyway. One
+  with no spot clear of other numbers is never dropped: it overflows, at the smallest scale
+  centered on its point (the region's pole), over whatever is there.
+- stamping: laid out boxes never overlap, so all copies of a glyph are blended with one
+  fancy-indexed np.minimum (black text over a white page: min(page, 255 - coverage));
+  overflowing numbers are blended one by one.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+#putText scales, largest (the default number size) first
+FONT_SCALES = (0.5, 0.42, 0.35, 0.3)
+#numbers in each atlas: the largest palette (64 colors)
+ATLAS_NUMBERS = 64
+#page pixels darker than this are outlines
+_INK = 128
+
+
+def _rasterize(number: int, scale: float) -> np.ndarray:
+	import cv2
+
+	text = str(number)
+	(tw, th), base = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 1)
+	tile = np.zeros((th + base + 4, tw + 4), dtype=np.uint8)
+	cv2.putText(tile, text, (2, th + 2), cv2.FONT_HERSHEY_SIMPLEX, scale, 255, thickness=1, lineType=cv2.LINE_AA)
+	ys, xs = np.nonzero(tile)
+	glyph = cv2.bitwise_not(tile[ys.min():ys.max() + 1, xs.min():xs.max() + 1])
+	glyph.setflags(write=False)
+	return glyph
+
+
+@lru_cache(maxsize=len(FONT_SCALES))
+def glyph_atlas(scale: float) -> Tuple[np.ndarray, ...]:
+	"""Inverted coverage (255 - alpha) of 1..ATLAS_NUMBERS at scale, cropped to the ink."""
+	return tuple(_rasterize(n, scale) for n in range(1, ATLAS_NUMBERS + 1))
+
+
+@lru_cache(maxsize=256)
+def _glyph_beyond_atlas(number: int, scale: float) -> np.ndarray:
+	return _rasterize(number, scale)
+
+
+def glyph(number: int, scale: float) -> np.ndarray:
+	if 1 <= number <= ATLAS_NUMBERS:
+		return glyph_atlas(scale)[number - 1]
+	return _glyph_beyond_atlas(number, scale)
+
+
+def _box_pixels(x0: np.ndarray, y0: np.ndarray, gh: int, gw: int, w: int) -> np.ndarray:
+	"""Flat indices (row-major, image width w) of the pixels of gh x gw boxes at (x0, y0)."""
+	offsets = (np.arange(gh, dtype=np.intp)[:, None] * w + np.arange(gw, dtype=np.intp)).ravel()
+	return ((y0.astype(np.intp) * w + x0)[:, None] + offsets).ravel()
+
+
+#box shifts tried around a placement point, in half box sizes: centered first
+_SHIFTS = ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1))
+#where boxes are sampled for outline pixels when picking the starting position, in box fractions
+_SAMPLES = (1 / 6, 1 / 2, 5 / 6)
+
+
+def _candidates(x: int, y: int, gw: int, gh: int, w: int, h: int):
+	"""Top-left corners of gw x gh boxes containing (x, y): centered first, then shifted."""
+	seen = set()
+	for dx, dy in _SHIFTS:
+		x0 = min(max(0, x - gw // 2 + dx * (gw // 2)), w - gw)
+		y0 = min(max(0, y - gh // 2 + dy * (gh // 2)), h - gh)
+		if (x0, y0) not in seen and x0 <= x < x0 + gw and y0 <= y < y0 + gh:
+			seen.add((x0, y0))
+			yield x0, y0
+
+
+def _start_boxes(ink: np.ndarray, x: np.ndarray, y: np.ndarray, bw: np.ndarray, bh: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Top-left corners, among the _SHIFTS boxes containing each point, of the one with the
+	fewest outline pixels on a 3 x 3 sample grid (the centered one on ties).
+	"""
+	h, w = ink.shape[:2]
+	shifts = np.array(_SHIFTS, dtype=np.intp)
+	x0 = np.clip(x[:, None] - bw[:, None] // 2 + shifts[None, :, 0] * (bw[:, None] // 2), 0, np.maximum(0, w - bw)[:, None])
+	y0 = np.clip(y[:, None] - bh[:, None] // 2 + shifts[None, :, 1] * (bh[:, None] // 2), 0, np.maximum(0, h - bh)[:, None])
+	frac = np.array(_SAMPLES)
+	sx = np.minimum(w - 1, x0[..., None, None] + (bw[:, None, None, None] * frac[None, None, None, :]).astype(np.intp))
+	sy = np.minimum(h - 1, y0[..., None, None] + (bh[:, None, None, None] * frac[None, None, :, None]).astype(np.intp))
+	dark = (ink[sy, sx] < _INK).sum(axis=(2, 3))
+	inside = (x0 <= x[:, None]) & (x[:, None] < x0 + bw[:, None]) & (y0 <= y[:, None]) & (y[:, None] < y0 + bh[:, None])
+	pick = np.where(inside, dark, np.iinfo(np.intp).max).argmin(axis=1)
+	rows = np.arange(x.size)
+	return x0[rows, pick], y0[rows, pick]
+
+
+def _overlapping(x0: np.ndarray, y0: np.ndarray, x1: np.ndarray, y1: np.ndarray, cell: int) -> np.ndarray:
+	"""Mask of the boxes overlapping another one. Boxes are binned by their top-left corner in
+	cells at least as large as any box, so overlapping boxes sit in the same or adjacent cells.
+	"""
+	n = x0.size
+	cx, cy = x0 // cell + 1, y0 // cell + 1
+	stride = int(cx.max()) + 2
+	key = cy * stride + cx
+	order = np.argsort(key, kind="stable")
+	sorted_key = key[order]
+	#candidate pairs (i, j): j in one of the 9 cells around i's cell
+	nkey = (key[None, :] + (np.arange(-1, 2)[:, None, None] * stride + np.arange(-1, 2)[None, :, None]).reshape(9, 1)).ravel()
+	lo = np.searchsorted(sorted_key, nkey, "left")
+	counts = np.searchsorted(sorted_key, nkey, "right") - lo
+	i = np.repeat(np.tile(np.arange(n), 9), counts)
+	j = order[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(i.size)]
+	over = (i != j) & (x0[i] < x1[j]) & (x0[j] < x1[i]) & (y0[i] < y1[j]) & (y0[j] < y1[i])
+	hit = np.zeros(n, dtype=np.bool_)
+	hit[i[over]] = True
+	return hit
+
+
+def layout_numbers(page: np.ndarray, placements: Sequence[tuple]) -> Tuple[List[Tuple[int, int, int, float]], List[Tuple[int, int, int, float]]]:
+	"""(layout, overflow): (x0, y0, number, scale) of every number to stamp on page, the
+	non-overlapping ones and those that overflow onto other numbers (see module docstring).
+	placements: (x, y, label) or (x, y, label, inscribed radius) tuples.
+
+	Starting boxes (first-fit scale, least outline around the point) are picked and checked
+	for overlaps all at once; only the overlapping numbers go through the search, largest
+	regions first.
+	"""
+	h, w = page.shape[:2]
+	if not placements:
+		return [], []
+	pts = np.array([tuple(p) if len(p) > 3 else (*p, np.inf) for p in placements], dtype=np.float64)
+	x, y, numbers, radius = pts[:, 0].astype(np.intp), pts[:, 1].astype(np.intp), pts[:, 2].astype(np.intp) + 1, pts[:, 3]
+	#(scales, numbers) glyph sizes
+	dims = np.array([[glyph(int(n), s).shape for n in range(1, int(numbers.max()) + 1)] for s in FONT_SCALES])
+	gh, gw = dims[..., 0][:, numbers - 1], dims[..., 1][:, numbers - 1]
+	#first scale whose glyph fits in the inscribed circle, the smallest one when none does
+	fits = np.hypot(gh, gw) / 2 <= radius[None, :]
+	roomy = fits.any(axis=0)
+	first = np.where(roomy, fits.argmax(axis=0), len(FONT_SCALES) - 1)
+	cols = np.arange(numbers.size)
+	bh, bw = gh[first, cols], gw[first, cols]
+	keep = (bw <= w) & (bh <= h)
+	ink = page if page.ndim == 2 else page[..., 0]
+	bx0, by0 = _start_boxes(ink, x, y, bw, bh)
+	bx1, by1 = bx0 + bw, by0 + bh
+	cell = int(max(dims[..., 0].max(), dims[..., 1].max()))
+	crowded = _overlapping(bx0, by0, bx1, by1, cell) & keep
+	settled = keep & ~crowded
+	out = [(a, b, n, FONT_SCALES[f]) for a, b, n, f in zip(bx0[settled].tolist(), by0[settled].tolist(), numbers[settled].tolist(), first[settled].tolist())]
+	if not crowded.any():
+		return out, []
+
+	#occupancy of the settled boxes, then the crowded numbers one by one, largest regions first
+	taken = np.zeros((h, w), dtype=np.bool_)
+	flat_taken = taken.reshape(-1)
+	sizes = bh * 4096 + bw
+	for size in np.unique(sizes[settled]).tolist():
+		sel = settled & (sizes == size)
+		flat_taken[_box_pixels(bx0[sel], by0[sel], size // 4096, size % 4096, w)] = True
+	idx = np.flatnonzero(crowded)
+	overflow = []
+	for i in idx[np.argsort(-radius[idx], kind="stable")].tolist():
+		clear = over_outline = None
+		for f in range(int(first[i]), len(FONT_SCALES)):
+			sh, sw = int(gh[f, i]), int(gw[f, i])
+			if sw > w or sh > h:
+				continue
+			for x0, y0 in _candidates(int(x[i]), int(y[i]), sw, sh, w, h):
+				if taken[y0:y0 + sh, x0:x0 + sw].any():
+					continue
+				#no scale fits a tight region: no clean spot to look for
+				if not roomy[i] or ink[y0:y0 + sh, x0:x0 + sw].min() >= _INK:
+					clear = (x0, y0, sw, sh, FONT_SCALES[f])
+					break
+				if over_outline is None:
+					over_outline = (x0, y0, sw, sh, FONT_SCALES[f])
+			if clear is not None:
+				break
+		chosen = clear or over_outline
+		if chosen is None:
+			#no room left around the point: smallest scale on the pole, over the other numbers
+			sh, sw = int(gh[-1, i]), int(gw[-1, i])
+			if sw > w or sh > h:
+				continue
+			x0 = min(max(0, int(x[i]) - sw // 2), w - sw)
+			y0 = min(max(0, int(y[i]) - sh // 2), h - sh)
+			taken[y0:y0 + sh, x0:x0 + sw] = True
+			overflow.append((x0, y0, int(numbers[i]), FONT_SCALES[-1]))
+			continue
+		x0, y0, sw, sh, scale = chosen
+		taken[y0:y0 + sh, x0:x0 + sw] = True
+		out.append((x0, y0, int(numbers[i]), scale))
+	return out, overflow
+
+
+def stamp_numbers(page: np.ndarray, layout: Sequence[Tuple[int, int, int, float]],
+		overflow: Sequence[Tuple[int, int, int, float]] = ()) -> np.ndarray:
+	"""Blend the glyphs of layout_numbers onto page in place, one vectorized blit per glyph
+	for layout, one blit per number for overflow (its boxes may overlap)."""
+	w = page.shape[1]
+	groups: Dict[Tuple[int, float], List[Tuple[int, int]]] = defaultdict(list)
+	for x0, y0, number, scale in layout:
+		groups[(number, scale)].append((x0, y0))
+	for (number, scale), corners in groups.items():
+		g = glyph(number, scale)
+		gh, gw = g.shape
+		xy = np.asarray(corners, dtype=np.intp)
+		flat = _box_pixels(xy[:, 0], xy[:, 1], gh, gw, w)
+		ink = np.tile(g.ravel(), len(corners))
+		if page.ndim == 2:
+			pixels = page.reshape(-1)
+			pixels[flat] = np.minimum(pixels[flat], ink)
+		else:
+			pixels = page.reshape(-1, page.shape[2])
+			pixels[flat] = np.minimum(pixels[flat], ink[:, None])
+	for x0, y0, number, scale in overflow:
+		g = glyph(number, scale)
+		gh, gw = g.shape
+		roi = page[y0:y0 + gh, x0:x0 + gw]
+		np.minimum(roi, g if page.ndim == 2 else g[..., None], out=roi)
+	return page
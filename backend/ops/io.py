@@ -6,7 +6,7 @@ from __future__ import annotations
 
 import base64
 from io import BytesIO
-from typing import Tuple
+from typing import Iterator, Tuple
 
 import numpy as np
 from PIL import Image, ImageOps, ImageFile, UnidentifiedImageError
@@ -14,6 +14,8 @@ from PIL import Image, ImageOps, ImageFile, UnidentifiedImageError
 # Allow loading truncated JPEGs
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+_EXIF_ORIENTATION = 0x0112
+
 
 def decode_image_bytes(data: bytes, *, max_bytes: int = 50 * 1024 * 1024) -> Image.Image:
 	"""Decode bytes into a PIL RGB image and apply EXIF orientation.
@@ -49,14 +51,145 @@ def decode_image_bytes(data: bytes, *, max_bytes: int = 50 * 1024 * 1024) -> Ima
 
 
 def pil_to_numpy_bgr(img: Image.Image) -> np.ndarray:
-	"""Convert PIL (RGB) to NumPy BGR uint8."""
-	arr = np.asarray(img)  #RGB
+	"""Convert PIL (RGB) to NumPy BGR uint8.
+	RGB images are written out directly in BGR order by Pillow (a single copy).
+	"""
+	if img.mode == "RGB":
+		w, h = img.size
+		return np.frombuffer(img.tobytes("raw", "BGR"), dtype=np.uint8).reshape((h, w, 3))
+	arr = np.asarray(img)
 	if arr.ndim == 2:  #grayscale
 		arr = np.stack([arr, arr, arr], axis=-1)
 	#RGB -> BGR
 	return arr[..., ::-1].copy()
 
 
+def _draft_size(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+	"""Smallest (w, h) the JPEG decoder may reduce to while keeping max side >= max_side."""
+	w, h = size
+	scale = min(1.0, float(max_side) / float(max(w, h)))
+	return max(1, int(np.ceil(w * scale))), max(1, int(np.ceil(h * scale)))
+
+
+#bytes per pixel of Pillow's decoded image, by mode (3-band images are stored as 4 bytes; anything else: 4)
+_MODE_BYTES = {"1": 1, "L": 1, "P": 1, "I;16": 2}
+
+
+class ImageProbe:
+	"""What the header of an upload declares, read without decoding any pixel data."""
+
+	__slots__ = ("format", "width", "height", "mode", "frames")
+
+	def __init__(self, format: str | None, width: int, height: int, mode: str, frames: int = 1):
+		self.format = format
+		self.width = width
+		self.height = height
+		self.mode = mode
+		self.frames = frames
+
+	@property
+	def bytes_per_px(self) -> int:
+		return _MODE_BYTES.get(self.mode, 4)
+
+	def decoded_size(self, max_side: int | None = None) -> Tuple[int, int]:
+		"""(w, h) decode_image_bgr will decode to: JPEGs shrink by the largest DCT scale
+		(1/2, 1/4, 1/8) that keeps max_side, like Pillow's draft(); other formats decode in full.
+		"""
+		if not max_side or self.format != "JPEG":
+			return self.width, self.height
+		rw, rh = _draft_size((self.width, self.height), max_side)
+		for scale in (8, 4, 2):
+			w, h = -(-self.width // scale), -(-self.height // scale)
+			if w >= rw and h >= rh:
+				return w, h
+		return self.width, self.height
+
+
+def probe_image(data: bytes) -> ImageProbe | None:
+	"""Header-only probe (size, mode, frame count); None when Pillow cannot identify the data.
+	Raises ValueError for images past Pillow's decompression-bomb limit.
+	"""
+	try:
+		img = Image.open(BytesIO(data))
+	except Image.DecompressionBombError as e:
+		raise ValueError(f"Image too large: {e}")
+	except Exception:
+		return None
+	w, h = img.size
+	return ImageProbe(img.format, w, h, img.mode, int(getattr(img, "n_frames", 1) or 1))
+
+
+def decode_image_bgr(data: bytes, max_side: int | None = None, *, max_bytes: int = 50 * 1024 * 1024) -> np.ndarray:
+	"""Decode bytes straight into a BGR uint8 array, with EXIF orientation applied.
+
+	When max_side is given, JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8)
+	that still keeps the longest side >= max_side; downscale_max_side does the rest.
+	The orientation is applied on the reduced image, nothing is decoded twice.
+	The returned array may be read-only. Raises ValueError on invalid data.
+	"""
+	if not data:
+		raise ValueError("No data received")
+	if len(data) > max_bytes:
+		raise ValueError("File too large. Please upload an image under 50 MB.")
+	try:
+		img = Image.open(BytesIO(data))
+		if max_side and img.format == "JPEG":
+			#header is parsed already, draft() only configures the decoder (mode + scale)
+			img.draft("RGB", _draft_size(img.size, max_side))
+		#exif_transpose copies even when there is nothing to do, so only call it when needed
+		if img.getexif().get(_EXIF_ORIENTATION, 1) != 1:
+			img = ImageOps.exif_transpose(img)
+		if img.mode != "RGB":
+			img = img.convert("RGB")
+		return pil_to_numpy_bgr(img)
+	except UnidentifiedImageError:
+		return _decode_with_opencv(data)
+	except Exception as e:
+		raise ValueError(f"Invalid image data: {e}")
+
+
+def iter_frames_bgr(data: bytes, max_frames: int | None = None, *, max_bytes: int = 50 * 1024 * 1024) -> Iterator[np.ndarray]:
+	"""Frames of an animated GIF/WebP or a multi-page TIFF as BGR uint8 arrays, decoded one
+	at a time (a still image is one frame). Raises ValueError on invalid data.
+	"""
+	if not data:
+		raise ValueError("No data received")
+	if len(data) > max_bytes:
+		raise ValueError("File too large. Please upload an image under 50 MB.")
+	try:
+		img = Image.open(BytesIO(data))
+		n = int(getattr(img, "n_frames", 1) or 1)
+	except UnidentifiedImageError:
+		yield _decode_with_opencv(data)
+		return
+	except Exception as e:
+		raise ValueError(f"Invalid image data: {e}")
+	for i in range(n if max_frames is None else min(n, max_frames)):
+		try:
+			img.seek(i)
+			frame = ImageOps.exif_transpose(img) if img.getexif().get(_EXIF_ORIENTATION, 1) != 1 else img
+			frame = frame.convert("RGB") if frame.mode != "RGB" else frame
+			bgr = pil_to_numpy_bgr(frame)
+		except Exception as e:
+			raise ValueError(f"Invalid image data (frame {i}): {e}")
+		del frame
+		yield bgr
+
+
+def _decode_with_opencv(data: bytes) -> np.ndarray:
+	"""Fallback decoder for what Pillow cannot identify."""
+	import cv2  # lazy
+
+	try:
+		arr = np.frombuffer(data, dtype=np.uint8)
+		bgr = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+		if bgr is None:
+			raise ValueError("Could not decode image (cv2 returned None)")
+		return bgr
+	except Exception as ee:
+		raise ValueError(f"Invalid image data (Pillow+OpenCV failed): {ee}")
+
+
 def downscale_max_side(img_bgr: np.ndarray, max_side: int) -> np.ndarray:
 	"""Downscale to ensure max(height, width) <= max_side, keep aspect ratio."""
 	h, w = img_bgr.shape[:2]
@@ -70,8 +203,14 @@ def downscale_max_side(img_bgr: np.ndarray, max_side: int) -> np.ndarray:
 	return cv2.resize(img_bgr, (new_w, new_h), interpolation=cv2.INTER_AREA)
 
 
-def encode_png_base64(img: np.ndarray) -> str:
-	"""Encode BGR/RGB/Gray image to base64-encoded PNG string."""
+#raster artifact formats; "webp" is lossless WebP
+RASTER_FORMATS = ("png", "webp")
+
+
+def encode_png(img: np.ndarray, compression: int | None = None) -> bytes:
+	"""Encode BGR/RGB/Gray image to PNG bytes (a single copy of the cv2.imencode buffer).
+	compression: zlib level 0..9, None for OpenCV's speed-tuned default.
+	"""
 	import cv2
 
 	if img.ndim == 3 and img.shape[2] == 3:
@@ -81,7 +220,54 @@ def encode_png_base64(img: np.ndarray) -> str:
 	else:
 		raise ValueError("Unsupported image shape for PNG encoding")
 
-	ok, buf = cv2.imencode(".png", bgr)
+	params = [cv2.IMWRITE_PNG_COMPRESSION, compression] if compression is not None else []
+	ok, buf = cv2.imencode(".png", bgr, params)
 	if not ok:
 		raise RuntimeError("PNG encoding failed")
-	return base64.b64encode(buf.tobytes()).decode("ascii")
+	return buf.tobytes()
+
+
+def png_bits(colors: int) -> int:
+	"""Fewest bits per pixel of a palette PNG with that many colors (1, 2, 4 or 8)."""
+	for bits in (1, 2, 4):
+		if colors <= 1 << bits:
+			return bits
+	return 8
+
+
+def _webp_effort(compression: int) -> dict:
+	#lossless WebP: quality is the compression effort, method the speed/size trade-off (0..6)
+	return {"lossless": True, "quality": round(compression * 100 / 9), "method": round(compression * 6 / 9)}
+
+
+def encode_indexed(indices: np.ndarray, palette_bgr: np.ndarray, fmt: str = "png", compression: int = 1) -> bytes:
+	"""(h, w) uint8 palette indices + (n, 3) BGR palette (n <= 256) -> palette PNG with
+	png_bits(n) bits per pixel, or lossless WebP. The PNG is written from the indices as
+	they are, no color image is built.
+	"""
+	img = Image.fromarray(np.ascontiguousarray(indices, dtype=np.uint8), "P")
+	img.putpalette(np.ascontiguousarray(palette_bgr[:, ::-1], dtype=np.uint8).tobytes())
+	buf = BytesIO()
+	if fmt == "webp":
+		img.save(buf, "WEBP", **_webp_effort(compression))
+	elif fmt == "png":
+		img.save(buf, "PNG", compress_level=compression, bits=png_bits(palette_bgr.shape[0]))
+	else:
+		raise ValueError(f"Unknown raster format: {fmt}")
+	return buf.getvalue()
+
+
+def encode_raster(img_bgr: np.ndarray, fmt: str = "png", compression: int = 1) -> bytes:
+	"""BGR image -> PNG (zlib level compression) or lossless WebP."""
+	if fmt == "png":
+		return encode_png(img_bgr, compression)
+	if fmt != "webp":
+		raise ValueError(f"Unknown raster format: {fmt}")
+	buf = BytesIO()
+	Image.fromarray(np.ascontiguousarray(img_bgr[..., ::-1])).save(buf, "WEBP", **_webp_effort(compression))
+	return buf.getvalue()
+
+
+def encode_png_base64(img: np.ndarray) -> str:
+	"""Encode BGR/RGB/Gray image to base64-encoded PNG string."""
+	return base64.b64encode(encode_png(img)).decode("ascii")
@@ -3,23 +3,126 @@ Outline extraction using Canny + dilation.
 
 Given a BGR uint8 image and desired thickness, returns a binary outline mask
 as uint8 (0 background, 255 edges).
+
+outline_union is the worksheet engine: label boundaries and Canny edges OR-ed into one
+mask, dilated once (dilation distributes over the union, so this is the same mask as
+dilating both and OR-ing them).
 """
 
 from __future__ import annotations
 
 import numpy as np
 
+from backend.ops.segments import label_boundaries
+from backend.ops.tiles import bands, is_tiled, map_bands
+
+#context rows around each band for Canny (Sobel + non-maximum suppression + hysteresis
+#along short edge chains); chains that only connect to a strong edge further away can differ
+CANNY_HALO = 16
+
+
+def _canny_thresholds(median: float) -> tuple[int, int]:
+	lower = int(max(0, 0.66 * median))
+	upper = int(min(255, 1.33 * median))
+	return lower, upper
+
+
+def _median_from_histogram(hist: np.ndarray) -> float:
+	"""np.median of the values counted in a 256-bin histogram."""
+	n = int(hist.sum())
+	cdf = np.cumsum(hist)
+	lo = int(np.searchsorted(cdf, (n - 1) // 2 + 1))
+	hi = int(np.searchsorted(cdf, n // 2 + 1))
+	return (lo + hi) / 2.0
+
+
+def _gray_histogram(gray: np.ndarray) -> np.ndarray:
+	import cv2
+
+	#cv2.calcHist counts in place; np.median sorts a copy, np.bincount widens to int64
+	return cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+
+
+def _image_thresholds(img_bgr: np.ndarray, band_rows: int) -> tuple[int, int]:
+	"""Canny thresholds from the median gray level of the whole image, counted band by band."""
+	import cv2
+
+	hist = np.zeros(256, dtype=np.float64)
+	for y0, y1 in bands(img_bgr.shape[0], band_rows):
+		hist += _gray_histogram(cv2.cvtColor(img_bgr[y0:y1], cv2.COLOR_BGR2GRAY))
+	return _canny_thresholds(_median_from_histogram(hist))
 
-def outline_edges(img_bgr: np.ndarray, thickness: int = 2) -> np.ndarray:
+
+def _dilate_kernel(thickness: int):
 	import cv2
 
-	gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
-	m = np.median(gray)
-	lower = int(max(0, 0.66 * m))
-	upper = int(min(255, 1.33 * m))
-	edges = cv2.Canny(gray, lower, upper)
-	if thickness > 1:
-		k = max(1, thickness)
-		kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
-		edges = cv2.dilate(edges, kernel)
-	return edges
+	return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (thickness, thickness)) if thickness > 1 else None
+
+
+def dilate_outline(mask: np.ndarray, thickness: int, inplace: bool = False) -> np.ndarray:
+	"""Thicken a 1px outline mask (thickness=1 outputs of the functions here) to thickness."""
+	import cv2
+
+	kernel = _dilate_kernel(thickness)
+	if kernel is None:
+		return mask if inplace else mask.copy()
+	return cv2.dilate(mask, kernel, dst=mask if inplace else None)
+
+
+def outline_edges(img_bgr: np.ndarray, thickness: int = 2, band_rows: int = 0) -> np.ndarray:
+	"""Canny outlines. band_rows > 0 works band by band: the thresholds still come from the
+	median of the whole image, edges can differ slightly next to band seams (see CANNY_HALO).
+	"""
+	import cv2
+
+	kernel = _dilate_kernel(thickness)
+
+	def canny(band: np.ndarray, lower: int, upper: int) -> np.ndarray:
+		edges = cv2.Canny(cv2.cvtColor(band, cv2.COLOR_BGR2GRAY), lower, upper)
+		return cv2.dilate(edges, kernel, dst=edges) if kernel is not None else edges
+
+	h, w = img_bgr.shape[:2]
+	if not is_tiled(h, band_rows):
+		gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+		lower, upper = _canny_thresholds(_median_from_histogram(_gray_histogram(gray)))
+		edges = cv2.Canny(gray, lower, upper)
+		return cv2.dilate(edges, kernel, dst=edges) if kernel is not None else edges
+	lower, upper = _image_thresholds(img_bgr, band_rows)
+	out = np.empty((h, w), dtype=np.uint8)
+	return map_bands(lambda band: canny(band, lower, upper), img_bgr, band_rows, CANNY_HALO + thickness, out)
+
+
+def outline_union(label_map: np.ndarray, img_bgr: np.ndarray | None = None, thickness: int = 2,
+		band_rows: int = 0) -> np.ndarray:
+	"""Label boundaries, OR-ed with the Canny edges of img_bgr when given, dilated once.
+	Same mask as outline_from_labels | outline_edges, with one dilation and no intermediate
+	full-frame masks. band_rows > 0 works band by band (see outline_edges for the seams).
+	"""
+	import cv2
+
+	kernel = _dilate_kernel(thickness)
+	h, w = label_map.shape[:2]
+	tiled = is_tiled(h, band_rows)
+	gray = lower = upper = None
+	if img_bgr is not None:
+		if tiled:
+			lower, upper = _image_thresholds(img_bgr, band_rows)
+		else:
+			gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+			lower, upper = _canny_thresholds(_median_from_histogram(_gray_histogram(gray)))
+
+	def outline(labels: np.ndarray, img: np.ndarray | None = None, gray: np.ndarray | None = None) -> np.ndarray:
+		edges = label_boundaries(labels)
+		if img is not None:
+			gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+		if gray is not None:
+			cv2.bitwise_or(edges, cv2.Canny(gray, lower, upper), dst=edges)
+		return cv2.dilate(edges, kernel, dst=edges) if kernel is not None else edges
+
+	if not tiled:
+		return outline(label_map, gray=gray)
+	out = np.empty((h, w), dtype=np.uint8)
+	if img_bgr is None:
+		#1 row for the boundary test + the dilation reach
+		return map_bands(outline, label_map, band_rows, 1 + thickness, out)
+	return map_bands(outline, label_map, band_rows, CANNY_HALO + thickness, out, others=(img_bgr,))
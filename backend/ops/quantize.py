@@ -2,27 +2,224 @@
 Color quantization using OpenCV k-means.
 
 quantize_bgr_kmeans(img_bgr, k) -> (quant_bgr, labels, palette_bgr)
+
+Labels are colour indices in a uint8 map (k <= 256), the dtype every later stage keeps.
+
+With sample_size > 0 the palette is fitted on a fixed-size pixel sample and every
+pixel is then assigned to its nearest centre in one vectorized pass, so the fit cost
+does not grow with the image size.
+
+quantize_to_palette(img_bgr, palette) maps pixels to a fixed palette instead (no k-means):
+a 2^(3*bits) lookup table holding the Lab-nearest palette entry of every quantized BGR
+colour is built once per palette and cached, then each pixel is a single gather.
 """
 
 from __future__ import annotations
 
+from functools import lru_cache
+
 import numpy as np
 
+#pixels per chunk for the nearest-centre assignment (bounds the N x K distance matrix)
+_ASSIGN_CHUNK = 1 << 18
+
+#bits kept per channel by the fixed-palette lookup table: 64^3 entries (256 KiB),
+#at most 2 levels per channel away from the exact nearest colour
+LUT_BITS = 6
+
+
+def label_dtype(k: int) -> np.dtype:
+	"""Smallest label-map dtype for k colours: uint8 up to 256, int32 beyond."""
+	return np.dtype(np.uint8) if k <= 256 else np.dtype(np.int32)
+
+
+def sample_pixels(pixels: np.ndarray, sample_size: int, sampling: str = "random", seed: int = 0) -> np.ndarray:
+	"""Pick at most sample_size rows of an Nx3 pixel array.
+	sampling="random" draws with a seeded RNG, "strided" takes every n-th pixel.
+	"""
+	n = pixels.shape[0]
+	if sample_size <= 0 or n <= sample_size:
+		return pixels
+	if sampling == "strided":
+		step = n // sample_size
+		return pixels[::step][:sample_size]
+	if sampling != "random":
+		raise ValueError(f"Unknown sampling: {sampling}")
+	rng = np.random.default_rng(seed)
+	return pixels[rng.integers(0, n, size=sample_size)]
+
+
+def assign_nearest(pixels: np.ndarray, centers: np.ndarray) -> np.ndarray:
+	"""Index of the nearest centre (squared L2) for each row of pixels, as label_dtype(k)."""
+	c = centers.astype(np.float32)
+	c2 = (c * c).sum(axis=1)
+	m2 = -2.0 * c.T
+	labels = np.empty(pixels.shape[0], dtype=label_dtype(c.shape[0]))
+	for start in range(0, pixels.shape[0], _ASSIGN_CHUNK):
+		chunk = pixels[start:start + _ASSIGN_CHUNK].astype(np.float32)
+		#|x - c|^2 without the |x|^2 term, which does not change the argmin
+		d = chunk @ m2
+		d += c2
+		labels[start:start + _ASSIGN_CHUNK] = d.argmin(axis=1)
+	return labels
 
-def quantize_bgr_kmeans(img_bgr: np.ndarray, k: int):
+
+def to_space(img_bgr: np.ndarray, space: str) -> np.ndarray:
+	"""BGR uint8 pixels (any shape ending in 3) converted to the clustering color space."""
 	import cv2
 
-	h, w = img_bgr.shape[:2]
+	if space == "bgr":
+		return img_bgr
+	if space != "lab":
+		raise ValueError(f"Unknown color space: {space}")
+	return cv2.cvtColor(img_bgr.reshape((-1, 1, 3)), cv2.COLOR_BGR2LAB).reshape(img_bgr.shape)
+
+
+def grow_centers(samples: np.ndarray, centers: np.ndarray, k: int, seed: int = 0, trials: int = 3) -> np.ndarray:
+	"""centers topped up to k rows with k-means++ picks among samples (D^2 weighting),
+	e.g. to warm-start a fit with more colours from the palette of a fit with fewer
+	(plain k-means++ from an empty centers array). Like OpenCV's KMEANS_PP_CENTERS, each
+	pick keeps the best of `trials` candidates (lowest total distance afterwards).
+	"""
+	centers = np.asarray(centers, dtype=np.float32)
+	if centers.shape[0] >= k:
+		return centers
+	rng = np.random.default_rng(seed)
+	#channel planes: the distances below are a few passes over contiguous N-vectors
+	planes = np.ascontiguousarray(samples.T, dtype=np.float32)
+	tmp = np.empty((trials, planes.shape[1]), dtype=np.float32)
+
+	def sq_dist(c: np.ndarray) -> np.ndarray:
+		#(len(c), N) squared distances from the rows of c to every sample
+		dist = np.zeros((c.shape[0], planes.shape[1]), dtype=np.float32)
+		for ch in range(planes.shape[0]):
+			diff = np.subtract(planes[ch], c[:, ch:ch + 1], out=tmp[:c.shape[0]])
+			diff *= diff
+			dist += diff
+		return dist
+
+	d = np.full(planes.shape[1], np.inf, dtype=np.float32)
+	for c in centers:
+		np.minimum(d, sq_dist(c[None, :])[0], out=d)
+	picks = [centers]
+	for _ in range(k - centers.shape[0]):
+		cum = np.cumsum(d, dtype=np.float64)
+		total = float(cum[-1])
+		if not 0 < total < np.inf:
+			#first pick (no centres yet) or every sample is already a centre: uniform
+			cand = rng.integers(d.size, size=1)
+		else:
+			cand = np.minimum(np.searchsorted(cum, rng.random(trials) * total, side="right"), d.size - 1)
+		dists = np.minimum(sq_dist(samples[cand]), d)
+		best = int(dists.sum(axis=1, dtype=np.float64).argmin())
+		picks.append(samples[cand[best]:cand[best] + 1])
+		d = dists[best]
+	return np.concatenate(picks)
+
+
+def fit_palette(img_bgr: np.ndarray, k: int, sample_size: int = 0, sampling: str = "random",
+		space: str = "bgr", seed: int = 0, attempts: int = 1, init_palette: np.ndarray | None = None):
+	"""Fit k-means centres on the image, or on a sample of sample_size pixels.
+	Returns (centers, labels): float32 centres in `space`, and the k-means labels when every
+	pixel was used for the fit (None for a sample). Sampling happens before the color conversion,
+	so only the sampled pixels are converted.
+	Starting centres are k-means++ picks from a local RNG seeded with seed (seed + n for the
+	n-th of `attempts` fits, the most compact one wins), so fits never touch OpenCV's
+	process-wide RNG and concurrent fits in threads stay reproducible.
+	init_palette: (n, 3) BGR uint8 starting centres (e.g. from a low-res pass, or a fit with
+	n <= k colours, topped up with grow_centers) instead of k-means++; the fit then usually
+	converges in a few iterations and keeps the palette order.
+	"""
+	import cv2
+
+	pixels = img_bgr.reshape((-1, 3))
 	#prepare samples Nx3 float32
-	samples = img_bgr.reshape((-1, 3)).astype(np.float32)
+	samples = to_space(sample_pixels(pixels, sample_size, sampling, seed), space).astype(np.float32)
 	criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
-	attempts = 1
-	flags = cv2.KMEANS_PP_CENTERS
-	#provide an initial label array to satisfy type checkers
-	best_labels = np.zeros((samples.shape[0], 1), dtype=np.int32)
-	compactness, labels, centers = cv2.kmeans(samples, k, best_labels, criteria, attempts, flags)
+	k = min(k, samples.shape[0])
+	init = np.empty((0, 3), dtype=np.float32)
+	if init_palette is not None and 0 < init_palette.shape[0] <= k:
+		init = to_space(np.ascontiguousarray(init_palette, dtype=np.uint8), space).astype(np.float32)
+		attempts = 1
+	best = None
+	for attempt in range(max(1, attempts)):
+		start = grow_centers(samples, init, k, seed + attempt)
+		start_labels = assign_nearest(samples, start).astype(np.int32).reshape((-1, 1))
+		fit = cv2.kmeans(samples, k, start_labels, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+		if best is None or fit[0] < best[0]:
+			best = fit
+	compactness, labels, centers = best
+	return centers, (labels if samples.shape[0] == pixels.shape[0] else None)
+
+
+def assign_labels(img_bgr: np.ndarray, centers: np.ndarray, space: str = "bgr") -> np.ndarray:
+	"""(h, w) index (label_dtype) of the nearest centre for every pixel of a BGR image (or image band)."""
+	h, w = img_bgr.shape[:2]
+	return assign_nearest(to_space(img_bgr, space).reshape((-1, 3)), centers).reshape((h, w))
+
+
+def palette_bgr(centers: np.ndarray, space: str = "bgr") -> np.ndarray:
+	"""k-means centres as a (k, 3) BGR uint8 palette."""
+	import cv2
+
 	centers = np.clip(centers, 0, 255).astype(np.uint8)
-	labels = labels.reshape((h, w)).astype(np.int32)
-	quant = centers[labels]
-	palette = centers  #BGR uint8, shape (k, 3)
+	if space == "lab":
+		centers = cv2.cvtColor(centers.reshape((1, -1, 3)), cv2.COLOR_LAB2BGR).reshape((-1, 3))
+	return centers
+
+
+def quantize_bgr_kmeans(img_bgr: np.ndarray, k: int, sample_size: int = 0, sampling: str = "random",
+		space: str = "bgr", seed: int = 0, attempts: int = 1, init_palette: np.ndarray | None = None):
+	"""k-means quantization.
+	sample_size: 0 fits on every pixel (original behaviour), otherwise on a sample of that size.
+	space: "bgr" or "lab" (clustering and assignment in CIE Lab, palette returned in BGR).
+	init_palette: warm start, see fit_palette.
+	"""
+	h, w = img_bgr.shape[:2]
+	centers, labels = fit_palette(img_bgr, k, sample_size, sampling, space, seed, attempts, init_palette)
+	if labels is None:
+		labels = assign_labels(img_bgr, centers, space)
+	labels = labels.reshape((h, w)).astype(label_dtype(centers.shape[0]), copy=False)
+	palette = palette_bgr(centers, space)  #BGR uint8, shape (k, 3)
+	quant = palette[labels]
 	return quant, labels, palette
+
+
+def _lab(bgr_unit: np.ndarray) -> np.ndarray:
+	"""Nx3 float32 BGR in [0, 1] -> CIE Lab (L in 0..100)."""
+	import cv2
+
+	return cv2.cvtColor(bgr_unit.reshape((-1, 1, 3)), cv2.COLOR_BGR2LAB).reshape((-1, 3))
+
+
+@lru_cache(maxsize=32)
+def _palette_lut(palette_key: bytes, bits: int) -> np.ndarray:
+	palette = np.frombuffer(palette_key, dtype=np.uint8).reshape((-1, 3))
+	levels = 1 << bits
+	step = 256 // levels
+	#centre of every (b, g, r) bin, b varying slowest like the index built in quantize_to_palette
+	centre = (np.arange(levels, dtype=np.float32) * step + (step - 1) / 2.0) / 255.0
+	grid = np.stack(np.meshgrid(centre, centre, centre, indexing="ij"), axis=-1).reshape((-1, 3))
+	lut = assign_nearest(_lab(grid), _lab(palette.astype(np.float32) / 255.0))
+	lut.flags.writeable = False
+	return lut
+
+
+def palette_lut(palette_bgr: np.ndarray, bits: int = LUT_BITS) -> np.ndarray:
+	"""Flat (2^(3*bits),) table: index (b >> s) << 2*bits | (g >> s) << bits | (r >> s) -> label.
+	Cached per palette, so a set of worksheets with the same palette builds it once.
+	"""
+	return _palette_lut(np.ascontiguousarray(palette_bgr, dtype=np.uint8).tobytes(), bits)
+
+
+def quantize_to_palette(img_bgr: np.ndarray, palette_bgr: np.ndarray, bits: int = LUT_BITS) -> np.ndarray:
+	"""(h, w) uint8 label of the Lab-nearest palette colour of every pixel (or image band)."""
+	lut = palette_lut(palette_bgr, bits)
+	shift = 8 - bits
+	b, g, r = (img_bgr[..., c] >> shift for c in range(3))
+	idx = b.astype(np.uint32)
+	idx <<= bits
+	idx |= g
+	idx <<= bits
+	idx |= r
+	return lut[idx]
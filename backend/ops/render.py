@@ -23,17 +23,20 @@ def compose_worksheet(outline_mask: np.ndarray, shape_hw3: tuple[int, int, int])
 	return canvas
 
 
-def draw_numbers(img_bgr: np.ndarray, placements: list[tuple[int, int, int]]) -> np.ndarray:
-	"""Draw region numbers using OpenCV putText.
-	placements: list of (x, y, labelIndex). We draw labelIndex+1 as the human-facing number.
+def draw_numbers(img_bgr: np.ndarray, placements: list[tuple], inplace: bool = False, stats: dict | None = None) -> np.ndarray:
+	"""Draw region numbers from the glyph atlas (see ops.glyphs), centered on their points.
+	placements: list of (x, y, labelIndex) or (x, y, labelIndex, radius); we draw labelIndex+1
+	as the human-facing number, smaller where the radius is tight, and move numbers that
+	would collide. img_bgr may also be a single-channel page.
+	stats, when given, gets numbers_overflow: numbers drawn over others for lack of room.
 	"""
-	import cv2
+	from backend.ops.glyphs import layout_numbers, stamp_numbers
 
-	out = img_bgr.copy()
-	for (x, y, lbl) in placements:
-		text = str(int(lbl) + 1)
-		cv2.putText(out, text, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), thickness=1, lineType=cv2.LINE_AA)
-	return out
+	out = img_bgr if inplace else img_bgr.copy()
+	layout, overflow = layout_numbers(out, placements)
+	if stats is not None:
+		stats["numbers_overflow"] = len(overflow)
+	return stamp_numbers(out, layout, overflow)
 
 
 def labels_viz(label_map: np.ndarray, palette_bgr: np.ndarray | None = None) -> np.ndarray:
@@ -52,7 +55,8 @@ def labels_viz(label_map: np.ndarray, palette_bgr: np.ndarray | None = None) ->
 	else:
 		pal = palette_bgr
 		pal_len = pal.shape[0]
-		indexed = np.clip(label_map, 0, pal_len - 1)
+		#colour-index maps are already in range: index the palette directly, no clipped copy
+		indexed = label_map if label_map.min() >= 0 and label_map.max() < pal_len else np.clip(label_map, 0, pal_len - 1)
 		return pal[indexed]
 
 
@@ -82,8 +86,8 @@ def legend_viz(palette_bgr: np.ndarray, box_size: int = 40, font_scale: float =
 	return canvas
 
 
-def overlay_legend_on_worksheet(worksheet: np.ndarray, legend: np.ndarray, margin: int = 12, alpha: float = 0.95) -> np.ndarray:
-	h, w = worksheet.shape[:2]
+def _fit_legend(h: int, w: int, legend: np.ndarray, margin: int) -> tuple[np.ndarray, int, int]:
+	"""Legend resized to at most half the width / a quarter of the height, and its top-left corner."""
 	lh, lw = legend.shape[:2]
 	max_lw = min(w // 2, lw)
 	max_lh = min(h // 4, lh)
@@ -91,10 +95,57 @@ def overlay_legend_on_worksheet(worksheet: np.ndarray, legend: np.ndarray, margi
 		import cv2
 		legend = cv2.resize(legend, (max_lw, max_lh), interpolation=cv2.INTER_AREA)
 		lh, lw = legend.shape[:2]
-	x0 = w - lw - margin
-	y0 = margin
+	return legend, w - lw - margin, margin
+
+
+def overlay_legend_on_worksheet(worksheet: np.ndarray, legend: np.ndarray, margin: int = 12, alpha: float = 0.95,
+		inplace: bool = False) -> np.ndarray:
+	h, w = worksheet.shape[:2]
+	legend, x0, y0 = _fit_legend(h, w, legend, margin)
+	lh, lw = legend.shape[:2]
 	roi = worksheet[y0:y0+lh, x0:x0+lw]
 	blended = (roi * (1 - alpha) + legend * alpha).astype(np.uint8)
-	worksheet_out = worksheet.copy()
+	worksheet_out = worksheet if inplace else worksheet.copy()
 	worksheet_out[y0:y0+lh, x0:x0+lw] = blended
 	return worksheet_out
+
+
+def worksheet_gray(outline_mask: np.ndarray, placements: list[tuple], inplace: bool = False, stats: dict | None = None) -> np.ndarray:
+	"""Single-channel worksheet: white page, black outlines (outline_mask is 0/255) and numbers.
+	inplace reuses the outline mask as the canvas; stats as in draw_numbers.
+	"""
+	import cv2
+
+	page = cv2.bitwise_not(outline_mask, dst=outline_mask if inplace else None)
+	return draw_numbers(page, placements, inplace=True, stats=stats)
+
+
+def worksheet_palette(palette_bgr: np.ndarray) -> np.ndarray:
+	"""Palette of an indexed worksheet: the legend colors, then a gray ramp from black to white
+	filling 16 entries (4-bit PNG) when that leaves at least 4 grays, else 256.
+	"""
+	k = palette_bgr.shape[0]
+	n = 16 if k + 4 <= 16 else 256
+	grays = np.linspace(0, 255, n - k).round().astype(np.uint8)
+	return np.concatenate([palette_bgr.astype(np.uint8), np.repeat(grays[:, None], 3, axis=1)])
+
+
+def index_worksheet(gray: np.ndarray, legend: np.ndarray, sheet_palette: np.ndarray, k: int, margin: int = 12,
+		alpha: float = 0.95, inplace: bool = False) -> np.ndarray:
+	"""Palette indices (into worksheet_palette) of a gray worksheet with the legend overlaid,
+	without building the BGR worksheet: page grays go through a 256-entry table, only the
+	legend area is matched against the full palette.
+	"""
+	import cv2
+	from backend.ops.quantize import assign_nearest
+
+	grays = sheet_palette[k:, 0].astype(np.int16)
+	table = (k + np.abs(np.arange(256, dtype=np.int16)[:, None] - grays[None, :]).argmin(axis=1)).astype(np.uint8)
+	h, w = gray.shape[:2]
+	legend, x0, y0 = _fit_legend(h, w, legend, margin)
+	lh, lw = legend.shape[:2]
+	roi = gray[y0:y0+lh, x0:x0+lw].astype(np.float32)[..., None]
+	blended = (roi * (1 - alpha) + legend * alpha).astype(np.uint8)
+	out = cv2.LUT(gray, table, dst=gray if inplace else None)
+	out[y0:y0+lh, x0:x0+lw] = assign_nearest(blended.reshape((-1, 3)), sheet_palette).reshape((lh, lw))
+	return out
@@ -1,29 +1,138 @@
 """
 Connected components on the label map with min-area filtering.
 
-extract_regions(label_map, min_area) -> list of regions, each region dict contains:
+extract_regions(label_map, min_area) -> list of Region, each region exposes:
+  - label: color index (0..K-1)
+  - area: pixel area
+  - bbox: (x, y, w, h)
+  - centroid: (cx, cy) in image coords (float)
+  - mask: ROI uint8 0/1 mask of shape (h, w) for this component only
 
+Regions also support dict-style access (r["bbox"]) for older callers.
 """
 
 from __future__ import annotations
 
-from typing import List, Dict, Tuple
+import logging
+import time
+from typing import List, Dict, Optional, Tuple
 
 import numpy as np
 
-"""
-  - label: color index (0..K-1)
-  - area: pixel area
-  - bbox: (x, y, w, h)
-  - centroid: (cx, c  y) in image coords (float)
-  - mask: ROI boolean mask of shape (h, w) for this component only
-"""
-def extract_regions(label_map: np.ndarray, min_area: int) -> List[Dict]:
+from backend.ops.tiles import is_tiled, map_bands
+
+
+class Region:
+	"""Compact region descriptor.
+	The ROI mask is cropped lazily from the shared component map, so no per-region
+	full-frame buffer is ever allocated.
+	"""
+
+	__slots__ = ("label", "area", "bbox", "centroid", "comp_id", "_comp", "_mask")
+
+	def __init__(self, label: int, area: int, bbox: Tuple[int, int, int, int], centroid: Tuple[float, float],
+			comp: np.ndarray | None = None, comp_id: int = -1, mask: np.ndarray | None = None):
+		self.label = label
+		self.area = area
+		self.bbox = bbox
+		self.centroid = centroid
+		self.comp_id = comp_id
+		self._comp = comp
+		self._mask = mask
+
+	@property
+	def comp(self) -> np.ndarray | None:
+		"""Shared HxW component map this region was cut from (None in per_label mode)."""
+		return self._comp
+
+	@property
+	def mask(self) -> np.ndarray:
+		if self._mask is None:
+			x, y, w, h = self.bbox
+			self._mask = (self._comp[y:y+h, x:x+w] == self.comp_id).astype(np.uint8)
+		return self._mask
+
+	def __getitem__(self, key: str):
+		if key not in ("label", "area", "bbox", "centroid", "mask"):
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __repr__(self) -> str:
+		return f"Region(label={self.label}, area={self.area}, bbox={self.bbox})"
+
+
+def _label_values(label_map: np.ndarray) -> List[int]:
+	"""Sorted candidate label values. Small non-negative labels (colour indices) are
+	enumerated from the max instead of np.unique, which sorts a full copy of the map;
+	absent values simply produce no component.
+	"""
+	if label_map.size == 0:
+		return []
+	lo, hi = int(label_map.min()), int(label_map.max())
+	if lo >= 0 and hi < 256:
+		return list(range(hi + 1))
+	return np.unique(label_map).tolist()
+
+
+def _label_all_components(label_map: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""Label the 8-connected components of every colour into one global component map.
+	Returns (comp, comp_label, stats, centroids): comp is HxW int32 with ids 0..N-1,
+	comp_label[i] is the colour index of component i, stats[i] the OpenCV CC stats row
+	(left, top, width, height, area) and centroids[i] its (cx, cy).
+	"""
+	import cv2
+
+	h, w = label_map.shape[:2]
+	comp = np.zeros((h, w), dtype=np.int32)
+	comp_label: List[np.ndarray] = []
+	comp_stats: List[np.ndarray] = []
+	comp_centroids: List[np.ndarray] = []
+	offset = 0
+	for lbl in _label_values(label_map):
+		mask = label_map == lbl
+		#a bool array viewed as uint8 is already the 0/1 image OpenCV wants
+		num, cc, stats, centroids = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8, ltype=cv2.CV_32S)
+		if num < 2:
+			continue
+		#background of this colour is 0; shift its components to offset..offset+num-2 in place
+		cc += offset - 1
+		np.copyto(comp, cc, where=mask)
+		del cc
+		comp_label.append(np.full(num - 1, lbl, dtype=np.int32))
+		comp_stats.append(stats[1:])
+		comp_centroids.append(centroids[1:])
+		offset += num - 1
+	if not comp_label:
+		return comp, np.zeros(0, dtype=np.int32), np.zeros((0, 5), dtype=np.int32), np.zeros((0, 2), dtype=np.float64)
+	return comp, np.concatenate(comp_label), np.concatenate(comp_stats), np.concatenate(comp_centroids)
+
+
+def extract_regions(label_map: np.ndarray, min_area: int, mode: str = "single_pass") -> List[Region]:
+	"""Connected components of every label with area >= min_area.
+	mode="single_pass" labels all colours into one component map and reads bbox, area and
+	centroid from the bulk stats; mode="per_label" is the original per-component mask loop.
+	"""
+	if mode == "per_label":
+		return _extract_regions_per_label(label_map, min_area)
+	if mode != "single_pass":
+		raise ValueError(f"Unknown region extraction mode: {mode}")
+
+	import cv2
+
+	comp, comp_label, stats, centroids = _label_all_components(label_map)
+	keep = np.flatnonzero(stats[:, cv2.CC_STAT_AREA] >= min_area)
+	regions: List[Region] = []
+	for i, (x, y, ww, hh, area), (cx, cy), lbl in zip(keep.tolist(), stats[keep].tolist(), centroids[keep].tolist(), comp_label[keep].tolist()):
+		regions.append(Region(lbl, area, (x, y, ww, hh), (cx, cy), comp=comp, comp_id=i))
+	return regions
+
+
+def _extract_regions_per_label(label_map: np.ndarray, min_area: int) -> List[Region]:
 
 	import cv2
 
 	h, w = label_map.shape[:2]
-	regions: List[Dict] = []
+	regions: List[Region] = []
 
 	unique_labels = np.unique(label_map)
 	for lbl in unique_labels.tolist():
@@ -47,34 +156,184 @@ def extract_regions(label_map: np.ndarray, min_area: int) -> List[Dict]:
 			#ROI mask for this component only
 			comp_mask = (comp == i)
 			mask_roi = comp_mask[y:y+hh, x:x+ww]
-			regions.append({
-				"label": int(lbl),
-				"area": area,
-				"bbox": (x, y, ww, hh),
-				"centroid": (float(cx), float(cy)),
-				"mask": mask_roi.astype(np.uint8),
-			})
+			regions.append(Region(int(lbl), area, (x, y, ww, hh), (float(cx), float(cy)), mask=mask_roi.astype(np.uint8)))
 
 	return regions
 
 
-def median_smooth_labels(label_map: np.ndarray, ksize: int = 3) -> np.ndarray:
+def median_smooth_labels(label_map: np.ndarray, ksize: int = 3, band_rows: int = 0, inplace: bool = False) -> np.ndarray:
 	"""Apply median filtering on label map to remove salt-and-pepper noise.
-	Operates per-channel via trick of expanding to 3 channels of same map and collapsing back.
+	uint8 maps are filtered as a single channel and keep their dtype; other dtypes go
+	through uint8 and are cast back. band_rows > 0 filters band by band (same result);
+	inplace writes back into label_map.
 	"""
 	import cv2
 
 	# Ensure odd kernel size >= 3
 	k = max(3, ksize | 1)
-	l = label_map.astype(np.int32)
-	# Expand to 3 channels for medianBlur
-	l3 = np.repeat(l[..., None], 3, axis=2).astype(np.uint8)
-	m3 = cv2.medianBlur(l3, k)
-	return m3[..., 0].astype(label_map.dtype)
 
+	def smooth(l: np.ndarray) -> np.ndarray:
+		return cv2.medianBlur(l if l.dtype == np.uint8 else l.astype(np.uint8), k)
+
+	if not is_tiled(label_map.shape[0], band_rows) and not inplace:
+		return smooth(label_map).astype(label_map.dtype, copy=False)
+	out = label_map if inplace else np.empty_like(label_map)
+	return map_bands(smooth, label_map, band_rows, k // 2, out)
+
+
+def _component_adjacency(comp: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+	"""Region adjacency of a component map, as directed pixel pairs (a, b) with a != b.
+	Uses the 8-neighbourhood, one entry per neighbouring pixel pair and direction.
+	"""
+	src: List[np.ndarray] = []
+	dst: List[np.ndarray] = []
+	#right, down, down-right, down-left; slices never wrap around the border
+	shifts = [
+		(comp[:, :-1], comp[:, 1:]),
+		(comp[:-1, :], comp[1:, :]),
+		(comp[:-1, :-1], comp[1:, 1:]),
+		(comp[:-1, 1:], comp[1:, :-1]),
+	]
+	for a, b in shifts:
+		diff = a != b
+		av = a[diff]
+		bv = b[diff]
+		src.extend((av, bv))
+		dst.extend((bv, av))
+	return np.concatenate(src), np.concatenate(dst)
+
+
+def merge_micro_regions_bulk(label_map: np.ndarray, min_area: int, max_iter: Optional[int] = None) -> Tuple[np.ndarray, Dict]:
+	"""Merge connected components with area < min_area using whole-array operations.
+
+	Each pass labels all components at once, builds the region adjacency graph from
+	neighbouring pixel pairs and moves every small component to the label it shares
+	the longest border with. Only neighbours that are larger (by area, then id) are
+	considered, so two small components can never swap labels. Passes repeat until no
+	small component can be merged anymore; every pass joins at least one component to a
+	neighbour, so this ends. max_iter caps the passes: hitting it with small components
+	left is logged and reported as converged=False.
+
+	Returns (labels, stats) where stats has iterations, merged, converged and elapsed_ms.
+	"""
+	import cv2
+
+	t0 = time.perf_counter()
+	out = label_map
+	iterations = 0
+	merged = 0
+	converged = False
+	while True:
+		comp, comp_label, stats, _ = _label_all_components(out)
+		comp_area = stats[:, cv2.CC_STAT_AREA].astype(np.int64)
+		n = comp_label.size
+		small = comp_area < min_area
+		if n < 2 or not small.any():
+			converged = True
+			break
+		if max_iter is not None and iterations >= max_iter:
+			logging.warning("merge_micro_regions_bulk: %d components under %d px left after %d passes", int(small.sum()), min_area, iterations)
+			break
+		iterations += 1
+		a, b = _component_adjacency(comp)
+		#rank components by (area, id) so a component only flows into a larger one
+		rank = np.empty(n, dtype=np.int64)
+		rank[np.lexsort((np.arange(n), comp_area))] = np.arange(n)
+		keep = small[a] & (rank[b] > rank[a])
+		a = a[keep]
+		b = b[keep]
+		if a.size == 0:
+			#only small components left next to each other (or alone): nothing can grow
+			converged = True
+			break
+		small_ids = np.flatnonzero(small)
+		small_index = np.full(n, -1, dtype=np.int64)
+		small_index[small_ids] = np.arange(small_ids.size)
+		k = int(comp_label.max()) + 1
+		counts = np.bincount(small_index[a] * k + comp_label[b], minlength=small_ids.size * k)
+		counts = counts.reshape(small_ids.size, k)
+		has_neighbour = counts.any(axis=1)
+		#argmax picks the lowest label on ties, like np.unique + argmax in the legacy path
+		target = counts.argmax(axis=1)
+		lut = comp_label.astype(label_map.dtype)
+		lut[small_ids[has_neighbour]] = target[has_neighbour]
+		merged += int(has_neighbour.sum())
+		del a, b
+		#relabel into our own buffer once we have one (never into the caller's map)
+		out = lut[comp] if out is label_map else np.take(lut, comp, out=out, mode="clip")
+		del comp
+	if out is label_map:
+		out = label_map.copy()
+	stats = {
+		"iterations": iterations,
+		"merged": merged,
+		"converged": converged,
+		"elapsed_ms": (time.perf_counter() - t0) * 1000.0,
+	}
+	return out, stats
+
+
+MERGE_ENGINES = ("pixel", "bulk", "legacy")
 
-def merge_micro_regions(label_map: np.ndarray, min_area: int) -> np.ndarray:
+
+def merge_micro_regions(label_map: np.ndarray, min_area: int, engine: str = "pixel", stats: Optional[Dict] = None) -> np.ndarray:
 	"""Merge connected components with area < min_area to neighboring dominant label.
+	engine="pixel" (default) is the original per-pixel rule, vectorized, with the same output;
+	engine="bulk" uses merge_micro_regions_bulk (whole components, opt-in: different output);
+	engine="legacy" keeps the original per-pixel loop.
+	stats, when given, gets the bulk engine's iterations, merged, converged and elapsed_ms
+	(the single-pass engines leave it empty).
+	"""
+	if engine == "pixel":
+		return merge_micro_regions_pixel(label_map, min_area)
+	if engine == "legacy":
+		return _merge_micro_regions_legacy(label_map, min_area)
+	if engine != "bulk":
+		raise ValueError(f"Unknown merge engine: {engine}")
+	out, bulk_stats = merge_micro_regions_bulk(label_map, min_area)
+	if stats is not None:
+		stats.update(bulk_stats)
+	return out
+
+
+def merge_micro_regions_pixel(label_map: np.ndarray, min_area: int) -> np.ndarray:
+	"""_merge_micro_regions_legacy with whole-array operations, same output.
+
+	Labels are visited in increasing order, each on the map as rewritten so far. Every pixel
+	of a small component of the label takes the most frequent other label of its 3x3
+	neighbourhood in the original map (the lowest one on ties); pixels with no other label
+	around keep theirs, so the interior of a small component survives.
+	"""
+	import cv2
+
+	out = label_map.copy()
+	pad = np.pad(label_map, 1, mode="edge")
+	for lbl in _label_values(label_map):
+		mask = out == lbl
+		if not mask.any():
+			continue
+		num, cc, stats, _ = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8, ltype=cv2.CV_32S)
+		small = stats[:, cv2.CC_STAT_AREA] < min_area
+		#component 0 is everything else
+		small[0] = False
+		if not small.any():
+			continue
+		ys, xs = np.nonzero(small[cc])
+		del cc, mask
+		#(pixels, 9) neighbourhoods, sorted so the first most frequent value is the lowest
+		nb = np.sort(np.stack([pad[ys + dy, xs + dx] for dy in range(3) for dx in range(3)], axis=1), axis=1)
+		other = nb != lbl
+		counts = ((nb[:, :, None] == nb[:, None, :]) & other[:, None, :]).sum(axis=2)
+		counts[~other] = 0
+		best = counts.argmax(axis=1)
+		rows = np.arange(ys.size)
+		ok = counts[rows, best] > 0
+		out[ys[ok], xs[ok]] = nb[rows, best][ok]
+	return out
+
+
+def _merge_micro_regions_legacy(label_map: np.ndarray, min_area: int) -> np.ndarray:
+	"""Per-pixel reference implementation.
 	Strategy: for each label, get CCs; if small, reassign its pixels to the mode label in a 3x3 neighborhood of the original map.
 	"""
 	import cv2
@@ -109,21 +368,36 @@ def merge_micro_regions(label_map: np.ndarray, min_area: int) -> np.ndarray:
 	return out
 
 
-def outline_from_labels(label_map: np.ndarray, thickness: int = 2) -> np.ndarray:
+def label_boundaries(label_map: np.ndarray) -> np.ndarray:
+	"""uint8 0/255 pixels with a 4-neighbour of another label.
+	Uses slice comparisons: no shifted full-frame copies and no wrap-around at the borders.
+	"""
+	h, w = label_map.shape[:2]
+	diff = np.zeros((h, w), dtype=np.bool_)
+	vert = label_map[1:, :] != label_map[:-1, :]
+	diff[1:, :] |= vert
+	diff[:-1, :] |= vert
+	del vert
+	horz = label_map[:, 1:] != label_map[:, :-1]
+	diff[:, 1:] |= horz
+	diff[:, :-1] |= horz
+	return np.multiply(diff, 255, dtype=np.uint8)
+
+
+def outline_from_labels(label_map: np.ndarray, thickness: int = 2, band_rows: int = 0) -> np.ndarray:
 	"""Generate outline mask from label boundaries (always closed).
+	band_rows > 0 works band by band with the same result.
 	"""
 	import cv2
 
+	kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (thickness, thickness)) if thickness > 1 else None
+
+	def outline(l: np.ndarray) -> np.ndarray:
+		edges = label_boundaries(l)
+		return cv2.dilate(edges, kernel) if kernel is not None else edges
+
 	h, w = label_map.shape[:2]
-	# Compute boundary by checking differences with shifted maps
-	diff = np.zeros((h, w), dtype=np.uint8)
-	diff |= (label_map != np.roll(label_map, 1, axis=0)).astype(np.uint8)
-	diff |= (label_map != np.roll(label_map, -1, axis=0)).astype(np.uint8)
-	diff |= (label_map != np.roll(label_map, 1, axis=1)).astype(np.uint8)
-	diff |= (label_map != np.roll(label_map, -1, axis=1)).astype(np.uint8)
-	edges = (diff > 0).astype(np.uint8) * 255
-	if thickness > 1:
-		k = max(1, thickness)
-		kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k, k))
-		edges = cv2.dilate(edges, kernel)
-	return edges
+	if not is_tiled(h, band_rows):
+		return outline(label_map)
+	#halo: 1 row for the boundary test + the dilation reach
+	return map_bands(outline, label_map, band_rows, 1 + thickness, np.empty((h, w), dtype=np.uint8))
@@ -0,0 +1,67 @@
+"""
+Row-band ("tile") execution helpers for the memory-bounded pipeline mode.
+
+Ops that accept band_rows process the image as full-width bands of that many rows,
+each extended by a few halo rows of context that are cropped again afterwards, so
+their temporaries scale with the band height instead of the image height. Bands are
+contiguous row slices of C-ordered arrays: no copies are needed to cut them.
+
+band_rows <= 0 (or >= the image height) means a single band, i.e. the untiled op.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator, Sequence, Tuple
+
+import numpy as np
+
+#bands thinner than this spend more time in halos and per-call overhead than they save
+MIN_BAND_ROWS = 64
+
+
+def bands(h: int, band_rows: int) -> Iterator[Tuple[int, int]]:
+	"""(y0, y1) row ranges covering [0, h)."""
+	step = band_rows if 0 < band_rows < h else max(h, 1)
+	for y0 in range(0, h, step):
+		yield y0, min(h, y0 + step)
+
+
+def is_tiled(h: int, band_rows: int) -> bool:
+	return 0 < band_rows < h
+
+
+def map_bands(fn: Callable[..., np.ndarray], src: np.ndarray, band_rows: int, halo: int,
+		out: np.ndarray, others: Sequence[np.ndarray] = ()) -> np.ndarray:
+	"""out[y0:y1] = fn(src[y0 - halo:y1 + halo]) cropped back to rows y0:y1, band by band.
+
+	Halos are clipped at the image border, so fn sees the real top/bottom edge exactly
+	as it would on the whole image (its own border handling applies). out may be src
+	itself: the original halo rows above each band are kept aside before being overwritten.
+	others are read-only arrays with the same rows as src: fn gets the same window of
+	each as extra arguments.
+	"""
+	h = src.shape[0]
+	inplace = out is src
+	carry = None
+	for y0, y1 in bands(h, band_rows):
+		a, b = max(0, y0 - halo), min(h, y1 + halo)
+		if inplace and carry is not None and carry.shape[0]:
+			window = np.concatenate([carry, src[y0:b]])
+		else:
+			window = src[a:b]
+		res = fn(window, *(o[a:b] for o in others))
+		if inplace:
+			carry = src[max(0, y1 - halo):y1].copy()
+		out[y0:y1] = res[y0 - a:y1 - a]
+	return out
+
+
+def band_rows_for_budget(h: int, w: int, budget_bytes: int, resident_per_px: float, band_per_px: float, halo: int = 0) -> int:
+	"""Band height keeping resident full-frame planes + one band of temporaries (halo rows
+	on both sides included) under budget_bytes. 0 when the untiled run already fits (or
+	there is no budget); never below MIN_BAND_ROWS, even when the budget cannot be met.
+	"""
+	if budget_bytes <= 0 or h * w * (resident_per_px + band_per_px) <= budget_bytes:
+		return 0
+	rows = int((budget_bytes - h * w * resident_per_px) // max(1.0, w * band_per_px)) - 2 * halo
+	return min(h, max(MIN_BAND_ROWS, rows))
@@ -0,0 +1,367 @@
+"""
+Vector worksheet export (SVG and PDF).
+
+Region boundaries are traced once from the label map as "crack edges" (the pixel
+sides between two different labels), chained into polylines between junctions and
+simplified with Douglas-Peucker. Each boundary is shared by the two regions it
+separates, so it is emitted exactly once and outlines stay closed (junction points
+are never moved by the simplification).
+
+Coordinates are in pixels of the label map: pixel (x, y) covers [x, x+1] x [y, y+1].
+
+PngPagesPdf writes raster worksheets as a multi-page PDF, one PNG per page, streamed page
+by page: the PNG's compressed data is embedded as is (PDF Flate + PNG predictors).
+"""
+
+from __future__ import annotations
+
+import struct
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+#page sizes in PDF points (1/72 inch), portrait
+PAGE_SIZES = {
+	"A4": (595.28, 841.89),
+	"A3": (841.89, 1190.55),
+}
+
+#raster worksheet numbers use FONT_HERSHEY_SIMPLEX at scale 0.5, about this tall in px
+NUMBER_FONT_PX = 14.0
+#Helvetica digits are 0.556 em wide and 0.716 em tall: half their height below the point
+#puts the baseline where the number is centered vertically, like the raster numbers
+_DIGIT_EM = 0.556
+_NUMBER_BASELINE = 0.358 * NUMBER_FONT_PX
+
+
+def trace_label_boundaries(label_map: np.ndarray, epsilon: float = 0.8) -> List[np.ndarray]:
+	"""Polylines (Nx2 float32 arrays of corner coordinates) along all label boundaries.
+	epsilon: Douglas-Peucker tolerance in pixels (0 keeps the exact staircase).
+
+	Chaining is vectorized: every crack edge is oriented with the smaller label on its
+	left, so at a corner joining two edges (degree 2) one edge ends where the other starts
+	and each edge's successor is one gather. Loops with no junction are found and cut at
+	their lowest edge, then edges are ordered along their chains by pointer jumping (about
+	log2(edges) rounds of whole-array gathers). Only the simplification runs per chain.
+	"""
+	import cv2
+
+	lm = label_map
+	h, w = lm.shape[:2]
+	stride = w + 1
+	#horizontal crack edges between rows y-1 and y, left to right when the upper label is smaller
+	hor = np.zeros((h + 1, w), dtype=np.bool_)
+	hor[1:h] = lm[1:, :] != lm[:-1, :]
+	flat = np.flatnonzero(hor)
+	right = (lm[:-1, :] < lm[1:, :]).ravel()[flat - w]
+	h_corner = flat + flat // w
+	#vertical crack edges between columns x-1 and x, downwards when the right label is smaller
+	ver = np.zeros((h, w + 1), dtype=np.bool_)
+	ver[:, 1:w] = lm[:, 1:] != lm[:, :-1]
+	flat = np.flatnonzero(ver)
+	down = (lm[:, 1:] < lm[:, :-1]).ravel()[flat - 2 * (flat // stride) - 1]
+	tail = np.concatenate([h_corner + ~right, flat + stride * ~down]).astype(np.int32)
+	head = np.concatenate([h_corner + right, flat + stride * down]).astype(np.int32)
+	n = tail.size
+	if n == 0:
+		return []
+
+	#edges meeting at each corner
+	deg = np.zeros((h + 1, w + 1), dtype=np.uint8)
+	deg[:, :-1] += hor
+	deg[:, 1:] += hor
+	deg[:-1, :] += ver
+	deg[1:, :] += ver
+	deg = deg.ravel()
+	ids = np.arange(n, dtype=np.int32)
+	#successor: the edge leaving the head corner, when that corner only joins two edges
+	leaving = np.empty(deg.size, dtype=np.int32)
+	leaving[tail] = ids
+	nxt = np.where(deg[head] == 2, leaving[head], -1)
+
+	#loops: jump until every chain reaches its end; edges still cycling are on loops,
+	#cut each before its lowest edge
+	succ = np.where(nxt >= 0, nxt, ids)
+	low = ids.copy()
+	for _ in range(max(1, int(n).bit_length())):
+		np.minimum(low, low[succ], out=low)
+		succ = succ[succ]
+	on_loop = nxt[succ] >= 0
+	closed = np.zeros(n, dtype=np.bool_)
+	closed[low[on_loop]] = True
+	nxt[on_loop & (nxt == low)] = -1
+
+	#rank: steps to the end of the chain, end: the chain's last edge
+	end = np.where(nxt >= 0, nxt, ids)
+	rank = (nxt >= 0).astype(np.int32)
+	while True:
+		jump = end[end]
+		if np.array_equal(jump, end):
+			break
+		rank += rank[end]
+		end = jump
+	#chains in the order of their last edge, each from its first edge to its last
+	lasts = np.flatnonzero(nxt < 0)
+	length = np.bincount(end, minlength=n)
+	first = np.cumsum(length[lasts]) - length[lasts]
+	offset = np.zeros(n, dtype=np.int64)
+	offset[lasts] = first
+	order = np.empty(n, dtype=np.int32)
+	order[offset[end] + length[end] - 1 - rank] = ids
+	is_closed = closed[order[first]].tolist()
+	#corners: each edge's tail, then the last edge's head
+	corners = np.insert(tail[order], first[1:].tolist() + [n], head[lasts])
+	xy = np.stack([corners % stride, corners // stride], axis=1).astype(np.float32).reshape(-1, 1, 2)
+	bounds = (first + np.arange(first.size)).tolist() + [xy.shape[0]]
+
+	polylines: List[np.ndarray] = []
+	for a, b, loop in zip(bounds, bounds[1:], is_closed):
+		curve = xy[a:b - 1] if loop else xy[a:b]
+		if epsilon > 0 and len(curve) > 2:
+			curve = cv2.approxPolyDP(curve, epsilon, loop)
+		poly = curve.reshape(-1, 2)
+		if loop:
+			poly = np.vstack([poly, poly[:1]])
+		polylines.append(poly)
+	return polylines
+
+
+def _legend_layout(palette_bgr: np.ndarray, w: int, h: int, margin: int = 12):
+	"""Legend geometry matching render.legend_viz + overlay_legend_on_worksheet.
+	Returns (x0, y0, scale, box, inner_margin, legend_w, legend_h) in worksheet pixels.
+	"""
+	k = int(palette_bgr.shape[0])
+	box, inner = 32, 16
+	lw = box * k + inner * 2
+	lh = box + 40
+	scale = min(1.0, (w // 2) / float(lw), (h // 4) / float(lh))
+	lw_s, lh_s = lw * scale, lh * scale
+	return w - lw_s - margin, float(margin), scale, box, inner, lw_s, lh_s
+
+
+def _fmt(v: float) -> str:
+	return f"{v:.2f}".rstrip("0").rstrip(".")
+
+
+def _path_data(polylines: Sequence[np.ndarray]) -> str:
+	#"M x,y x,y ..." : coordinates after a moveto are implicit linetos
+	return " ".join("M" + " ".join(f"{_fmt(x)},{_fmt(y)}" for x, y in poly.tolist()) for poly in polylines)
+
+
+def worksheet_svg(polylines: Sequence[np.ndarray], size_wh: Tuple[int, int], placements: Sequence[tuple],
+		palette_bgr: np.ndarray, thickness: int = 2) -> bytes:
+	"""SVG worksheet: shared outline paths, region numbers (label + 1) and the color legend."""
+	w, h = size_wh
+	out = [
+		f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {w} {h}" width="{w}" height="{h}">',
+		f'<rect width="{w}" height="{h}" fill="#fff"/>',
+		f'<path d="{_path_data(polylines)}" fill="none" stroke="#000" stroke-width="{thickness}" stroke-linejoin="round" stroke-linecap="round"/>',
+		f'<g font-family="Helvetica, Arial, sans-serif" font-size="{_fmt(NUMBER_FONT_PX)}" fill="#000" text-anchor="middle">',
+	]
+	for x, y, lbl, *_ in placements:
+		out.append(f'<text x="{int(x)}" y="{_fmt(int(y) + _NUMBER_BASELINE)}">{int(lbl) + 1}</text>')
+	out.append("</g>")
+	x0, y0, s, box, inner, lw, lh = _legend_layout(palette_bgr, w, h)
+	out.append(f'<g transform="translate({_fmt(x0)} {_fmt(y0)}) scale({_fmt(s)})" font-family="Helvetica, Arial, sans-serif" font-size="18" text-anchor="middle">')
+	out.append(f'<rect width="{_fmt(lw / s)}" height="{_fmt(lh / s)}" fill="#fff"/>')
+	for i, (b, g, r) in enumerate(palette_bgr.tolist()):
+		bx = inner + i * box
+		out.append(f'<rect x="{bx}" y="{inner}" width="{box}" height="{box}" fill="#{r:02x}{g:02x}{b:02x}" stroke="#000" stroke-width="1"/>')
+		out.append(f'<text x="{bx + box // 2}" y="{inner + box + 20}">{i + 1}</text>')
+	out.append("</g>")
+	out.append("</svg>")
+	return "\n".join(out).encode("utf-8")
+
+
+def worksheet_pdf(polylines: Sequence[np.ndarray], size_wh: Tuple[int, int], placements: Sequence[tuple],
+		palette_bgr: np.ndarray, thickness: int = 2, page: str = "A4", margin_pt: float = 28.35) -> bytes:
+	"""Single-page PDF worksheet fitted to an A4/A3 page (landscape when the image is wide)."""
+	if page not in PAGE_SIZES:
+		raise ValueError(f"Unknown page size: {page}")
+	w, h = size_wh
+	pw, ph = PAGE_SIZES[page]
+	if w > h:
+		pw, ph = ph, pw
+	s = min((pw - 2 * margin_pt) / w, (ph - 2 * margin_pt) / h)
+	tx = (pw - w * s) / 2.0
+	ty = ph - (ph - h * s) / 2.0
+
+	ops: List[str] = []
+	#flip to image coordinates: (x, y) -> (tx + s*x, ty - s*y)
+	ops.append(f"q {_fmt(s)} 0 0 {_fmt(-s)} {_fmt(tx)} {_fmt(ty)} cm")
+	ops.append(f"{thickness} w 1 J 1 j 0 G")
+	for poly in polylines:
+		pts = poly.tolist()
+		ops.append(f"{_fmt(pts[0][0])} {_fmt(pts[0][1])} m " + " ".join(f"{_fmt(x)} {_fmt(y)} l" for x, y in pts[1:]))
+	ops.append("S")
+	#text matrices flip glyphs back upright inside the flipped space
+	ops.append("0 g BT")
+	for x, y, lbl, *_ in placements:
+		label = str(int(lbl) + 1)
+		tw = _DIGIT_EM * NUMBER_FONT_PX * len(label)
+		ops.append(f"/F1 {_fmt(NUMBER_FONT_PX)} Tf 1 0 0 -1 {_fmt(int(x) - tw / 2)} {_fmt(int(y) + _NUMBER_BASELINE)} Tm ({label}) Tj")
+	ops.append("ET")
+	x0, y0, ls, box, inner, lw, lh = _legend_layout(palette_bgr, w, h)
+	ops.append(f"q {_fmt(ls)} 0 0 {_fmt(ls)} {_fmt(x0)} {_fmt(y0)} cm")
+	ops.append(f"1 g 0 0 {_fmt(lw / ls)} {_fmt(lh / ls)} re f 1 w")
+	for i, (b, g, r) in enumerate(palette_bgr.tolist()):
+		bx = inner + i * box
+		ops.append(f"{_fmt(r / 255)} {_fmt(g / 255)} {_fmt(b / 255)} rg {bx} {inner} {box} {box} re B")
+	ops.append("0 g BT")
+	for i in range(palette_bgr.shape[0]):
+		label = str(i + 1)
+		tw = _DIGIT_EM * 18 * len(label)
+		ops.append(f"/F1 18 Tf 1 0 0 -1 {_fmt(inner + i * box + (box - tw) / 2)} {inner + box + 20} Tm ({label}) Tj")
+	ops.append("ET Q Q")
+	content = zlib.compress("\n".join(ops).encode("ascii"))
+
+	objects = [
+		b"<< /Type /Catalog /Pages 2 0 R >>",
+		b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+		(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_fmt(pw)} {_fmt(ph)}] "
+			f"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>").encode("ascii"),
+		b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+		f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode("ascii") + content + b"\nendstream",
+	]
+	buf = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+	offsets = []
+	for i, body in enumerate(objects, start=1):
+		offsets.append(len(buf))
+		buf += f"{i} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+	xref = len(buf)
+	buf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+	for off in offsets:
+		buf += f"{off:010d} 00000 n \n".encode("ascii")
+	buf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+	return bytes(buf)
+
+
+def _png_image(png: bytes) -> Tuple[int, int, bytes, bytes]:
+	"""(width, height, image dictionary entries, Flate data) of a non-interlaced gray, RGB or
+	palette PNG, for a PDF image XObject.
+	"""
+	if png[:8] != b"\x89PNG\r\n\x1a\n":
+		raise ValueError("Not a PNG")
+	pos, idat, plte = 8, [], b""
+	w = h = depth = ctype = None
+	while pos < len(png):
+		n, kind = struct.unpack(">I4s", png[pos:pos + 8])
+		body = png[pos + 8:pos + 8 + n]
+		if kind == b"IHDR":
+			w, h, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", body)
+			if interlace:
+				raise ValueError("Interlaced PNGs are not supported")
+		elif kind == b"PLTE":
+			plte = body
+		elif kind == b"IDAT":
+			idat.append(body)
+		elif kind == b"IEND":
+			break
+		pos += 12 + n
+	colors = {0: 1, 2: 3, 3: 1}.get(ctype)
+	if colors is None:
+		raise ValueError(f"Unsupported PNG color type: {ctype}")
+	if ctype == 3:
+		space = f"[/Indexed /DeviceRGB {len(plte) // 3 - 1} <{plte.hex()}>]"
+	else:
+		space = "/DeviceGray" if ctype == 0 else "/DeviceRGB"
+	entries = (f"/Width {w} /Height {h} /ColorSpace {space} /BitsPerComponent {depth} /Filter /FlateDecode "
+		f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent {depth} /Columns {w} >>")
+	return w, h, entries.encode("ascii"), b"".join(idat)
+
+
+def _pdf_text(line: str) -> str:
+	"""line as the body of a PDF literal string (latin-1, parentheses and backslashes escaped)."""
+	line = line.encode("latin-1", "replace").decode("latin-1")
+	return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+class PngPagesPdf:
+	"""Multi-page PDF of PNG images, each fitted to an A4/A3 page (landscape when wide).
+
+	add_page() and close() return the PDF bytes written so far: pages go out as they come,
+	only the object offsets are kept. Pages added with the same key as an earlier page
+	reuse its image (repeated frames are stored once).
+	"""
+
+	def __init__(self, page: str = "A4", margin_pt: float = 28.35):
+		if page not in PAGE_SIZES:
+			raise ValueError(f"Unknown page size: {page}")
+		self.page = PAGE_SIZES[page]
+		self.margin = margin_pt
+		self._offsets: Dict[int, int] = {}
+		self._written = 0
+		self._kids: List[int] = []
+		self._images: Dict[object, Tuple[int, int, int]] = {}
+		#1: catalog, 2: page tree (written last, when the kids are known)
+		self._next = 3
+
+	def _obj(self, num: int, body: bytes) -> bytes:
+		out = f"{num} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+		self._offsets[num] = self._written
+		self._written += len(out)
+		return out
+
+	def _new(self) -> int:
+		num, self._next = self._next, self._next + 1
+		return num
+
+	def _start(self) -> List[bytes]:
+		"""Header and catalog before the first page, nothing afterwards."""
+		if self._written:
+			return []
+		header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+		self._written = len(header)
+		return [header, self._obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")]
+
+	def add_page(self, png: bytes, key: Optional[object] = None) -> List[bytes]:
+		out = self._start()
+		image = self._images.get(key) if key is not None else None
+		if image is None:
+			w, h, entries, data = _png_image(png)
+			num = self._new()
+			out.append(self._obj(num, b"<< /Type /XObject /Subtype /Image " + entries
+				+ f" /Length {len(data)} >>\nstream\n".encode("ascii") + data + b"\nendstream"))
+			image = (num, w, h)
+			if key is not None:
+				self._images[key] = image
+		num, w, h = image
+		pw, ph = self.page
+		if w > h:
+			pw, ph = ph, pw
+		s = min((pw - 2 * self.margin) / w, (ph - 2 * self.margin) / h)
+		content = f"q {_fmt(w * s)} 0 0 {_fmt(h * s)} {_fmt((pw - w * s) / 2)} {_fmt((ph - h * s) / 2)} cm /Im0 Do Q".encode("ascii")
+		content_num, page_num = self._new(), self._new()
+		out.append(self._obj(content_num, f"<< /Length {len(content)} >>\nstream\n".encode("ascii") + content + b"\nendstream"))
+		out.append(self._obj(page_num, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_fmt(pw)} {_fmt(ph)}] "
+			f"/Resources << /XObject << /Im0 {num} 0 R >> >> /Contents {content_num} 0 R >>").encode("ascii")))
+		self._kids.append(page_num)
+		return out
+
+	def add_text_page(self, lines: List[str]) -> List[bytes]:
+		"""A page with lines of Helvetica text from the top left, e.g. an error note."""
+		out = self._start()
+		pw, ph = self.page
+		text = " ".join(f"({_pdf_text(line)}) Tj T*" for line in lines)
+		content = f"BT /F1 12 Tf 14 TL {_fmt(self.margin)} {_fmt(ph - self.margin - 12)} Td {text} ET".encode("latin-1")
+		font_num, content_num, page_num = self._new(), self._new(), self._new()
+		out.append(self._obj(font_num, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"))
+		out.append(self._obj(content_num, f"<< /Length {len(content)} >>\nstream\n".encode("ascii") + content + b"\nendstream"))
+		out.append(self._obj(page_num, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_fmt(pw)} {_fmt(ph)}] "
+			f"/Resources << /Font << /F1 {font_num} 0 R >> >> /Contents {content_num} 0 R >>").encode("ascii")))
+		self._kids.append(page_num)
+		return out
+
+	def close(self) -> List[bytes]:
+		"""The page tree, cross-reference table and trailer (a PDF needs at least one page)."""
+		if not self._kids:
+			raise ValueError("A PDF needs at least one page")
+		kids = " ".join(f"{k} 0 R" for k in self._kids)
+		out = [self._obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._kids)} >>".encode("ascii"))]
+		xref = self._written
+		lines = [f"xref\n0 {self._next}\n0000000000 65535 f \n"]
+		lines += [f"{self._offsets[i]:010d} 00000 n \n" for i in range(1, self._next)]
+		lines.append(f"trailer\n<< /Size {self._next} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+		out.append("".join(lines).encode("ascii"))
+		return out
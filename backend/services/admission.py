@@ -0,0 +1,182 @@
+"""
+Memory-aware admission control, in front of the conversion pool.
+
+Before anything is decoded, the upload's header is probed (size, mode, frames) and the
+peak memory of its conversion estimated (magic.estimate_peak_bytes). Conversions in
+flight share one budget (MAGIC_MEMORY_BUDGET_MB); each request is then:
+
+- admitted: its estimate fits in what is left of the budget
+- queued: it fits the budget but not right now; waits (first come, first served) for
+  running conversions to release memory, QueueFullError after MAGIC_ADMISSION_TIMEOUT
+- degraded: alone it would not fit; it runs in tiled mode (memory_budget_mb) and, if
+  that is still too much, with a smaller max_size (JPEGs then also decode smaller)
+- rejected: not even the smallest max_size fits, e.g. a huge PNG that has to be decoded
+  in full (ImageTooLargeError)
+
+Degraded results are not the ones the options ask for, so callers should not cache them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from backend.api.schemas import ConvertRequestOptions
+from backend.config import settings
+from backend.ops.io import ImageProbe, probe_image
+from backend.services.executor import QueueFullError, tracking_tasks
+from backend.services.magic import estimate_peak_bytes
+
+#smallest max_size a degraded request is shrunk to (the schema minimum)
+MIN_MAX_SIZE = 128
+
+
+def _call_soon(loop: asyncio.AbstractEventLoop, fn, *args) -> None:
+	try:
+		loop.call_soon_threadsafe(fn, *args)
+	except RuntimeError:
+		#loop closed (shutdown): nobody is left waiting for the memory
+		pass
+
+
+class ImageTooLargeError(ValueError):
+	"""The image cannot be converted within the memory budget, whatever the options."""
+
+
+class MemoryAdmission:
+	"""Shared memory budget of the conversions in flight (budget_bytes <= 0 disables it)."""
+
+	def __init__(self, budget_bytes: int, timeout: float = 30.0):
+		self.budget = int(budget_bytes)
+		self.timeout = float(timeout)
+		self._used = 0
+		#(bytes, future) of the requests waiting for memory, in arrival order
+		self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+		self._counters = {"admitted": 0, "queued": 0, "degraded": 0, "rejected": 0, "timed_out": 0}
+
+	def plan(self, data: bytes, opts: ConvertRequestOptions, degrade: bool = True) -> Tuple[ConvertRequestOptions, int, Optional[str]]:
+		"""(options to run with, bytes to reserve, degradation: None, "tiled" or "downscaled").
+		Raises ImageTooLargeError when no degradation fits the budget.
+		"""
+		try:
+			probe = probe_image(data)
+		except ValueError as e:
+			raise ImageTooLargeError(str(e))
+		need = len(data) + estimate_peak_bytes(probe, opts)
+		if self.budget <= 0 or need <= self.budget:
+			return opts, need, None
+		if degrade:
+			return self._degrade(data, probe, opts)
+		self._counters["rejected"] += 1
+		raise ImageTooLargeError(f"Image needs about {need >> 20} MB to convert, over the {self.budget >> 20} MB budget.")
+
+	def _degrade(self, data: bytes, probe: Optional[ImageProbe], opts: ConvertRequestOptions) -> Tuple[ConvertRequestOptions, int, str]:
+		room_mb = (self.budget - len(data)) >> 20
+		if room_mb > 0 and (opts.memory_budget_mb == 0 or opts.memory_budget_mb > room_mb):
+			tiled = opts.model_copy(update={"memory_budget_mb": room_mb})
+			need = len(data) + estimate_peak_bytes(probe, tiled)
+			if need <= self.budget:
+				return tiled, need, "tiled"
+			opts = tiled
+		max_size = opts.max_size
+		while max_size > MIN_MAX_SIZE:
+			max_size = max(MIN_MAX_SIZE, int(max_size * 0.8))
+			smaller = opts.model_copy(update={"max_size": max_size})
+			need = len(data) + estimate_peak_bytes(probe, smaller)
+			if need <= self.budget:
+				return smaller, need, "downscaled"
+		self._counters["rejected"] += 1
+		raise ImageTooLargeError(f"Image is too large to convert within the {self.budget >> 20} MB memory budget.")
+
+	def _wake(self) -> None:
+		#grant waiters in order while the head fits (cancelled or timed out ones are skipped)
+		while self._waiters:
+			need, fut = self._waiters[0]
+			if fut.done():
+				self._waiters.popleft()
+				continue
+			if self._used + need > self.budget:
+				break
+			self._waiters.popleft()
+			self._used += need
+			fut.set_result(None)
+
+	async def _acquire(self, need: int) -> None:
+		if self.budget <= 0:
+			return
+		if not self._waiters and self._used + need <= self.budget:
+			self._used += need
+			return
+		self._counters["queued"] += 1
+		fut = asyncio.get_running_loop().create_future()
+		self._waiters.append((need, fut))
+		try:
+			await asyncio.wait_for(asyncio.shield(fut), self.timeout)
+		except asyncio.TimeoutError:
+			self._abandon(need, fut)
+			self._counters["timed_out"] += 1
+			raise QueueFullError(max(1, math.ceil(self.timeout / 2)))
+		except asyncio.CancelledError:
+			self._abandon(need, fut)
+			raise
+
+	def _abandon(self, need: int, fut: asyncio.Future) -> None:
+		"""Give up a place in the queue: hand the memory back if it was granted just as the
+		wait ended, and let the waiters behind through if this one was blocking them."""
+		if fut.done() and not fut.cancelled():
+			self._release(need)
+			return
+		fut.cancel()
+		self._wake()
+
+	def _release(self, need: int) -> None:
+		if self.budget <= 0:
+			return
+		self._used -= need
+		self._wake()
+
+	def _release_after(self, need: int, tasks: list) -> None:
+		"""Release need now, or once the pool tasks still running are all done."""
+		pending = [f for f in tasks if not f.done()]
+		if not pending:
+			self._release(need)
+			return
+		loop = asyncio.get_running_loop()
+		left = [len(pending)]
+
+		def done(_):
+			left[0] -= 1
+			if left[0] == 0:
+				self._release(need)
+
+		for f in pending:
+			#done callbacks run on a pool thread: hop back to the loop that owns the waiters
+			f.add_done_callback(lambda f: _call_soon(loop, done, f))
+
+	@asynccontextmanager
+	async def admit(self, data: bytes, opts: ConvertRequestOptions, degrade: bool = True) -> AsyncIterator[Tuple[ConvertRequestOptions, Optional[str]]]:
+		"""Hold the memory of one conversion; yields (options to run with, degradation or None).
+		The memory stays reserved until the pool tasks submitted inside the block are done,
+		also when the request is cancelled while a worker still holds the image."""
+		opts, need, degraded = self.plan(data, opts, degrade)
+		await self._acquire(need)
+		self._counters["admitted"] += 1
+		if degraded:
+			#counted once it runs, not for requests that timed out or went away while queued
+			self._counters["degraded"] += 1
+		with tracking_tasks() as tasks:
+			try:
+				yield opts, degraded
+			finally:
+				self._release_after(need, tasks)
+
+	def stats(self) -> Dict[str, int]:
+		out = dict(self._counters)
+		out.update({"budget_bytes": self.budget, "used_bytes": self._used, "waiting": len(self._waiters)})
+		return out
+
+
+memory_admission = MemoryAdmission(settings.MEMORY_BUDGET_MB * 2**20, settings.ADMISSION_TIMEOUT_SECONDS)
@@ -0,0 +1,235 @@
+"""
+Content-addressed result cache for /magic/convert.
+
+Keys are sha256(upload bytes + normalized options + pipeline version), so the same
+photo with the same settings always maps to the same entry (and the same ETag).
+
+Two tiers:
+- memory: LRU bounded by the total size of the cached artifacts
+- disk (optional): one directory per key with the artifact files and meta.json,
+  evicted least-recently-used first when the directory grows past its budget
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from backend.api.schemas import ConvertRequestOptions, ImageMeta
+from backend.config import settings
+from backend.services.magic import ARTIFACT_NAMES, WorksheetArtifacts, artifact_filename
+
+#bump when the pipeline output changes, so stale entries are never served
+PIPELINE_VERSION = "9"
+
+
+def cache_key(data: bytes, opts: ConvertRequestOptions, variant: str = "") -> str:
+	"""Hex digest identifying (upload bytes, options) for the current pipeline version.
+	variant separates results of the same options computed differently (e.g. warm-started).
+	"""
+	h = hashlib.sha256()
+	h.update(PIPELINE_VERSION.encode("ascii"))
+	h.update(b"\0")
+	if variant:
+		h.update(variant.encode("ascii"))
+		h.update(b"\0")
+	h.update(json.dumps(opts.model_dump(mode="json"), sort_keys=True, separators=(",", ":")).encode("utf-8"))
+	h.update(b"\0")
+	h.update(data)
+	return h.hexdigest()
+
+
+def write_artifacts(directory: Path, artifacts: WorksheetArtifacts) -> int:
+	"""Write one file per artifact + meta.json into directory; returns the bytes written."""
+	size = 0
+	for name, raw in artifacts.items().items():
+		(directory / artifact_filename(name)).write_bytes(raw)
+		size += len(raw)
+	meta = json.dumps({"meta": artifacts.meta.model_dump()})
+	(directory / "meta.json").write_text(meta, encoding="utf-8")
+	return size + len(meta)
+
+
+def read_artifacts(directory: Path) -> WorksheetArtifacts:
+	"""Inverse of write_artifacts; raises OSError/ValueError/KeyError on a missing or corrupt entry."""
+	meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+	fields = {"meta": ImageMeta(**meta["meta"])}
+	for name in ARTIFACT_NAMES:
+		path = directory / artifact_filename(name)
+		fields[name] = path.read_bytes() if path.exists() else None
+	return WorksheetArtifacts(**fields)
+
+
+class ResultCache:
+	"""Two-tier (memory LRU + optional disk) cache of WorksheetArtifacts."""
+
+	def __init__(self, memory_bytes: int, disk_dir: str | None = None, disk_bytes: int = 0):
+		self.memory_bytes = max(0, int(memory_bytes))
+		self.disk_dir = Path(disk_dir) if disk_dir else None
+		self.disk_bytes = max(0, int(disk_bytes))
+		self._lock = threading.Lock()
+		self._memory: "OrderedDict[str, Tuple[WorksheetArtifacts, int]]" = OrderedDict()
+		self._memory_used = 0
+		#key -> (size, last access) for entries on disk
+		self._disk_index: Dict[str, Tuple[int, float]] = {}
+		self._disk_used = 0
+		self._counters = {
+			"memory_hits": 0,
+			"disk_hits": 0,
+			"misses": 0,
+			"memory_evictions": 0,
+			"disk_evictions": 0,
+			"stores": 0,
+		}
+		if self.disk_dir is not None and self.disk_bytes > 0:
+			self.disk_dir.mkdir(parents=True, exist_ok=True)
+			self._scan_disk()
+
+	#---- public API
+
+	def get(self, key: str) -> Optional[WorksheetArtifacts]:
+		with self._lock:
+			entry = self._memory.get(key)
+			if entry is not None:
+				self._memory.move_to_end(key)
+				self._counters["memory_hits"] += 1
+				return entry[0]
+		resp = self._disk_get(key)
+		with self._lock:
+			if resp is None:
+				self._counters["misses"] += 1
+				return None
+			self._counters["disk_hits"] += 1
+			self._memory_put(key, resp)
+		return resp
+
+	def put(self, key: str, resp: WorksheetArtifacts) -> None:
+		with self._lock:
+			self._counters["stores"] += 1
+			self._memory_put(key, resp)
+		self._disk_put(key, resp)
+
+	def stats(self) -> Dict[str, int]:
+		with self._lock:
+			out = dict(self._counters)
+			out.update({
+				"memory_entries": len(self._memory),
+				"memory_bytes": self._memory_used,
+				"memory_budget": self.memory_bytes,
+				"disk_entries": len(self._disk_index),
+				"disk_bytes": self._disk_used,
+				"disk_budget": self.disk_bytes if self.disk_dir is not None else 0,
+			})
+			return out
+
+	def clear(self) -> None:
+		with self._lock:
+			self._memory.clear()
+			self._memory_used = 0
+			keys = list(self._disk_index)
+			self._disk_index.clear()
+			self._disk_used = 0
+		for key in keys:
+			shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+	#---- memory tier (caller holds the lock)
+
+	def _memory_put(self, key: str, resp: WorksheetArtifacts) -> None:
+		size = resp.nbytes + 256
+		if size > self.memory_bytes:
+			return
+		old = self._memory.pop(key, None)
+		if old is not None:
+			self._memory_used -= old[1]
+		self._memory[key] = (resp, size)
+		self._memory_used += size
+		while self._memory_used > self.memory_bytes and self._memory:
+			_, (_, evicted) = self._memory.popitem(last=False)
+			self._memory_used -= evicted
+			self._counters["memory_evictions"] += 1
+
+	#---- disk tier
+
+	def _enabled_disk(self) -> bool:
+		return self.disk_dir is not None and self.disk_bytes > 0
+
+	def _entry_dir(self, key: str) -> Path:
+		assert self.disk_dir is not None
+		return self.disk_dir / key[:2] / key
+
+	def _scan_disk(self) -> None:
+		for meta in self.disk_dir.glob("*/*/meta.json"):
+			entry = meta.parent
+			size = sum(p.stat().st_size for p in entry.iterdir() if p.is_file())
+			self._disk_index[entry.name] = (size, meta.stat().st_mtime)
+			self._disk_used += size
+
+	def _disk_get(self, key: str) -> Optional[WorksheetArtifacts]:
+		if not self._enabled_disk():
+			return None
+		with self._lock:
+			if key not in self._disk_index:
+				return None
+		entry = self._entry_dir(key)
+		try:
+			artifacts = read_artifacts(entry)
+		except (OSError, ValueError, KeyError):
+			#entry vanished or is corrupt: drop it from the index
+			self._disk_forget(key)
+			return None
+		now = time.time()
+		try:
+			os.utime(entry / "meta.json", (now, now))
+		except OSError:
+			pass
+		with self._lock:
+			if key in self._disk_index:
+				self._disk_index[key] = (self._disk_index[key][0], now)
+		return artifacts
+
+	def _disk_put(self, key: str, resp: WorksheetArtifacts) -> None:
+		if not self._enabled_disk():
+			return
+		entry = self._entry_dir(key)
+		if entry.exists():
+			return
+		entry.parent.mkdir(parents=True, exist_ok=True)
+		tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=entry.parent))
+		try:
+			size = write_artifacts(tmp, resp)
+			os.replace(tmp, entry)
+		except OSError:
+			shutil.rmtree(tmp, ignore_errors=True)
+			return
+		with self._lock:
+			self._disk_index[key] = (size, time.time())
+			self._disk_used += size
+			victims = []
+			if self._disk_used > self.disk_bytes:
+				for k, (sz, _) in sorted(self._disk_index.items(), key=lambda kv: kv[1][1]):
+					if self._disk_used <= self.disk_bytes:
+						break
+					victims.append(k)
+					self._disk_used -= sz
+					del self._disk_index[k]
+					self._counters["disk_evictions"] += 1
+		for k in victims:
+			shutil.rmtree(self._entry_dir(k), ignore_errors=True)
+
+	def _disk_forget(self, key: str) -> None:
+		with self._lock:
+			entry = self._disk_index.pop(key, None)
+			if entry is not None:
+				self._disk_used -= entry[0]
+		shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+
+result_cache = ResultCache(settings.CACHE_MEMORY_BYTES, settings.CACHE_DIR, settings.CACHE_DISK_BYTES)
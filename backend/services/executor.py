@@ -0,0 +1,189 @@
+"""
+Execution layer: run CPU-bound conversions off the event loop.
+
+Conversions go to a bounded thread or process pool (OpenCV and most NumPy kernels
+release the GIL, so threads scale too). At most workers + queue_depth conversions
+are admitted at once; beyond that QueueFullError is raised so the API can answer
+503 with Retry-After instead of letting latency pile up. A conversion counts until its
+pool task is done, also when the request awaiting it is cancelled.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from backend.config import settings
+
+
+class QueueFullError(RuntimeError):
+	"""Raised when the conversion queue is full; retry_after is a hint in seconds."""
+
+	def __init__(self, retry_after: int):
+		super().__init__("Server busy, too many conversions in progress. Please retry later.")
+		self.retry_after = retry_after
+
+
+#per worker (thread, or main thread of a worker process): its warm-up error, if any
+_worker = threading.local()
+#pool futures submitted by ConversionExecutor.run in the current context (see tracking_tasks)
+_tracked: ContextVar[Optional[List[Future]]] = ContextVar("magic_tracked_tasks", default=None)
+
+
+@contextmanager
+def tracking_tasks() -> Iterator[List[Future]]:
+	"""Collect the pool futures that run() submits inside the block, e.g. to hold a
+	resource until the workers are done with it even when the caller went away."""
+	tasks: List[Future] = []
+	#set back rather than reset: streaming bodies may leave the block in a copied context
+	previous = _tracked.get()
+	_tracked.set(tasks)
+	try:
+		yield tasks
+	finally:
+		_tracked.set(previous)
+
+
+def _init_worker(warm: bool = False) -> None:
+	#pay the heavy imports once per worker instead of on the first request
+	import cv2
+	import numpy  # noqa: F401
+
+	#workers run side by side: split the cores between them instead of oversubscribing
+	cv2.setNumThreads(settings.CV_THREADS)
+	_worker.warm_error = None
+	if warm:
+		#every worker runs its initializer before its first task: none serves cold
+		from backend.services.startup import warm_conversion
+
+		try:
+			warm_conversion()
+		except Exception as e:
+			#the worker still serves; wait_ready() reports the failure
+			logging.exception("worker warm-up failed: %s", e)
+			_worker.warm_error = f"{type(e).__name__}: {e}"
+
+
+def _worker_ready(barrier=None) -> Optional[str]:
+	"""Warm-up error of the worker running this (None when fine). Waiting at a barrier of
+	one party per worker keeps each worker from taking a second of these tasks."""
+	if barrier is not None:
+		barrier.wait()
+	return getattr(_worker, "warm_error", None)
+
+
+class ConversionExecutor:
+	"""Bounded pool with admission control."""
+
+	def __init__(self, kind: str = "thread", workers: int = 1, queue_depth: int = 0, warm: bool = False):
+		if kind not in ("thread", "process"):
+			raise ValueError(f"Unknown executor kind: {kind}")
+		self.kind = kind
+		#run startup.warm_conversion in every worker's initializer
+		self.warm = warm
+		self.workers = max(1, int(workers))
+		self.queue_depth = max(0, int(queue_depth))
+		self._pool: Executor | None = None
+		self._lock = threading.Lock()
+		self._in_flight = 0
+		self._rejected = 0
+		self._completed = 0
+		#moving average of task durations, used for the Retry-After hint
+		self._avg_seconds = 1.0
+
+	@property
+	def capacity(self) -> int:
+		return self.workers + self.queue_depth
+
+	def start(self) -> Executor:
+		"""Create the pool (workers start with their first tasks, see wait_ready)."""
+		with self._lock:
+			if self._pool is None:
+				if self.kind == "process":
+					self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.warm,))
+				else:
+					self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="magic", initializer=_init_worker, initargs=(self.warm,))
+			return self._pool
+
+	def wait_ready(self, timeout: float = 120.0) -> None:
+		"""Block until every worker is up and initialized (warmed up with warm); raises
+		RuntimeError with the first warm-up error, or when the workers are not all up
+		within timeout seconds (one hung or died in its initializer). One task per worker,
+		held at a barrier until all of them run (a manager barrier for processes)."""
+		pool = self.start()
+		deadline = time.monotonic() + timeout
+		manager = multiprocessing.Manager() if self.kind == "process" else None
+		try:
+			barrier = manager.Barrier(self.workers, timeout=timeout) if manager is not None else threading.Barrier(self.workers, timeout=timeout)
+			futures = [pool.submit(_worker_ready, barrier) for _ in range(self.workers)]
+			errors = [f.result(timeout=max(0.0, deadline - time.monotonic())) for f in futures]
+		except (FutureTimeoutError, threading.BrokenBarrierError) as e:
+			raise RuntimeError(f"workers not ready after {timeout:g} s") from e
+		finally:
+			if manager is not None:
+				manager.shutdown()
+		failed = [e for e in errors if e]
+		if failed:
+			raise RuntimeError(f"{len(failed)} of {self.workers} workers failed to warm up: {failed[0]}")
+
+	def shutdown(self) -> None:
+		with self._lock:
+			pool, self._pool = self._pool, None
+		if pool is not None:
+			pool.shutdown(wait=True, cancel_futures=True)
+
+	def _admit(self) -> None:
+		with self._lock:
+			if self._in_flight >= self.capacity:
+				self._rejected += 1
+				waves = (self._in_flight - self.workers + 1) / self.workers
+				raise QueueFullError(max(1, math.ceil(self._avg_seconds * max(1.0, waves))))
+			self._in_flight += 1
+
+	def _release(self, elapsed: float) -> None:
+		with self._lock:
+			self._in_flight -= 1
+			self._completed += 1
+			self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+	async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+		"""Run fn(*args) in the pool; raises QueueFullError when over capacity.
+		The slot is held until the pool task is done: a caller cancelled while its task
+		runs frees it only when the worker returns (a task not started yet is dropped)."""
+		pool = self.start()
+		self._admit()
+		t0 = time.perf_counter()
+		try:
+			fut = pool.submit(fn, *args)
+		except BaseException:
+			self._release(time.perf_counter() - t0)
+			raise
+		fut.add_done_callback(lambda _: self._release(time.perf_counter() - t0))
+		tracked = _tracked.get()
+		if tracked is not None:
+			tracked.append(fut)
+		return await asyncio.wrap_future(fut)
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"kind": self.kind,
+				"workers": self.workers,
+				"queue_depth": self.queue_depth,
+				"in_flight": self._in_flight,
+				"completed": self._completed,
+				"rejected": self._rejected,
+				"avg_seconds": round(self._avg_seconds, 3),
+			}
+
+
+conversion_executor = ConversionExecutor(settings.EXECUTOR_KIND, settings.EXECUTOR_WORKERS, settings.EXECUTOR_QUEUE_DEPTH, warm=settings.WARMUP)
@@ -0,0 +1,93 @@
+"""
+Multi-frame conversion: one worksheet per frame of an animated GIF/WebP or multi-page TIFF.
+
+Frames are decoded one at a time (ops.io.iter_frames_bgr) and only the frame being
+converted is kept, so memory does not grow with the frame count. Decoding and the reuse
+check run on the caller's side (changed_frames, a generator); each changed frame goes to
+the conversion pool on its own (convert_frame, a plain function of picklable arguments,
+so process workers can run it too):
+
+- palette: one k-means palette for every frame, fitted on pixels sampled from up to
+  PALETTE_FRAMES frames spread over the animation (a first, decode-only pass). Every frame is
+  then mapped to it like a fixed palette, so a number means the same color on every page.
+  A palette given in the options is used as is.
+- reuse: a frame whose THUMB_SIZE px gray thumbnail differs from the last converted frame by
+  at most skip_threshold gray levels on average gets that frame's result again.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend.api.schemas import ConvertRequestOptions
+from backend.ops.io import downscale_max_side, iter_frames_bgr, probe_image
+from backend.ops.quantize import fit_palette, palette_bgr
+from backend.services.magic import WorksheetArtifacts, render_image_artifacts
+from backend.services.palettes import bgr_to_hex
+from backend.services.timing import StageTimer
+
+#frames sampled for the shared palette
+PALETTE_FRAMES = 8
+#long side of the thumbnails compared to detect (almost) unchanged frames
+THUMB_SIZE = 64
+
+
+def frame_count(data: bytes, max_frames: Optional[int] = None) -> int:
+	probe = probe_image(data)
+	n = probe.frames if probe is not None else 1
+	return n if max_frames is None else min(n, max_frames)
+
+
+def shared_palette(data: bytes, opts: ConvertRequestOptions, max_frames: Optional[int] = None) -> List[str]:
+	"""k-means palette ('#rrggbb' list) fitted on pixels of frames spread over the animation."""
+	n = frame_count(data, max_frames)
+	picks = set(np.linspace(0, n - 1, min(n, PALETTE_FRAMES)).round().astype(int).tolist())
+	per_frame = max(1000, (opts.kmeans_sample or 100_000) // len(picks))
+	rng = np.random.default_rng(0)
+	samples = []
+	for i, frame in enumerate(iter_frames_bgr(data, max(picks) + 1)):
+		if i in picks:
+			pixels = downscale_max_side(frame, opts.max_size).reshape((-1, 3))
+			if pixels.shape[0] > per_frame:
+				pixels = pixels[rng.choice(pixels.shape[0], per_frame, replace=False)]
+			samples.append(pixels)
+	k = max(2, min(24, opts.colors))
+	centers, _ = fit_palette(np.concatenate(samples)[:, None, :], k, space=opts.kmeans_space)
+	return bgr_to_hex(palette_bgr(centers, opts.kmeans_space))
+
+
+def _thumb(img: np.ndarray) -> np.ndarray:
+	import cv2
+
+	return cv2.cvtColor(downscale_max_side(img, THUMB_SIZE), cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+def frame_options(data: bytes, opts: ConvertRequestOptions, max_frames: Optional[int] = None) -> ConvertRequestOptions:
+	"""opts with the palette shared by every frame (shared_palette unless opts has one)."""
+	if opts.palette:
+		return opts
+	return opts.model_copy(update={"palette": shared_palette(data, opts, max_frames)})
+
+
+def changed_frames(data: bytes, opts: ConvertRequestOptions, max_frames: Optional[int] = None,
+		skip_threshold: float = 0.5) -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+	"""(frame index, frame downscaled to opts.max_size) for every frame, the frame None when it
+	is close enough to the last changed frame to reuse its result (see the module docstring).
+	"""
+	last_thumb = None
+	for i, frame in enumerate(iter_frames_bgr(data, max_frames)):
+		img = downscale_max_side(frame, opts.max_size)
+		del frame
+		thumb = _thumb(img)
+		if last_thumb is not None and thumb.shape == last_thumb.shape and np.abs(thumb - last_thumb).mean() <= skip_threshold:
+			yield i, None
+			continue
+		last_thumb = thumb
+		yield i, img
+
+
+def convert_frame(img: np.ndarray, opts: ConvertRequestOptions) -> WorksheetArtifacts:
+	"""Artifacts of one frame from changed_frames (opts from frame_options)."""
+	return render_image_artifacts(img, opts, StageTimer())
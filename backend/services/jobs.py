@@ -0,0 +1,502 @@
+"""
+Asynchronous conversion jobs: submit, poll status and progress, fetch results, cancel.
+
+A job runs the same pipeline as /magic/convert on the shared conversion pool, at most
+one job per worker so synchronous requests still get a turn. Job records and, once
+done, their artifacts live in a JobStore until the TTL expires:
+- MemoryJobStore (default): everything in process; results are also bounded in bytes
+  (MAGIC_JOBS_MEMORY_BYTES), the oldest ones go first and their jobs answer 404 for them
+- DiskJobStore: one directory per job (job.json + artifact files), survives restarts
+
+Progress and cancellation go through the stage timer of the run: the Job itself in a
+thread pool, a shared dict (multiprocessing manager proxy) in a process pool.
+
+Admission control: at most max_queued jobs may wait for a worker, beyond that
+submit raises QueueFullError (503 + Retry-After at the API).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from backend.api.schemas import ConvertRequestOptions
+from backend.config import settings
+from backend.services.admission import memory_admission
+from backend.services.cache import cache_key, read_artifacts, result_cache, write_artifacts
+from backend.services.executor import ConversionExecutor, QueueFullError, conversion_executor
+from backend.services.magic import WorksheetArtifacts, planned_stages, render_worksheet_artifacts
+from backend.services.metrics import conversions_total, observe_pipeline
+from backend.services.timing import StageTimer
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+TERMINAL_STATES = ("done", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+	"""Raised inside the pipeline at the next stage boundary once a job is cancelled."""
+
+
+class Job:
+	"""State of one conversion job (times are epoch seconds)."""
+
+	__slots__ = ("id", "key", "status", "stage", "stages", "planned", "error", "cached",
+		"created", "started", "finished", "expires", "cancel_requested")
+
+	def __init__(self, id: str, key: str, planned: List[str], created: float | None = None):
+		self.id = id
+		self.key = key
+		self.status = "queued"
+		#current stage, and finished stage -> wall ms
+		self.stage: Optional[str] = None
+		self.stages: Dict[str, float] = {}
+		self.planned = planned
+		self.error: Optional[str] = None
+		self.cached = False
+		self.created = created if created is not None else time.time()
+		self.started: Optional[float] = None
+		self.finished: Optional[float] = None
+		self.expires: Optional[float] = None
+		self.cancel_requested = False
+
+	@property
+	def terminal(self) -> bool:
+		return self.status in TERMINAL_STATES
+
+	@property
+	def progress(self) -> float:
+		if self.status == "done":
+			return 1.0
+		return round(len(self.stages) / max(1, len(self.planned)), 3)
+
+	def to_dict(self) -> Dict[str, Any]:
+		return {
+			"id": self.id,
+			"status": self.status,
+			"stage": self.stage,
+			"progress": self.progress,
+			"stages": {name: round(ms, 1) for name, ms in self.stages.items()},
+			"planned": list(self.planned),
+			"error": self.error,
+			"cached": self.cached,
+			"created_at": self.created,
+			"started_at": self.started,
+			"finished_at": self.finished,
+			"expires_at": self.expires,
+			"key": self.key,
+		}
+
+	@classmethod
+	def from_dict(cls, d: Dict[str, Any]) -> "Job":
+		job = cls(d["id"], d["key"], list(d.get("planned") or []), created=d.get("created_at"))
+		job.status = d["status"]
+		job.stage = d.get("stage")
+		job.stages = dict(d.get("stages") or {})
+		job.error = d.get("error")
+		job.cached = bool(d.get("cached"))
+		job.started = d.get("started_at")
+		job.finished = d.get("finished_at")
+		job.expires = d.get("expires_at")
+		return job
+
+
+class JobTimer(StageTimer):
+	"""StageTimer that publishes progress on its job and stops a cancelled job between stages."""
+
+	__slots__ = ("job",)
+
+	def __init__(self, job: Job):
+		super().__init__()
+		self.job = job
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		if self.job.cancel_requested:
+			raise JobCancelled()
+		self.job.stage = name
+		with super().stage(name):
+			yield
+		self.job.stages[name] = self.timings[name]
+
+
+class SharedJobTimer(StageTimer):
+	"""JobTimer for process pools: the stage, finished stages ("stage:<name>" -> ms) and the
+	cancel flag live in a manager dict, which is picklable and shared with the worker."""
+
+	__slots__ = ("state",)
+
+	def __init__(self, state):
+		super().__init__()
+		self.state = state
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		if self.state.get("cancel"):
+			raise JobCancelled()
+		self.state["stage"] = name
+		with super().stage(name):
+			yield
+		self.state[f"stage:{name}"] = self.timings[name]
+
+
+#---- stores
+
+class JobStore(ABC):
+	"""Job records and results; subclasses keep them in memory or on disk."""
+
+	#results dropped before their job expired (size limits)
+	evictions = 0
+
+	@abstractmethod
+	def put(self, job: Job) -> None: ...
+
+	@abstractmethod
+	def get(self, job_id: str) -> Optional[Job]: ...
+
+	@abstractmethod
+	def put_result(self, job_id: str, artifacts: WorksheetArtifacts) -> None: ...
+
+	@abstractmethod
+	def get_result(self, job_id: str) -> Optional[WorksheetArtifacts]: ...
+
+	@abstractmethod
+	def delete(self, job_id: str) -> None: ...
+
+	@abstractmethod
+	def ids(self) -> List[str]: ...
+
+	def sweep(self, now: float | None = None) -> int:
+		"""Delete jobs past their expiry; returns how many were removed."""
+		now = time.time() if now is None else now
+		removed = 0
+		for job_id in self.ids():
+			job = self.get(job_id)
+			if job is not None and job.expires is not None and job.expires <= now:
+				self.delete(job_id)
+				removed += 1
+		return removed
+
+
+class MemoryJobStore(JobStore):
+	"""Jobs and results in process; results take at most max_result_bytes, oldest evicted first."""
+
+	def __init__(self, max_result_bytes: int = 256 * 1024 * 1024):
+		self.max_result_bytes = max(0, int(max_result_bytes))
+		self._lock = threading.Lock()
+		self._jobs: Dict[str, Job] = {}
+		#job id -> (artifacts, bytes), oldest first
+		self._results: "OrderedDict[str, Tuple[WorksheetArtifacts, int]]" = OrderedDict()
+		self._result_bytes = 0
+
+	def put(self, job: Job) -> None:
+		with self._lock:
+			self._jobs[job.id] = job
+
+	def get(self, job_id: str) -> Optional[Job]:
+		with self._lock:
+			return self._jobs.get(job_id)
+
+	def put_result(self, job_id: str, artifacts: WorksheetArtifacts) -> None:
+		size = artifacts.nbytes + 256
+		with self._lock:
+			self._drop_result(job_id)
+			self._results[job_id] = (artifacts, size)
+			self._result_bytes += size
+			#the newest result stays even alone over the limit: its job just finished
+			while self._result_bytes > self.max_result_bytes and len(self._results) > 1:
+				self._drop_result(next(iter(self._results)))
+				self.evictions += 1
+
+	def get_result(self, job_id: str) -> Optional[WorksheetArtifacts]:
+		with self._lock:
+			entry = self._results.get(job_id)
+			return entry[0] if entry is not None else None
+
+	def delete(self, job_id: str) -> None:
+		with self._lock:
+			self._jobs.pop(job_id, None)
+			self._drop_result(job_id)
+
+	def _drop_result(self, job_id: str) -> None:
+		#caller holds the lock
+		entry = self._results.pop(job_id, None)
+		if entry is not None:
+			self._result_bytes -= entry[1]
+
+	def ids(self) -> List[str]:
+		with self._lock:
+			return list(self._jobs)
+
+
+class DiskJobStore(JobStore):
+	"""<dir>/<job id>/job.json, plus result/ holding the artifacts once the job is done."""
+
+	def __init__(self, directory: str):
+		self.dir = Path(directory)
+		self.dir.mkdir(parents=True, exist_ok=True)
+
+	def _entry(self, job_id: str) -> Path:
+		#ids are generated hex strings; anything else never maps to a path
+		if not job_id.isalnum():
+			raise KeyError(job_id)
+		return self.dir / job_id
+
+	def put(self, job: Job) -> None:
+		entry = self._entry(job.id)
+		entry.mkdir(exist_ok=True)
+		fd, tmp = tempfile.mkstemp(prefix=".job-", dir=entry)
+		with os.fdopen(fd, "w", encoding="utf-8") as f:
+			json.dump(job.to_dict(), f)
+		os.replace(tmp, entry / "job.json")
+
+	def get(self, job_id: str) -> Optional[Job]:
+		try:
+			return Job.from_dict(json.loads((self._entry(job_id) / "job.json").read_text(encoding="utf-8")))
+		except (OSError, ValueError, KeyError):
+			return None
+
+	def put_result(self, job_id: str, artifacts: WorksheetArtifacts) -> None:
+		entry = self._entry(job_id)
+		tmp = Path(tempfile.mkdtemp(prefix=".result-", dir=entry))
+		write_artifacts(tmp, artifacts)
+		os.replace(tmp, entry / "result")
+
+	def get_result(self, job_id: str) -> Optional[WorksheetArtifacts]:
+		try:
+			return read_artifacts(self._entry(job_id) / "result")
+		except (OSError, ValueError, KeyError):
+			return None
+
+	def delete(self, job_id: str) -> None:
+		try:
+			shutil.rmtree(self._entry(job_id), ignore_errors=True)
+		except KeyError:
+			pass
+
+	def ids(self) -> List[str]:
+		return [p.name for p in self.dir.iterdir() if p.is_dir() and (p / "job.json").exists()]
+
+
+def make_store(kind: str, directory: str | None = None, memory_bytes: int = 256 * 1024 * 1024) -> JobStore:
+	if kind == "memory":
+		return MemoryJobStore(memory_bytes)
+	if kind == "disk":
+		if not directory:
+			raise ValueError("The disk job store needs a directory (MAGIC_JOBS_DIR)")
+		return DiskJobStore(directory)
+	raise ValueError(f"Unknown job store: {kind}")
+
+
+#---- manager
+
+class JobManager:
+	"""Queue of conversion jobs running on a ConversionExecutor."""
+
+	def __init__(self, store: JobStore, executor: ConversionExecutor, ttl: float = 3600.0, max_queued: int = 64):
+		self.store = store
+		self.executor = executor
+		self.ttl = float(ttl)
+		self.max_queued = max(0, int(max_queued))
+		#jobs not finished yet, with live progress (the store may only hold snapshots)
+		self._active: Dict[str, Job] = {}
+		self._tasks: Dict[str, asyncio.Task] = {}
+		#jobs whose conversion was handed to the executor (the others can be cancelled outright)
+		self._in_pool: set = set()
+		self._slots: Optional[asyncio.Semaphore] = None
+		#process pools: manager and the shared progress dict of each running job
+		self._manager = None
+		self._shared: Dict[str, Any] = {}
+		self._last_sweep = 0.0
+		self._counters = {"submitted": 0, "done": 0, "failed": 0, "cancelled": 0, "rejected": 0, "expired": 0}
+
+	def start(self) -> None:
+		#called from the serving event loop: the semaphore belongs to it
+		self._slots = asyncio.Semaphore(self.executor.workers)
+		#jobs left unfinished by a previous process (disk store) will never complete
+		for job_id in self.store.ids():
+			job = self.store.get(job_id)
+			if job is not None and not job.terminal:
+				self._finish(job, "failed", error="Interrupted by a server restart.")
+
+	async def shutdown(self) -> None:
+		tasks = list(self._tasks.values())
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		if self._manager is not None:
+			self._manager.shutdown()
+			self._manager = None
+
+	def _queued(self) -> int:
+		return sum(1 for job in self._active.values() if job.status == "queued")
+
+	def _retry_after(self) -> int:
+		stats = self.executor.stats()
+		waves = (self._queued() + 1) / self.executor.workers
+		return max(1, math.ceil(stats["avg_seconds"] * waves))
+
+	def submit(self, data: bytes, opts: ConvertRequestOptions) -> Job:
+		"""Queue a conversion; raises QueueFullError when max_queued jobs are already waiting."""
+		self._maybe_sweep()
+		if self._queued() >= self.max_queued:
+			self._counters["rejected"] += 1
+			raise QueueFullError(self._retry_after())
+		if self._slots is None:
+			self._slots = asyncio.Semaphore(self.executor.workers)
+		job = Job(uuid.uuid4().hex, cache_key(data, opts), planned_stages(opts))
+		self._active[job.id] = job
+		self.store.put(job)
+		self._counters["submitted"] += 1
+		self._tasks[job.id] = asyncio.get_running_loop().create_task(self._run(job, data, opts))
+		return job
+
+	async def _run(self, job: Job, data: bytes, opts: ConvertRequestOptions) -> None:
+		try:
+			async with self._slots:
+				if job.cancel_requested:
+					raise JobCancelled()
+				job.status = "running"
+				job.started = time.time()
+				self.store.put(job)
+				artifacts = result_cache.get(job.key)
+				if artifacts is not None:
+					job.cached = True
+					job.stages = dict(artifacts.timings)
+					conversions_total.inc(source="cache")
+				else:
+					artifacts, degraded = await self._convert(job, data, opts)
+					if job.cancel_requested:
+						#process pools cannot stop mid-way: drop the result
+						raise JobCancelled()
+					if not degraded:
+						result_cache.put(job.key, artifacts)
+					conversions_total.inc(source="pipeline")
+					observe_pipeline(artifacts.timings, artifacts.meta.num_regions, artifacts.meta.merge_iterations)
+			self.store.put_result(job.id, artifacts)
+			self._finish(job, "done")
+		except (JobCancelled, asyncio.CancelledError):
+			self._finish(job, "cancelled")
+		except Exception as e:
+			self._finish(job, "failed", error=str(e))
+		finally:
+			self._tasks.pop(job.id, None)
+
+	async def _convert(self, job: Job, data: bytes, opts: ConvertRequestOptions) -> Tuple[WorksheetArtifacts, Optional[str]]:
+		"""(artifacts, degradation applied by memory admission or None)."""
+		if self.executor.kind == "thread":
+			timer = JobTimer(job)
+		else:
+			if self._manager is None:
+				self._manager = multiprocessing.Manager()
+			state = self._shared[job.id] = self._manager.dict(cancel=job.cancel_requested, stage=None)
+			timer = SharedJobTimer(state)
+		try:
+			while True:
+				if job.cancel_requested:
+					raise JobCancelled()
+				try:
+					async with memory_admission.admit(data, opts) as (run_opts, degraded):
+						#executor.run admits and submits without awaiting in between
+						self._in_pool.add(job.id)
+						return await self.executor.run(render_worksheet_artifacts, data, run_opts, timer), degraded
+				except QueueFullError as e:
+					self._in_pool.discard(job.id)
+					#the pool and the memory budget are shared with synchronous requests: wait for room
+					await asyncio.sleep(min(1.0, e.retry_after))
+		finally:
+			self._in_pool.discard(job.id)
+			#final progress of a process worker, then forget its dict
+			self._sync_shared(job)
+			self._shared.pop(job.id, None)
+
+	def _finish(self, job: Job, status: str, error: str | None = None) -> None:
+		job.status = status
+		job.error = error
+		job.stage = None
+		job.finished = time.time()
+		job.expires = job.finished + self.ttl
+		self._counters[status] += 1
+		self._active.pop(job.id, None)
+		self.store.put(job)
+
+	def _sync_shared(self, job: Job) -> None:
+		"""Copy the progress a process worker published into job."""
+		state = self._shared.get(job.id)
+		if state is None:
+			return
+		try:
+			snapshot = state.copy()
+		except (OSError, EOFError):
+			#manager gone (shutdown)
+			return
+		job.stage = snapshot.get("stage")
+		job.stages = {k[len("stage:"):]: v for k, v in snapshot.items() if k.startswith("stage:")}
+
+	def get(self, job_id: str) -> Optional[Job]:
+		self._maybe_sweep()
+		job = self._active.get(job_id)
+		if job is not None:
+			self._sync_shared(job)
+		else:
+			job = self.store.get(job_id)
+		if job is not None and job.expires is not None and job.expires <= time.time():
+			return None
+		return job
+
+	def result(self, job_id: str) -> Optional[WorksheetArtifacts]:
+		job = self.get(job_id)
+		if job is None or job.status != "done":
+			return None
+		return self.store.get_result(job_id)
+
+	def cancel(self, job_id: str) -> Optional[Job]:
+		"""Cancel a queued/running job (running ones stop at the next stage), or delete a finished one."""
+		job = self.get(job_id)
+		if job is None:
+			return None
+		if job.terminal:
+			self.store.delete(job_id)
+			return job
+		job.cancel_requested = True
+		state = self._shared.get(job_id)
+		if state is not None:
+			state["cancel"] = True
+		task = self._tasks.get(job_id)
+		if task is not None and job_id not in self._in_pool:
+			#queued, or running but still waiting for memory or a pool slot
+			task.cancel()
+		return job
+
+	def _maybe_sweep(self) -> None:
+		now = time.time()
+		if now - self._last_sweep < 1.0:
+			return
+		self._last_sweep = now
+		self._counters["expired"] += self.store.sweep(now)
+
+	def stats(self) -> Dict[str, int]:
+		out = dict(self._counters)
+		out.update({
+			"queued": self._queued(),
+			"running": sum(1 for job in self._active.values() if job.status == "running"),
+			"max_queued": self.max_queued,
+			"results_evicted": self.store.evictions,
+		})
+		return out
+
+
+job_manager = JobManager(make_store(settings.JOBS_STORE, settings.JOBS_DIR, settings.JOBS_MEMORY_BYTES), conversion_executor,
+	ttl=settings.JOBS_TTL_SECONDS, max_queued=settings.JOBS_MAX_QUEUED)
@@ -6,65 +6,328 @@ This generates a basic "coloriage": white page with black outline of the photo.
 
 from __future__ import annotations
 
-from typing import Tuple
+import base64
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
-from backend.ops.io import decode_image_bytes, pil_to_numpy_bgr, downscale_max_side, encode_png_base64
-from backend.ops.outline import outline_edges
-from backend.ops.render import compose_worksheet, draw_numbers, labels_viz, legend_viz, overlay_legend_on_worksheet
-from backend.api.schemas import ConvertRequestOptions, ConvertResponse, ImageMeta
-from backend.ops.quantize import quantize_bgr_kmeans
-from backend.ops.segments import extract_regions, median_smooth_labels, merge_micro_regions, outline_from_labels
-from backend.ops.placing import place_numbers
+from backend.ops.io import ImageProbe, decode_image_bgr, downscale_max_side, encode_indexed, encode_raster
+from backend.ops.outline import outline_union
+from backend.ops.render import index_worksheet, legend_viz, worksheet_gray, worksheet_palette
+from backend.api.schemas import OUTPUTS, ConvertRequestOptions, ConvertResponse, ImageMeta
+from backend.ops.quantize import assign_labels, fit_palette, label_dtype, palette_bgr, quantize_to_palette
+from backend.ops.segments import extract_regions, median_smooth_labels, merge_micro_regions
+from backend.ops.placing import PLACEMENT_HALO, place_numbers
+from backend.ops.tiles import band_rows_for_budget, is_tiled, map_bands
+from backend.services.palettes import hex_to_bgr
+from backend.services.timing import StageTimer
+from backend.ops.vector import trace_label_boundaries, worksheet_pdf, worksheet_svg
+
+
+ARTIFACT_NAMES = ("worksheet_png", "preview_png", "labels_png", "legend_png", "worksheet_svg", "worksheet_pdf")
+
+RASTER_ARTIFACTS = frozenset(("worksheet_png", "preview_png", "labels_png", "legend_png"))
+
+ARTIFACT_MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "svg": "image/svg+xml", "pdf": "application/pdf"}
+
+#outputs= value -> artifact it produces ("meta" has none, meta is always returned)
+OUTPUT_ARTIFACTS = {
+	"worksheet": "worksheet_png",
+	"preview": "preview_png",
+	"labels": "labels_png",
+	"legend": "legend_png",
+	"svg": "worksheet_svg",
+	"pdf": "worksheet_pdf",
+	"meta": None,
+}
+
+
+#memory model of the tiled mode, in bytes per output pixel: full-frame planes that stay
+#resident (input, label maps, component map + its labelling temporaries, edges, worksheet),
+#extra resident planes per requested full-frame image, and the temporaries of one band of
+#rows (the placement keys dominate); measured with tracemalloc at 4096 px
+RESIDENT_BYTES_PER_PX = 24
+OUTPUT_BYTES_PER_PX = 3
+BAND_BYTES_PER_PX = 32
+#decode on top of Pillow's own image, per decoded pixel: the BGR bytes are produced in chunks
+#then joined (2 x 3); measured with tracemalloc
+DECODE_BYTES_PER_PX = 6
+#a memory budget never fits the palette on every pixel (12 bytes per pixel of float32 samples)
+TILED_KMEANS_SAMPLE = 100_000
+
+
+def plan_band_rows(opts: ConvertRequestOptions, h: int, w: int, want: frozenset) -> int:
+	"""Band height that keeps the estimated peak under opts.memory_budget_mb (0 = untiled)."""
+	extra = len(want & {"preview_png", "labels_png"}) * OUTPUT_BYTES_PER_PX
+	return band_rows_for_budget(h, w, opts.memory_budget_mb * 2**20, RESIDENT_BYTES_PER_PX + extra,
+		BAND_BYTES_PER_PX, halo=PLACEMENT_HALO)
+
+
+def estimate_peak_bytes(probe: Optional[ImageProbe], opts: ConvertRequestOptions) -> int:
+	"""Estimated peak memory of render_worksheet_artifacts for an image with this header:
+	the decode (Pillow's image + the BGR copies, at the JPEG draft scale) or the pipeline at
+	max_size (tiled when opts.memory_budget_mb asks for it), whichever is larger.
+	Unknown formats are costed as a max_size square.
+	"""
+	if probe is None:
+		probe = ImageProbe(None, opts.max_size, opts.max_size, "RGB")
+	dw, dh = probe.decoded_size(opts.max_size)
+	scale = min(1.0, opts.max_size / float(max(dw, dh)))
+	w, h = max(1, round(dw * scale)), max(1, round(dh * scale))
+	decode = dw * dh * (probe.bytes_per_px + DECODE_BYTES_PER_PX) + (w * h * 3 if scale < 1.0 else 0)
+	want = requested_artifacts(opts)
+	extra = len(want & {"preview_png", "labels_png"}) * OUTPUT_BYTES_PER_PX
+	band_rows = plan_band_rows(opts, h, w, want)
+	band = (min(h, band_rows + 2 * PLACEMENT_HALO) if is_tiled(h, band_rows) else h) * w * BAND_BYTES_PER_PX
+	return int(max(decode, h * w * (RESIDENT_BYTES_PER_PX + extra) + band))
+
+
+def requested_artifacts(opts: ConvertRequestOptions) -> frozenset:
+	"""Artifact names a request asks for: opts.outputs, or the legacy flags when unset."""
+	if opts.outputs is not None:
+		return frozenset(OUTPUT_ARTIFACTS[o] for o in opts.outputs if OUTPUT_ARTIFACTS[o])
+	names = {"worksheet_png", "legend_png"}
+	if opts.include_preview:
+		names.update(("preview_png", "labels_png"))
+	if opts.return_svg:
+		names.add("worksheet_svg")
+	if opts.return_pdf:
+		names.add("worksheet_pdf")
+	return frozenset(names)
+
+
+def planned_stages(opts: ConvertRequestOptions) -> List[str]:
+	"""Timer stages render_worksheet_artifacts will go through for opts, in order."""
+	want = requested_artifacts(opts)
+	vector = want & {"worksheet_svg", "worksheet_pdf"}
+	need_places = "worksheet_png" in want or bool(vector)
+	stages = ["decode", "downscale", "palette" if opts.palette else "kmeans", "smooth", "merge"]
+	stages += ["outline", "regions", "placement"] if need_places else ["regions"]
+	if want & {"worksheet_png", "legend_png"}:
+		stages.append("render")
+	if want & RASTER_ARTIFACTS:
+		stages.append("encode")
+	if vector:
+		stages.append("vector")
+	return stages
+
+
+#longest side of the quick first result of a progressive conversion
+PROGRESSIVE_PREVIEW_SIZE = 256
+
+
+def progressive_preview_options(opts: ConvertRequestOptions, size: int = PROGRESSIVE_PREVIEW_SIZE) -> Optional[ConvertRequestOptions]:
+	"""Options of the low-res worksheet + preview pass, None when opts is not larger than that.
+	Areas scale with the image so the low-res regions match the final ones, only coarser.
+	"""
+	if opts.max_size <= size:
+		return None
+	scale = (size / float(opts.max_size)) ** 2
+	return opts.model_copy(update={
+		"max_size": size,
+		"min_area": max(1, round(opts.min_area * scale)),
+		"merge_area": max(1, round(opts.merge_area * scale)),
+		"outputs": ["worksheet", "preview"],
+		"memory_budget_mb": 0,
+	})
+
+
+def with_output(opts: ConvertRequestOptions, output: str) -> ConvertRequestOptions:
+	"""Copy of opts that also produces output (e.g. the file a single-file format returns)."""
+	if opts.outputs is not None:
+		return opts if output in opts.outputs else opts.model_copy(update={"outputs": [o for o in OUTPUTS if o in opts.outputs or o == output]})
+	if output in ("svg", "pdf"):
+		return opts.model_copy(update={f"return_{output}": True})
+	return opts
+
+
+def _artifact_ext(name: str, body: Optional[bytes]) -> str:
+	#raster artifacts keep their *_png name when encoded as WebP (raster_format=webp)
+	if body is not None and body[:4] == b"RIFF" and body[8:12] == b"WEBP":
+		return "webp"
+	return name.rsplit("_", 1)[1]
+
+
+def artifact_filename(name: str, body: Optional[bytes] = None) -> str:
+	"""worksheet_png -> worksheet.png (worksheet.webp when body is a WebP)"""
+	return f"{name.rsplit('_', 1)[0]}.{_artifact_ext(name, body)}"
+
+
+def artifact_media_type(name: str, body: Optional[bytes] = None) -> str:
+	return ARTIFACT_MEDIA_TYPES[_artifact_ext(name, body)]
+
+
+class WorksheetArtifacts:
+	"""Encoded outputs of one conversion: raw file bytes per artifact (None if not produced) + meta."""
+
+	__slots__ = ARTIFACT_NAMES + ("meta", "timings", "sizes", "palette")
+
+	def __init__(self, meta: ImageMeta, worksheet_png: Optional[bytes] = None, preview_png: Optional[bytes] = None,
+			labels_png: Optional[bytes] = None, legend_png: Optional[bytes] = None,
+			worksheet_svg: Optional[bytes] = None, worksheet_pdf: Optional[bytes] = None,
+			timings: Optional[Dict[str, float]] = None, sizes: Optional[Dict[str, int]] = None,
+			palette: Optional[np.ndarray] = None):
+		self.meta = meta
+		self.worksheet_png = worksheet_png
+		self.preview_png = preview_png
+		self.labels_png = labels_png
+		self.legend_png = legend_png
+		self.worksheet_svg = worksheet_svg
+		self.worksheet_pdf = worksheet_pdf
+		#stage -> wall ms / output bytes of the run that produced these artifacts
+		self.timings = timings or {}
+		self.sizes = sizes or {}
+		#(k, 3) BGR palette of the run, to warm-start another one (not kept by the disk cache)
+		self.palette = palette
+
+	def items(self) -> Dict[str, bytes]:
+		"""Produced artifacts, in ARTIFACT_NAMES order."""
+		out: Dict[str, bytes] = {}
+		for name in ARTIFACT_NAMES:
+			value = getattr(self, name)
+			if value is not None:
+				out[name] = value
+		return out
+
+	@property
+	def nbytes(self) -> int:
+		return sum(len(v) for v in self.items().values())
+
+	def to_response(self) -> ConvertResponse:
+		fields = {name: base64.b64encode(value).decode("ascii") for name, value in self.items().items()}
+		return ConvertResponse(meta=self.meta, **fields)
 
 
 def convert_image_bytes_to_worksheet(data: bytes, opts: ConvertRequestOptions) -> ConvertResponse:
-	#1) decode and convert to BGR
-	pil = decode_image_bytes(data)
-	img = pil_to_numpy_bgr(pil)
+	"""Full pipeline, JSON-ready response with base64 PNGs."""
+	return render_worksheet_artifacts(data, opts).to_response()
+
+
+def render_worksheet_artifacts(data: bytes, opts: ConvertRequestOptions, timer: Optional[StageTimer] = None,
+		init_palette: Optional[np.ndarray] = None) -> WorksheetArtifacts:
+	"""Full pipeline; stage wall times and output sizes are recorded in timer (and on the result).
+	init_palette: k-means starting colours, e.g. the palette of a low-res run of the same image.
+	"""
+	t = timer if timer is not None else StageTimer()
+	#1) decode straight to BGR, JPEGs at a reduced scale close to max_size
+	with t.stage("decode"):
+		img = decode_image_bgr(data, max_side=opts.max_size)
+	t.size("decode", img.nbytes)
+	return render_image_artifacts(img, opts, t, init_palette)
+
+
+def render_image_artifacts(img: np.ndarray, opts: ConvertRequestOptions, timer: Optional[StageTimer] = None,
+		init_palette: Optional[np.ndarray] = None) -> WorksheetArtifacts:
+	"""render_worksheet_artifacts for an image decoded already (BGR uint8), e.g. one frame of an animation."""
+	t = timer if timer is not None else StageTimer()
 	#2) downscale to control runtime
-	img = downscale_max_side(img, opts.max_size)
+	with t.stage("downscale"):
+		img = downscale_max_side(img, opts.max_size)
+	t.size("downscale", img.nbytes)
 	h, w = img.shape[:2]
 
-	#3) color quantization (preview)
-	q_bgr, labels, palette = quantize_bgr_kmeans(img, max(2, min(24, opts.colors)))
+	want = requested_artifacts(opts)
+	vector = want & {"worksheet_svg", "worksheet_pdf"}
+	#numbers are placed for the raster and vector worksheets, both need the outlines
+	need_places = "worksheet_png" in want or bool(vector)
+	#memory budget: row bands for every local stage, only the component labelling stays global
+	band_rows = plan_band_rows(opts, h, w, want)
+	tiled = is_tiled(h, band_rows)
+
+	#3) color quantization (preview); everything up to the merge is needed by every output (meta counts regions)
+	k = max(2, min(24, opts.colors))
+	quant_stage = "palette" if opts.palette else "kmeans"
+	with t.stage(quant_stage):
+		if opts.palette:
+			#fixed palette: one cached-table lookup per pixel, no k-means
+			palette = hex_to_bgr(opts.palette)
+			quantize = lambda band: quantize_to_palette(band, palette)
+			labels = None
+		else:
+			#on a memory budget the palette is always fitted on a sample, then assigned band by band
+			sample = (opts.kmeans_sample or TILED_KMEANS_SAMPLE) if tiled else opts.kmeans_sample
+			centers, labels = fit_palette(img, k, sample_size=sample, space=opts.kmeans_space, init_palette=init_palette)
+			palette = palette_bgr(centers, opts.kmeans_space)
+			quantize = lambda band: assign_labels(band, centers, opts.kmeans_space)
+		dtype = label_dtype(palette.shape[0])
+		if labels is not None:
+			#the fit used every pixel, k-means labelled them already
+			labels = labels.reshape((h, w)).astype(dtype, copy=False)
+		elif tiled:
+			labels = map_bands(quantize, img, band_rows, 0, np.empty((h, w), dtype=dtype))
+		else:
+			labels = quantize(img)
+	t.size(quant_stage, labels.nbytes)
+	#the preview is encoded from the unsmoothed labels (smoothing works in place when tiled)
+	raw_labels = None
+	if "preview_png" in want:
+		raw_labels = labels.copy() if tiled else labels
 	#3b) label smoothing + merge of micro-regions
-	labels = median_smooth_labels(labels, ksize=3)
-	labels = merge_micro_regions(labels, min_area=opts.merge_area)
+	with t.stage("smooth"):
+		labels = median_smooth_labels(labels, ksize=3, band_rows=band_rows, inplace=tiled)
+	merge_stats: Dict = {}
+	with t.stage("merge"):
+		labels = merge_micro_regions(labels, min_area=opts.merge_area, engine=opts.merge_engine, stats=merge_stats)
+	t.size("merge", labels.nbytes)
 
 	#4) outlines
-	labels_edges = outline_from_labels(labels, thickness=opts.thickness)
-	if (opts.outline_mode or "union").lower() == "union":
-		canny_edges = outline_edges(img, thickness=opts.thickness)
-		import cv2
-		edges = cv2.bitwise_or(labels_edges, canny_edges)
-	else:
-		edges = labels_edges
-
-	#5) render worksheet (white + outline)
-	worksheet = compose_worksheet(edges, (h, w, 3))
-
-	#6)regions and placement
-	regions = extract_regions(labels, min_area=opts.min_area)
-	places = place_numbers(regions)
-	worksheet = draw_numbers(worksheet, places)
-
-	#7)legend image and overlay
-	legend_img = legend_viz(palette, box_size=32)
-	worksheet_with_legend = overlay_legend_on_worksheet(worksheet, legend_img, margin=12, alpha=0.95)
-
-	#8)pack response (with preview and optional labels viz)
-	worksheet_png = encode_png_base64(worksheet_with_legend)
-	preview_png = encode_png_base64(q_bgr) if opts.include_preview else None
-	labels_img = labels_viz(labels, palette)
-	labels_png = encode_png_base64(labels_img) if opts.include_preview else None
-	legend_png = encode_png_base64(legend_img)
-	meta = ImageMeta(width=w, height=h, colors=int(palette.shape[0]), num_regions=len(regions))
-	return ConvertResponse(
-		worksheet_png=worksheet_png,
-		preview_png=preview_png,
-		labels_png=labels_png,
-		legend_png=legend_png,
+	edges = None
+	if need_places:
+		with t.stage("outline"):
+			union = (opts.outline_mode or "union").lower() == "union"
+			edges = outline_union(labels, img if union else None, thickness=opts.thickness, band_rows=band_rows)
+		t.size("outline", edges.nbytes)
+	#the input image is not needed past this point
+	del img
+
+	#5)regions (always, for meta) and placement
+	with t.stage("regions"):
+		regions = extract_regions(labels, min_area=opts.min_area)
+	places = []
+	if need_places:
+		with t.stage("placement"):
+			places = place_numbers(regions, outline_mask=edges, band_rows=band_rows, with_radius=True)
+
+	#6) render what was asked for: the legend, and the worksheet (white page + outline + numbers +
+	#legend overlay) straight to palette indices, no color image
+	sheet = sheet_palette = legend_img = None
+	number_stats: Dict[str, int] = {}
+	if want & {"worksheet_png", "legend_png"}:
+		with t.stage("render"):
+			legend_img = legend_viz(palette, box_size=32)
+			if "worksheet_png" in want:
+				#the outline mask is not needed past this point, it becomes the page
+				sheet = worksheet_gray(edges, places, inplace=True, stats=number_stats)
+				sheet_palette = worksheet_palette(palette)
+				sheet = index_worksheet(sheet, legend_img, sheet_palette, palette.shape[0], margin=12, alpha=0.95, inplace=True)
+		t.size("render", sum(a.nbytes for a in (sheet, legend_img) if a is not None))
+
+	#7)encode only the requested images, indexed ones from their label map / palette indices
+	encoded: Dict[str, Optional[bytes]] = {}
+	indexed = {"worksheet_png": (sheet, sheet_palette), "preview_png": (raw_labels, palette), "labels_png": (labels, palette)}
+	if want & RASTER_ARTIFACTS:
+		with t.stage("encode"):
+			for name, (indices, colors) in indexed.items():
+				if name in want:
+					encoded[name] = encode_indexed(indices, colors, opts.raster_format, opts.compression)
+			if "legend_png" in want:
+				encoded["legend_png"] = encode_raster(legend_img, opts.raster_format, opts.compression)
+		t.size("encode", sum(len(b) for b in encoded.values()))
+	#8)optional vector exports, traced once from the label map
+	if vector:
+		with t.stage("vector"):
+			polylines = trace_label_boundaries(labels)
+			if "worksheet_svg" in vector:
+				encoded["worksheet_svg"] = worksheet_svg(polylines, (w, h), places, palette, thickness=opts.thickness)
+			if "worksheet_pdf" in vector:
+				encoded["worksheet_pdf"] = worksheet_pdf(polylines, (w, h), places, palette, thickness=opts.thickness, page=opts.page_size)
+		t.size("vector", len(encoded.get("worksheet_svg") or b"") + len(encoded.get("worksheet_pdf") or b""))
+	meta = ImageMeta(width=w, height=h, colors=int(palette.shape[0]), num_regions=len(regions), numbers_overflow=number_stats.get("numbers_overflow", 0),
+		merge_iterations=merge_stats.get("iterations"), merge_converged=merge_stats.get("converged"))
+	return WorksheetArtifacts(
 		meta=meta,
+		palette=palette,
+		**encoded,
+		timings=dict(t.timings),
+		sizes=dict(t.sizes),
 	)
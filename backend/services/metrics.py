@@ -0,0 +1,167 @@
+"""
+In-process metrics in the Prometheus text exposition format (no extra dependency).
+
+Counters, gauges and histograms keyed by label values; render() produces the
+/metrics payload. Callback gauges are read at scrape time (cache and pool stats).
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+	parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+	if extra:
+		parts.append(extra)
+	return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+	kind = ""
+
+	def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+		self.name = name
+		self.help = help_text
+		self.labelnames = tuple(labelnames)
+		self._lock = threading.Lock()
+
+	def _key(self, labels: Dict[str, str]) -> LabelValues:
+		return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+	def header(self) -> List[str]:
+		return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+	kind = "counter"
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._values: Dict[LabelValues, float] = {}
+
+	def inc(self, amount: float = 1.0, **labels: str) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0.0) + amount
+
+	def render(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class Gauge(_Metric):
+	kind = "gauge"
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._values: Dict[LabelValues, float] = {}
+
+	def inc(self, amount: float = 1.0, **labels: str) -> None:
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0.0) + amount
+
+	def dec(self, amount: float = 1.0, **labels: str) -> None:
+		self.inc(-amount, **labels)
+
+	def set(self, value: float, **labels: str) -> None:
+		with self._lock:
+			self._values[self._key(labels)] = value
+
+	def render(self) -> List[str]:
+		with self._lock:
+			items = sorted(self._values.items())
+		return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in items]
+
+
+class CallbackGauge(_Metric):
+	"""Gauge whose values come from fn() -> {label value tuple: value} at scrape time."""
+
+	kind = "gauge"
+
+	def __init__(self, name: str, help_text: str, labelnames: Sequence[str], fn: Callable[[], Dict[LabelValues, float]]):
+		super().__init__(name, help_text, labelnames)
+		self._fn = fn
+
+	def render(self) -> List[str]:
+		return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in sorted(self._fn().items())]
+
+
+class Histogram(_Metric):
+	kind = "histogram"
+
+	def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+		super().__init__(name, help_text, labelnames)
+		self.buckets = tuple(sorted(buckets))
+		#label values -> (bucket counts, count, sum)
+		self._values: Dict[LabelValues, Tuple[List[int], int, float]] = {}
+
+	def observe(self, value: float, **labels: str) -> None:
+		key = self._key(labels)
+		i = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			counts, n, total = self._values.get(key) or ([0] * len(self.buckets), 0, 0.0)
+			if i < len(counts):
+				counts[i] += 1
+			self._values[key] = (counts, n + 1, total + value)
+
+	def render(self) -> List[str]:
+		with self._lock:
+			items = sorted((k, (list(c), n, s)) for k, (c, n, s) in self._values.items())
+		out = self.header()
+		for key, (counts, n, total) in items:
+			cumulative = 0
+			for bound, c in zip(self.buckets, counts):
+				cumulative += c
+				le = 'le="%g"' % bound
+				out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+			inf = 'le="+Inf"'
+			out.append(f"{self.name}_bucket{_labels(self.labelnames, key, inf)} {n}")
+			out.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+			out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:g}")
+		return out
+
+
+class Registry:
+	def __init__(self):
+		self._metrics: List[_Metric] = []
+
+	def register(self, metric: _Metric) -> _Metric:
+		self._metrics.append(metric)
+		return metric
+
+	def render(self) -> str:
+		lines: List[str] = []
+		for m in self._metrics:
+			lines.extend(m.render())
+		return "\n".join(lines) + "\n"
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+REGION_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+MERGE_PASS_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+registry = Registry()
+
+requests_total = registry.register(Counter("magic_requests_total", "HTTP requests by route and status.", ("route", "status")))
+request_seconds = registry.register(Histogram("magic_request_duration_seconds", "HTTP request latency.", ("route",), LATENCY_BUCKETS))
+in_flight = registry.register(Gauge("magic_requests_in_flight", "HTTP requests being processed.", ("route",)))
+stage_seconds = registry.register(Histogram("magic_stage_duration_seconds", "Pipeline stage wall time.", ("stage",), LATENCY_BUCKETS))
+regions_per_image = registry.register(Histogram("magic_regions_per_image", "Numbered regions per converted image.", (), REGION_BUCKETS))
+merge_passes = registry.register(Histogram("magic_merge_passes", "Passes of the bulk merge engine per image.", (), MERGE_PASS_BUCKETS))
+conversions_total = registry.register(Counter("magic_conversions_total", "Conversions by result source.", ("source",)))
+
+
+def observe_pipeline(timings: Dict[str, float], num_regions: int, merge_iterations: Optional[int] = None) -> None:
+	"""Record one pipeline run (stage timings in ms; merge passes with the bulk engine)."""
+	for stage, ms in timings.items():
+		stage_seconds.observe(ms / 1000.0, stage=stage)
+	regions_per_image.observe(num_regions)
+	if merge_iterations is not None:
+		merge_passes.observe(merge_iterations)
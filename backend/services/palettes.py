@@ -0,0 +1,86 @@
+"""
+Palette registry for the fixed-palette mode: built-in crayon sets, plus palettes uploaded
+at runtime (kept in memory by this process, at most MAGIC_PALETTES_MAX of them).
+
+A palette is a list of '#rrggbb' colors in legend order: number i + 1 is colors[i], on
+every worksheet made with it.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from backend.config import settings
+
+PALETTE_NAME = r"^[a-z0-9][a-z0-9_-]{0,63}$"
+
+BUILTIN_PALETTES: Dict[str, List[str]] = {
+	#classic 8-crayon box: red, orange, yellow, green, blue, violet, brown, black
+	"crayons-8": ["#ed0a3f", "#ff861f", "#fbe870", "#01a368", "#0066ff", "#8359a3", "#af593e", "#000000"],
+	#16-crayon box: the 8 above plus white and the in-between hues
+	"crayons-16": [
+		"#ed0a3f", "#ff3f34", "#ff861f", "#ffae42", "#fbe870", "#c5e17a", "#01a368", "#0095b7",
+		"#0066ff", "#6456b7", "#8359a3", "#bb3385", "#ffa6c9", "#af593e", "#000000", "#ffffff",
+	],
+	"primary-6": ["#d62828", "#f7d716", "#1d4ed8", "#2e9e44", "#000000", "#ffffff"],
+	"grays-5": ["#000000", "#404040", "#808080", "#c0c0c0", "#ffffff"],
+}
+
+
+def hex_to_bgr(colors: Sequence[str]) -> np.ndarray:
+	"""['#rrggbb', ...] -> (k, 3) BGR uint8 palette."""
+	rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in colors], dtype=np.uint8)
+	return np.ascontiguousarray(rgb[:, ::-1])
+
+
+def bgr_to_hex(palette_bgr: np.ndarray) -> List[str]:
+	"""(k, 3) BGR uint8 palette -> ['#rrggbb', ...]."""
+	return [f"#{r:02x}{g:02x}{b:02x}" for b, g, r in palette_bgr.tolist()]
+
+
+class PaletteRegistry:
+	"""Built-in palettes (read-only) + user palettes, by name."""
+
+	def __init__(self, max_user: int):
+		self.max_user = max_user
+		self._user: Dict[str, List[str]] = {}
+		self._lock = threading.Lock()
+
+	def get(self, name: str) -> Optional[List[str]]:
+		if name in BUILTIN_PALETTES:
+			return BUILTIN_PALETTES[name]
+		with self._lock:
+			return self._user.get(name)
+
+	def list(self) -> List[dict]:
+		with self._lock:
+			user = dict(self._user)
+		out = [{"name": n, "builtin": True, "colors": c} for n, c in BUILTIN_PALETTES.items()]
+		out += [{"name": n, "builtin": False, "colors": c} for n, c in sorted(user.items())]
+		return out
+
+	def put(self, name: str, colors: List[str]) -> bool:
+		"""Create or replace a user palette; True when created. ValueError for bad names
+		(built-in or invalid) and when the registry is full.
+		"""
+		if not re.match(PALETTE_NAME, name):
+			raise ValueError(f"Invalid palette name: {name!r}")
+		if name in BUILTIN_PALETTES:
+			raise ValueError(f"Palette {name!r} is built in and cannot be replaced.")
+		with self._lock:
+			created = name not in self._user
+			if created and len(self._user) >= self.max_user:
+				raise ValueError(f"Too many palettes (max {self.max_user}).")
+			self._user[name] = list(colors)
+		return created
+
+	def delete(self, name: str) -> bool:
+		with self._lock:
+			return self._user.pop(name, None) is not None
+
+
+palette_registry = PaletteRegistry(settings.PALETTES_MAX)
@@ -0,0 +1,93 @@
+"""
+Per-request sampling profiler.
+
+A background thread samples the target thread's Python stack every `interval`
+seconds and counts identical stacks. The result is in "folded" format
+(root;child;leaf count per line), which flamegraph.pl, speedscope and inferno read.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Tuple
+
+
+class SamplingProfiler:
+	"""Sample one thread's stack (default: the calling thread) until stop()."""
+
+	def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+		self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+		self.interval = interval
+		self.stacks: Counter = Counter()
+		self._stop = threading.Event()
+		self._thread: threading.Thread | None = None
+
+	def _frame_name(self, frame) -> str:
+		code = frame.f_code
+		return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			stack = []
+			while frame is not None:
+				stack.append(self._frame_name(frame))
+				frame = frame.f_back
+			if stack:
+				self.stacks[";".join(reversed(stack))] += 1
+
+	def start(self) -> "SamplingProfiler":
+		self._thread = threading.Thread(target=self._run, name="magic-profiler", daemon=True)
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+
+	def folded(self) -> str:
+		return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def profiled_call(fn: Callable[..., Any], *args: Any, interval: float = 0.005) -> Tuple[Any, str]:
+	"""Run fn(*args) in the current thread under the sampler; returns (result, folded stacks)."""
+	profiler = SamplingProfiler(interval=interval).start()
+	try:
+		result = fn(*args)
+	finally:
+		profiler.stop()
+	return result, profiler.folded()
+
+
+def save_profile(folded: str, directory: str, max_files: int = 100) -> str:
+	"""Write folded stacks to <directory>/<timestamp>-<id>.folded, return the file name.
+	Only the newest max_files profiles are kept.
+	"""
+	Path(directory).mkdir(parents=True, exist_ok=True)
+	name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+	(Path(directory) / name).write_text(folded, encoding="utf-8")
+	_rotate(Path(directory), max_files)
+	return name
+
+
+def _rotate(directory: Path, max_files: int) -> None:
+	profiles = []
+	for path in directory.glob("*.folded"):
+		try:
+			profiles.append((path.stat().st_mtime, path.name, path))
+		except OSError:
+			pass
+	profiles.sort(reverse=True)
+	for _, _, path in profiles[max(1, max_files):]:
+		try:
+			path.unlink()
+		except OSError:
+			#removed by a concurrent rotation
+			pass
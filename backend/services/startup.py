@@ -0,0 +1,101 @@
+"""
+Cold start: native thread counts, worker warm-up and readiness.
+
+A fresh process pays on its first conversion for the OpenCV import and initialization,
+thread-pool spin-up, the glyph atlas and first-touch of every kernel. Each conversion
+worker therefore converts a small synthetic image through every output (JPEG and PNG
+decode, k-means and fixed palette, worksheet, SVG, PDF) in its pool initializer, before
+its first task (executor._init_worker). At startup (main.lifespan) every worker is
+spun up; until all of them are warm GET /ready answers 503, so a load balancer only
+routes traffic to warm workers while GET /health (liveness) answers right away.
+
+Thread counts: each worker gets MAGIC_CV_THREADS OpenCV threads (executor._init_worker)
+and as many BLAS/OpenMP threads. The BLAS pools read their environment variables when
+numpy is first imported, so limit_native_threads() must run before that (main.py calls
+it before importing the app).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from backend.config import settings
+
+#thread pool sizes read by OpenBLAS, MKL, OpenMP and Accelerate at load time
+_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+#side of the synthetic warm-up image (the smallest max_size)
+WARMUP_SIZE = 128
+
+
+def limit_native_threads() -> None:
+	"""Default the BLAS/OpenMP thread counts to MAGIC_CV_THREADS (explicit values are kept)."""
+	for name in _THREAD_VARS:
+		os.environ.setdefault(name, str(settings.CV_THREADS))
+
+
+class Readiness:
+	"""Startup progress: timings of the startup steps, ready once the workers are warm."""
+
+	def __init__(self):
+		self.ready = False
+		self.error: Optional[str] = None
+		self._timings: Dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def mark(self, step: str, seconds: float) -> None:
+		with self._lock:
+			self._timings[step] = seconds * 1000.0
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			timings = {k: round(v, 2) for k, v in self._timings.items()}
+		return {"ready": self.ready, "error": self.error, "timings_ms": timings}
+
+
+def _warmup_images():
+	"""(jpeg, png) bytes of a synthetic picture: a gradient with a few flat shapes, so the
+	pipeline finds several regions and draws numbers of every size."""
+	import cv2
+	import numpy as np
+
+	n = WARMUP_SIZE
+	ramp = np.linspace(40, 220, n, dtype=np.uint8)
+	img = np.dstack([np.tile(ramp, (n, 1)), np.tile(ramp[:, None], (1, n)), np.full((n, n), 128, np.uint8)])
+	cv2.circle(img, (40, 44), 26, (30, 40, 200), -1)
+	cv2.rectangle(img, (74, 14), (118, 58), (200, 160, 20), -1)
+	cv2.ellipse(img, (84, 96), (34, 18), 20, 0, 360, (20, 180, 60), -1)
+	return cv2.imencode(".jpg", img)[1].tobytes(), cv2.imencode(".png", img)[1].tobytes()
+
+
+def warm_conversion() -> None:
+	"""Convert the synthetic image once per decoder/palette/output path (runs in a worker)."""
+	from backend.api.schemas import OUTPUTS, ConvertRequestOptions
+	from backend.services.magic import render_worksheet_artifacts
+	from backend.services.palettes import BUILTIN_PALETTES
+
+	jpeg, png = _warmup_images()
+	render_worksheet_artifacts(jpeg, ConvertRequestOptions(max_size=WARMUP_SIZE, colors=6, outputs=list(OUTPUTS)))
+	render_worksheet_artifacts(png, ConvertRequestOptions(max_size=WARMUP_SIZE, palette=BUILTIN_PALETTES["crayons-8"], kmeans_space="lab", raster_format="webp"))
+
+
+async def warm_up(executor, state: Readiness) -> None:
+	"""Spin every worker of executor up (each warms up in its initializer when
+	executor.warm); state is ready afterwards, not ready with the error when one failed
+	or did not start within MAGIC_WARMUP_TIMEOUT."""
+	t0 = time.perf_counter()
+	try:
+		await asyncio.get_running_loop().run_in_executor(None, executor.wait_ready, settings.WARMUP_TIMEOUT_SECONDS)
+	except Exception as e:
+		logging.exception("worker start-up failed: %s", e)
+		state.error = f"warm-up failed: {e}"
+		return
+	state.mark("warmup" if executor.warm else "workers", time.perf_counter() - t0)
+	state.ready = True
+
+
+readiness = Readiness()
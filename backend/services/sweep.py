@@ -0,0 +1,106 @@
+"""
+Parameter sweep: many option variants of one image, sharing every stage they have in common.
+
+The image is decoded and downscaled once. Palettes are fitted in increasing colors order,
+each warm-started from the previous palette (only the extra centres are picked anew, so a
+colour keeps its number across variants). Every later result is computed once and reused
+by all variants that only differ in options consumed further down:
+
+	colors -> kmeans + smooth
+	  merge_area -> merge, preview thumbnail
+	    min_area -> regions
+	      thickness, outline_mode -> outlines -> placement -> worksheet thumbnail
+
+Outlines are dilated once per variant, from 1px masks computed once: the Canny edges of
+the image, and the label boundaries (OR-ed with those edges in union mode) per merge_area.
+
+Variants come back as small PNG thumbnails plus their metadata (region counts).
+"""
+
+from __future__ import annotations
+
+import base64
+from typing import Dict, Optional
+
+import numpy as np
+
+from backend.api.schemas import SWEEP_AXES, ImageMeta, SweepRequest, SweepResponse, SweepVariant
+from backend.ops.io import decode_image_bgr, downscale_max_side, encode_png
+from backend.ops.outline import dilate_outline, outline_edges, outline_union
+from backend.ops.placing import place_numbers
+from backend.ops.quantize import quantize_bgr_kmeans
+from backend.ops.render import compose_worksheet, draw_numbers, legend_viz, overlay_legend_on_worksheet
+from backend.ops.segments import extract_regions, median_smooth_labels, merge_micro_regions
+from backend.services.timing import StageTimer
+
+
+def _thumb_png(img: np.ndarray, size: int) -> str:
+	return base64.b64encode(encode_png(downscale_max_side(img, size))).decode("ascii")
+
+
+def sweep_variants(data: bytes, req: SweepRequest, timer: Optional[StageTimer] = None) -> SweepResponse:
+	"""Run every variant of req on one image; shared stages run once (see module docstring)."""
+	import cv2
+
+	t = timer if timer is not None else StageTimer()
+	with t.stage("decode"):
+		img = decode_image_bgr(data, max_side=req.max_size)
+	with t.stage("downscale"):
+		img = downscale_max_side(img, req.max_size)
+	h, w = img.shape[:2]
+	want_sheet = "worksheet" in req.thumbs
+	want_preview = "preview" in req.thumbs
+
+	#1px Canny edges only depend on the image
+	canny: Optional[np.ndarray] = None
+	variants = []
+	prev_palette = None
+	for k in req.colors:
+		with t.stage("kmeans"):
+			_, labels, palette = quantize_bgr_kmeans(img, k, sample_size=req.kmeans_sample, space=req.kmeans_space, init_palette=prev_palette)
+		prev_palette = palette
+		with t.stage("smooth"):
+			labels = median_smooth_labels(labels, ksize=3)
+		legend = legend_viz(palette, box_size=32) if want_sheet else None
+		for merge_area in req.merge_area:
+			merge_stats: Dict = {}
+			with t.stage("merge"):
+				merged = merge_micro_regions(labels, min_area=merge_area, engine=req.merge_engine, stats=merge_stats)
+			preview = None
+			if want_preview:
+				with t.stage("thumbs"):
+					preview = _thumb_png(palette[merged], req.thumb_size)
+			#1px outlines per outline mode, shared by every thickness and min_area
+			thin: Dict[str, np.ndarray] = {}
+			for min_area in req.min_area:
+				with t.stage("regions"):
+					regions = extract_regions(merged, min_area=min_area)
+				for thickness in req.thickness:
+					for mode in req.outline_mode:
+						sheet = None
+						number_stats: Dict[str, int] = {}
+						if want_sheet:
+							with t.stage("outline"):
+								if "labels" not in thin:
+									thin["labels"] = outline_union(merged, thickness=1)
+								if mode not in thin:
+									if canny is None:
+										canny = outline_edges(img, thickness=1)
+									thin[mode] = cv2.bitwise_or(thin["labels"], canny)
+								edges = dilate_outline(thin[mode], thickness)
+							with t.stage("placement"):
+								places = place_numbers(regions, outline_mask=edges, with_radius=True)
+							with t.stage("thumbs"):
+								worksheet = draw_numbers(compose_worksheet(edges, (h, w, 3)), places, inplace=True, stats=number_stats)
+								worksheet = overlay_legend_on_worksheet(worksheet, legend, margin=12, alpha=0.95, inplace=True)
+								sheet = _thumb_png(worksheet, req.thumb_size)
+						values = (k, merge_area, min_area, thickness, mode)
+						variants.append(SweepVariant(
+							options=dict(zip(SWEEP_AXES, values)),
+							meta=ImageMeta(width=w, height=h, colors=int(palette.shape[0]), num_regions=len(regions),
+								numbers_overflow=number_stats.get("numbers_overflow", 0),
+								merge_iterations=merge_stats.get("iterations"), merge_converged=merge_stats.get("converged")),
+							worksheet_png=sheet,
+							preview_png=preview,
+						))
+	return SweepResponse(width=w, height=h, variants=variants, timings={name: round(ms, 2) for name, ms in t.timings.items()})
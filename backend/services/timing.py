@@ -0,0 +1,46 @@
+"""
+Per-stage wall time and output size recording for one pipeline run.
+
+	timer = StageTimer()
+	with timer.stage("decode"):
+		img = ...
+	timer.size("decode", img.nbytes)
+	timer.server_timing()  # 'decode;dur=12.3, ...'
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StageTimer:
+	"""Ordered stage -> milliseconds (re-entering a stage adds up) and stage -> output bytes."""
+
+	__slots__ = ("timings", "sizes")
+
+	def __init__(self):
+		self.timings: Dict[str, float] = {}
+		self.sizes: Dict[str, int] = {}
+
+	@contextmanager
+	def stage(self, name: str) -> Iterator[None]:
+		t0 = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - t0) * 1000.0
+
+	def size(self, name: str, nbytes: int) -> None:
+		self.sizes[name] = self.sizes.get(name, 0) + int(nbytes)
+
+	def items(self) -> List[Tuple[str, float]]:
+		return list(self.timings.items())
+
+
+def server_timing(timings: Dict[str, float], extra: Dict[str, float] | None = None) -> str:
+	"""Server-Timing header value, e.g. 'decode;dur=12.3, kmeans;dur=80.1'."""
+	entries = dict(timings)
+	entries.update(extra or {})
+	return ", ".join(f"{name};dur={ms:.1f}" for name, ms in entries.items())
@@ -1 +1,288 @@
-#unit tests for key ops on sample image tiles
\ No newline at end of file
+#unit tests for key ops on sample image tiles
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from backend.api.schemas import ConvertRequestOptions
+from backend.bench.images import encode_jpeg, synthetic_image
+from backend.bench.pipeline import bench_case, compare
+from backend.ops.glyphs import FONT_SCALES, glyph, layout_numbers, stamp_numbers
+from backend.ops.io import decode_image_bgr, downscale_max_side, encode_indexed
+from backend.ops.outline import outline_edges, outline_union
+from backend.ops.placing import place_numbers
+from backend.ops.quantize import assign_nearest, fit_palette, quantize_bgr_kmeans, quantize_to_palette
+from backend.ops.vector import trace_label_boundaries, worksheet_pdf, worksheet_svg
+from backend.ops.segments import extract_regions, median_smooth_labels, merge_micro_regions, merge_micro_regions_bulk, outline_from_labels, _label_all_components
+from backend.services.magic import artifact_media_type, plan_band_rows, render_worksheet_artifacts, requested_artifacts
+
+
+def _tile_with_islands() -> np.ndarray:
+	#two big halves with a few tiny islands on each side
+	labels = np.zeros((64, 64), dtype=np.int32)
+	labels[:, 32:] = 1
+	labels[10:13, 5:8] = 2
+	labels[40:42, 50:52] = 0
+	labels[20, 31:33] = 3
+	return labels
+
+
+def test_merge_bulk_removes_small_components():
+	labels = _tile_with_islands()
+	out, merge_stats = merge_micro_regions_bulk(labels, min_area=50)
+	_, _, cc_stats, _ = _label_all_components(out)
+	assert (cc_stats[:, 4] >= 50).all()
+	assert merge_stats["iterations"] >= 1
+	assert out[11, 6] == 0
+	assert out[41, 51] == 1
+
+
+def test_merge_bulk_stops_at_max_iter_and_reports_it():
+	#a staircase of small components, each only next to a larger one: one merge per pass
+	labels = np.zeros((8, 40), dtype=np.int32)
+	for i, x in enumerate(range(0, 40, 5)):
+		labels[:, x:x + 5] = i
+	labels[:, 35:] = 9
+	_, capped = merge_micro_regions_bulk(labels, min_area=300, max_iter=1)
+	assert capped["iterations"] == 1 and not capped["converged"]
+	out, full = merge_micro_regions_bulk(labels, min_area=300)
+	assert full["converged"] and len(np.unique(out)) == 1
+	#the pipeline reports the passes on the result's meta (the pixel engine has none)
+	jpeg = encode_jpeg(synthetic_image(160))
+	bulk = render_worksheet_artifacts(jpeg, ConvertRequestOptions(max_size=160, colors=5, merge_engine="bulk", outputs=["meta"]))
+	assert bulk.meta.merge_iterations >= 1 and bulk.meta.merge_converged
+	pixel = render_worksheet_artifacts(jpeg, ConvertRequestOptions(max_size=160, colors=5, outputs=["meta"]))
+	assert pixel.meta.merge_iterations is None and pixel.meta.merge_converged is None
+
+
+def test_merge_pixel_engine_matches_legacy_on_sample_images():
+	from pathlib import Path
+
+	root = Path(__file__).resolve().parents[2] / "img"
+	for path in sorted(root.glob("*.*")):
+		img = downscale_max_side(decode_image_bgr(path.read_bytes(), max_side=256), 256)
+		_, labels, _ = quantize_bgr_kmeans(img, 9)
+		labels = median_smooth_labels(labels, ksize=3)
+		assert np.array_equal(merge_micro_regions(labels, 200), merge_micro_regions(labels, 200, engine="legacy")), path.name
+
+
+def test_merge_bulk_keeps_large_components_like_legacy():
+	labels = _tile_with_islands()
+	bulk = merge_micro_regions(labels, 50, engine="bulk")
+	legacy = merge_micro_regions(labels, 50, engine="legacy")
+	comp, _, stats, _ = _label_all_components(labels)
+	big = stats[:, 4][comp] >= 50
+	assert np.array_equal(bulk[big], labels[big])
+	assert np.array_equal(legacy[big], labels[big])
+	#the 2x2 island has no interior pixel, so both engines resolve it the same way
+	assert bulk[40:42, 50:52].tolist() == legacy[40:42, 50:52].tolist()
+
+
+def test_extract_regions_single_pass_matches_per_label():
+	labels = merge_micro_regions(_tile_with_islands(), 50)
+	fast = extract_regions(labels, min_area=10)
+	slow = extract_regions(labels, min_area=10, mode="per_label")
+	assert [(r.label, r.area, r.bbox) for r in fast] == [(r.label, r.area, r.bbox) for r in slow]
+	for a, b in zip(fast, slow):
+		assert np.array_equal(a.mask, b.mask)
+		assert a["centroid"] == b["centroid"]
+
+
+def test_place_numbers_global_stays_inside_and_off_outlines():
+	labels = merge_micro_regions(_tile_with_islands(), 50)
+	regions = extract_regions(labels, min_area=10)
+	outline = np.zeros(labels.shape, dtype=np.uint8)
+	outline[:, 12:16] = 255
+	places = place_numbers(regions, outline_mask=outline)
+	assert len(places) == len(regions)
+	for x, y, lbl in places:
+		assert labels[y, x] == lbl
+		assert outline[y, x] == 0
+
+
+def test_sampled_kmeans_assigns_every_pixel_to_nearest_center():
+	rng = np.random.default_rng(0)
+	img = np.zeros((96, 96, 3), dtype=np.uint8)
+	img[:, 32:64] = (200, 40, 40)
+	img[:, 64:] = (20, 220, 90)
+	img = np.clip(img.astype(np.int16) + rng.integers(-6, 7, img.shape), 0, 255).astype(np.uint8)
+	quant, labels, palette = quantize_bgr_kmeans(img, 3, sample_size=500)
+	assert labels.shape == img.shape[:2]
+	assert len(np.unique(labels[:, :32])) == 1
+	assert np.array_equal(labels.ravel(), assign_nearest(img.reshape(-1, 3), palette.astype(np.float32)))
+	assert np.array_equal(quant, palette[labels])
+
+
+def test_kmeans_fits_are_reproducible_across_threads():
+	from concurrent.futures import ThreadPoolExecutor
+
+	img = synthetic_image(120)
+	jobs = [(seed, attempts) for seed in range(6) for attempts in (1, 2)] * 3
+	alone = {job: fit_palette(img, 8, 4000, seed=job[0], attempts=job[1])[0] for job in set(jobs)}
+	with ThreadPoolExecutor(max_workers=6) as pool:
+		together = list(pool.map(lambda job: fit_palette(img, 8, 4000, seed=job[0], attempts=job[1])[0], jobs))
+	assert all(np.array_equal(centers, alone[job]) for job, centers in zip(jobs, together))
+
+
+def test_palette_lut_maps_to_lab_nearest_color():
+	import cv2
+
+	palette = np.array([[0, 0, 0], [255, 255, 255], [63, 10, 237], [255, 102, 0], [1, 163, 1]], dtype=np.uint8)
+	#the palette colors themselves map to their own index
+	assert quantize_to_palette(palette.reshape((1, -1, 3)), palette).ravel().tolist() == [0, 1, 2, 3, 4]
+	img = synthetic_image(96, "noisy", seed=3)
+	lab = lambda a: cv2.cvtColor(a.reshape((-1, 1, 3)).astype(np.float32) / 255.0, cv2.COLOR_BGR2LAB).reshape((-1, 3))
+	exact = assign_nearest(lab(img), lab(palette)).reshape(img.shape[:2])
+	labels = quantize_to_palette(img, palette)
+	assert labels.dtype == np.uint8 and (labels == exact).mean() > 0.95
+
+
+def test_indexed_encoding_uses_fewest_bits_and_round_trips():
+	import cv2
+
+	rng = np.random.default_rng(0)
+	for k, bits in ((2, 1), (4, 2), (9, 4), (24, 8)):
+		palette = rng.integers(0, 256, size=(k, 3), dtype=np.uint8)
+		labels = rng.integers(0, k, size=(40, 50), dtype=np.uint8)
+		png = encode_indexed(labels, palette)
+		#IHDR bit depth
+		assert png[24] == bits
+		for data in (png, encode_indexed(labels, palette, fmt="webp")):
+			assert (cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) == palette[labels]).all()
+	artifacts = render_worksheet_artifacts(encode_jpeg(synthetic_image(160, "flat")), ConvertRequestOptions(max_size=160, colors=4, raster_format="webp"))
+	assert artifact_media_type("worksheet_png", artifacts.worksheet_png) == "image/webp"
+
+
+def test_vector_trace_covers_every_boundary_once():
+	labels = merge_micro_regions(_tile_with_islands(), 50)
+	polylines = trace_label_boundaries(labels, epsilon=0)
+	length = sum(np.abs(np.diff(p, axis=0)).sum() for p in polylines)
+	cracks = (labels[1:, :] != labels[:-1, :]).sum() + (labels[:, 1:] != labels[:, :-1]).sum()
+	assert length == cracks
+	palette = np.array([[255, 0, 0], [0, 255, 0]], dtype=np.uint8)
+	places = place_numbers(extract_regions(labels, min_area=10))
+	svg = worksheet_svg(trace_label_boundaries(labels), (64, 64), places, palette)
+	pdf = worksheet_pdf(trace_label_boundaries(labels), (64, 64), places, palette, page="A3")
+	assert svg.startswith(b"<svg") and b">1</text>" in svg
+	assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+
+
+def test_vector_trace_chains_each_crack_edge_once_between_junctions():
+	rng = np.random.default_rng(1)
+	labels = np.kron(rng.integers(0, 4, (12, 15)), np.ones((3, 3), dtype=np.int64))
+	labels[rng.random(labels.shape) < 0.1] = 4
+	h, w = labels.shape
+	cracks = set()
+	for y, x in zip(*np.nonzero(labels[1:, :] != labels[:-1, :])):
+		cracks.add(((x, y + 1), (x + 1, y + 1)))
+	for y, x in zip(*np.nonzero(labels[:, 1:] != labels[:, :-1])):
+		cracks.add(((x + 1, y), (x + 1, y + 1)))
+	degree = {}
+	for a, b in cracks:
+		degree[a] = degree.get(a, 0) + 1
+		degree[b] = degree.get(b, 0) + 1
+	seen = []
+	for poly in trace_label_boundaries(labels, epsilon=0):
+		pts = [tuple(p) for p in poly.astype(int).tolist()]
+		assert all(degree[p] == 2 for p in pts[1:-1])
+		#a loop without junction, or a chain from a junction (or the border) to another
+		assert pts[0] == pts[-1] if degree[pts[0]] == 2 else degree[pts[-1]] != 2
+		seen += [tuple(sorted(e)) for e in zip(pts, pts[1:])]
+	assert len(seen) == len(cracks) and set(seen) == cracks
+
+
+def test_bench_reports_every_stage_and_flags_regressions():
+	from backend.api.schemas import ConvertRequestOptions
+
+	stages = bench_case("flat", 128, ConvertRequestOptions(max_size=128, colors=4), repeat=1)
+	assert {"decode", "quantize", "merge", "placement", "encode", "vector", "full"} <= set(stages)
+	current = {"results": {"flat/128": stages}}
+	assert compare(current, current) == []
+	faster = {"results": {"flat/128": {k: dict(v, ms=v["ms"] / 10) for k, v in stages.items() if not k.startswith("_")}}}
+	slow = compare(current, faster, threshold=0.2, min_ms=0.0)
+	assert any(r["stage"] == "full" for r in slow)
+
+
+def test_decode_reduced_jpeg_keeps_max_side_and_orientation():
+	rgb = np.zeros((600, 1000, 3), dtype=np.uint8)
+	rgb[:, :500] = (255, 0, 0)
+	img = Image.fromarray(rgb)
+	exif = img.getexif()
+	exif[0x0112] = 6  #rotate 90 degrees clockwise on display
+	buf = BytesIO()
+	img.save(buf, "JPEG", exif=exif)
+	bgr = decode_image_bgr(buf.getvalue(), max_side=200)
+	#1/4 scale (250x150) is the smallest that keeps the long side >= 200, then rotated
+	assert bgr.shape == (250, 150, 3)
+	#red (left half) ends up on top, in BGR order
+	assert bgr[10, 75, 2] > 200 and bgr[10, 75, 0] < 50
+	assert bgr[-10, 75, 2] < 50
+
+
+def test_number_layout_sizes_to_room_and_never_overlaps():
+	page = np.full((60, 90), 255, dtype=np.uint8)
+	page[:, 70] = 0
+	#two numbers close enough to collide, one in a 2px sliver by the outline, one inside the
+	#box of another (no free spot around it: it overflows at the smallest scale on its point)
+	places = [(20, 30, 0, 25.0), (27, 30, 11, 25.0), (71, 30, 4, 2.0), (40, 10, 7), (20, 31, 2, 1.0)]
+	layout, overflow = layout_numbers(page, places)
+	assert sorted(n for _, _, n, _ in layout) == [1, 5, 8, 12]
+	assert [(n, scale) for _, _, n, scale in overflow] == [(3, FONT_SCALES[-1])]
+	ox, oy, _, _ = overflow[0]
+	oh, ow = glyph(3, FONT_SCALES[-1]).shape
+	assert ox <= 20 < ox + ow and oy <= 31 < oy + oh
+	boxes = []
+	for x0, y0, n, scale in layout:
+		gh, gw = glyph(n, scale).shape
+		assert 0 <= x0 and x0 + gw <= 90 and 0 <= y0 and y0 + gh <= 60
+		boxes.append((x0, y0, x0 + gw, y0 + gh))
+	for i, a in enumerate(boxes):
+		for b in boxes[i + 1:]:
+			assert not (a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3])
+	scales = {n: scale for _, _, n, scale in layout}
+	assert scales[1] == FONT_SCALES[0] and scales[5] == FONT_SCALES[-1]
+	stamped = stamp_numbers(page.copy(), layout)
+	inked = np.zeros(page.shape, dtype=np.bool_)
+	for x0, y0, x1, y1 in boxes:
+		inked[y0:y1, x0:x1] = True
+	assert (stamped[~inked] == page[~inked]).all()
+	assert all(stamped[y0:y1, x0:x1].min() < 64 for x0, y0, x1, y1 in boxes)
+	stamped = stamp_numbers(page.copy(), layout, overflow)
+	assert stamped[oy:oy + oh, ox:ox + ow].min() < 64
+	assert (stamped[~inked] == page[~inked]).sum() < (~inked).sum()
+
+
+def test_banded_ops_match_whole_image():
+	rng = np.random.default_rng(3)
+	labels = np.kron(rng.integers(0, 5, (40, 30)), np.ones((5, 5), dtype=np.int64)).astype(np.int32)
+	labels[rng.random(labels.shape) < 0.05] = 2
+	smoothed = median_smooth_labels(labels)
+	inplace = labels.copy()
+	median_smooth_labels(inplace, band_rows=64, inplace=True)
+	assert (inplace == smoothed).all()
+	for thickness in (1, 2, 3):
+		assert (outline_from_labels(labels, thickness, band_rows=64) == outline_from_labels(labels, thickness)).all()
+
+
+def test_outline_union_matches_separate_outlines():
+	img = synthetic_image(160, "noisy")
+	labels = quantize_bgr_kmeans(img, 5, 2000)[1]
+	for thickness in (1, 2, 3):
+		for band_rows in (0, 64):
+			separate = outline_from_labels(labels, thickness, band_rows) | outline_edges(img, thickness, band_rows)
+			assert (outline_union(labels, img, thickness, band_rows) == separate).all()
+			assert (outline_union(labels, None, thickness, band_rows) == outline_from_labels(labels, thickness, band_rows)).all()
+
+
+def test_memory_budget_runs_tiled_with_same_labels():
+	jpeg = encode_jpeg(synthetic_image(300, "noisy"))
+	opts = ConvertRequestOptions(max_size=256, colors=5, outputs=["labels", "preview", "worksheet"])
+	tiled_opts = opts.model_copy(update={"memory_budget_mb": 1})
+	assert 0 < plan_band_rows(tiled_opts, 256, 256, requested_artifacts(tiled_opts)) < 256
+	whole = render_worksheet_artifacts(jpeg, opts)
+	tiled = render_worksheet_artifacts(jpeg, tiled_opts)
+	assert tiled.labels_png == whole.labels_png
+	assert tiled.preview_png == whole.preview_png
+	assert tiled.meta == whole.meta
+	assert tiled.worksheet_png is not None
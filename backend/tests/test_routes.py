@@ -1 +1,600 @@
-#integration tests with TestClient
\ No newline at end of file
+#integration tests with TestClient
+
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from backend.main import app
+
+IMG = Path(__file__).resolve().parents[2] / "img" / "chicken_joe.jpg"
+
+client = TestClient(app)
+
+
+def _upload():
+	return {"file": ("chicken.jpg", IMG.read_bytes(), "image/jpeg")}
+
+
+def test_health():
+	assert client.get("/health").json() == {"status": "ok"}
+
+
+def test_ready_once_workers_are_warm():
+	import time
+
+	with TestClient(app) as c:
+		for _ in range(500):
+			state = c.get("/ready")
+			if state.status_code == 200:
+				break
+			assert state.headers["retry-after"] == "1"
+			time.sleep(0.02)
+		body = state.json()
+		assert body["ready"] and body["error"] is None
+		assert {"imports", "warmup"} <= set(body["timings_ms"])
+		assert c.get("/health").json() == {"status": "ok"}
+
+
+def test_every_worker_warms_up_once(monkeypatch):
+	import threading
+
+	import pytest
+
+	from backend.services import startup
+	from backend.services.executor import ConversionExecutor
+
+	warmed = []
+	monkeypatch.setattr(startup, "warm_conversion", lambda: warmed.append(threading.get_ident()))
+	pool = ConversionExecutor("thread", workers=3, warm=True)
+	try:
+		pool.wait_ready()
+	finally:
+		pool.shutdown()
+	assert len(warmed) == 3 and len(set(warmed)) == 3
+
+	def broken():
+		raise RuntimeError("no codec")
+
+	monkeypatch.setattr(startup, "warm_conversion", broken)
+	pool = ConversionExecutor("thread", workers=2, warm=True)
+	try:
+		with pytest.raises(RuntimeError, match="2 of 2 workers failed to warm up: RuntimeError: no codec"):
+			pool.wait_ready()
+	finally:
+		pool.shutdown()
+
+
+def test_workers_that_do_not_start_fail_readiness(monkeypatch):
+	import asyncio
+	import threading
+
+	from backend.services import startup
+	from backend.services.executor import ConversionExecutor
+
+	hang = threading.Event()
+	calls = []
+
+	def first_hangs():
+		calls.append(1)
+		if len(calls) == 1:
+			hang.wait(5)
+
+	monkeypatch.setattr(startup, "warm_conversion", first_hangs)
+	monkeypatch.setattr(startup.settings, "WARMUP_TIMEOUT_SECONDS", 0.3)
+	pool = ConversionExecutor("thread", workers=2, warm=True)
+	state = startup.Readiness()
+	try:
+		asyncio.run(startup.warm_up(pool, state))
+	finally:
+		hang.set()
+		pool.shutdown()
+	assert not state.ready and state.error == "warm-up failed: workers not ready after 0.3 s"
+
+
+def test_cancelled_caller_keeps_its_slot_until_the_worker_returns():
+	import asyncio
+	import threading
+	import time
+
+	from backend.services.executor import ConversionExecutor, QueueFullError
+
+	pool = ConversionExecutor("thread", workers=1, queue_depth=0)
+	release = threading.Event()
+
+	async def scenario():
+		task = asyncio.create_task(pool.run(release.wait, 5))
+		await asyncio.sleep(0.05)
+		task.cancel()
+		await asyncio.sleep(0.05)
+		#the worker is still busy: the slot stays taken and the next caller is turned away
+		held = pool.stats()["in_flight"]
+		try:
+			await pool.run(time.sleep, 0)
+			rejected = False
+		except QueueFullError:
+			rejected = True
+		release.set()
+		for _ in range(100):
+			if pool.stats()["in_flight"] == 0:
+				break
+			await asyncio.sleep(0.01)
+		return held, rejected, pool.stats()["in_flight"]
+
+	try:
+		assert asyncio.run(scenario()) == (1, True, 0)
+	finally:
+		release.set()
+		pool.shutdown()
+
+
+def test_convert_is_cached_and_honours_etag():
+	params = {"max_size": 256, "colors": 4}
+	first = client.post("/magic/convert", params=params, files=_upload())
+	assert first.status_code == 200
+	etag = first.headers["etag"]
+	second = client.post("/magic/convert", params=params, files=_upload())
+	assert second.headers["x-cache"] == "hit"
+	assert second.headers["etag"] == etag
+	assert second.json() == first.json()
+	not_modified = client.post("/magic/convert", params=params, files=_upload(), headers={"If-None-Match": etag})
+	assert not_modified.status_code == 304
+	assert client.get("/magic/cache").json()["memory_hits"] >= 1
+
+
+def test_convert_binary_formats():
+	import io
+	import zipfile
+
+	params = {"max_size": 256, "colors": 4, "format": "png"}
+	png = client.post("/magic/convert", params=params, files=_upload())
+	assert png.headers["content-type"] == "image/png"
+	assert png.content.startswith(b"\x89PNG")
+	assert int(png.headers["x-image-width"]) == 256
+
+	params["format"] = "zip"
+	archive = zipfile.ZipFile(io.BytesIO(client.post("/magic/convert", params=params, files=_upload()).content))
+	assert set(archive.namelist()) == {"meta.json", "worksheet.png", "preview.png", "labels.png", "legend.png"}
+	assert archive.read("worksheet.png") == png.content
+
+	params["format"] = "multipart"
+	multi = client.post("/magic/convert", params=params, files=_upload())
+	assert multi.headers["content-type"].startswith("multipart/mixed; boundary=")
+	assert multi.content.count(b"Content-Type: image/png") == 4
+
+
+def test_outputs_selects_artifacts():
+	params = {"max_size": 256, "colors": 4, "outputs": "meta,legend"}
+	body = client.post("/magic/convert", params=params, files=_upload()).json()
+	assert [k for k, v in body.items() if v is not None] == ["legend_png", "meta"]
+	assert body["meta"]["num_regions"] > 0
+	#same selection in another order shares the cache entry
+	params["outputs"] = "legend,meta,legend"
+	assert client.post("/magic/convert", params=params, files=_upload()).headers["x-cache"] == "hit"
+	#single-file formats add their file to the selection
+	params.update(outputs="meta", format="png")
+	assert client.post("/magic/convert", params=params, files=_upload()).content.startswith(b"\x89PNG")
+	assert client.post("/magic/convert", params={"outputs": "nope"}, files=_upload()).status_code == 422
+
+
+def test_batch_streams_one_line_per_file_with_item_errors():
+	import json
+
+	files = [
+		("files", ("a.jpg", IMG.read_bytes(), "image/jpeg")),
+		("files", ("broken.jpg", b"not an image", "image/jpeg")),
+	]
+	resp = client.post("/magic/convert/batch", params={"max_size": 128, "colors": 3}, files=files)
+	assert resp.status_code == 200
+	lines = sorted((json.loads(l) for l in resp.text.splitlines()), key=lambda l: l["index"])
+	assert [l["ok"] for l in lines] == [True, False]
+	assert lines[0]["result"]["meta"]["width"] == 128
+	assert lines[1]["filename"] == "broken.jpg" and lines[1]["error"]
+
+
+def test_server_timing_and_metrics(monkeypatch, tmp_path):
+	from backend.config import settings
+
+	#profiling is opt-in: the header alone does nothing
+	resp = client.post("/magic/convert", params={"max_size": 160, "colors": 5}, files=_upload(), headers={"X-Magic-Profile": "1"})
+	assert resp.status_code == 200 and "x-profile" not in resp.headers
+	stages = [part.split(";")[0].strip() for part in resp.headers["server-timing"].split(",")]
+	assert stages[:3] == ["decode", "downscale", "kmeans"] and "encode" in stages
+	monkeypatch.setattr(settings, "PROFILE_ALLOWED", True)
+	monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+	monkeypatch.setattr(settings, "PROFILE_MAX_FILES", 1)
+	names = []
+	for colors in (6, 7):
+		resp = client.post("/magic/convert", params={"max_size": 160, "colors": colors}, files=_upload(), headers={"X-Magic-Profile": "1"})
+		names.append(resp.headers["x-profile"])
+	assert names[0].endswith(".folded")
+	#rotation keeps only the newest profile
+	assert [p.name for p in tmp_path.iterdir()] == [names[1]]
+	(tmp_path / names[1]).unlink()
+	client.post("/magic/convert", params={"max_size": 160, "colors": 5, "merge_engine": "bulk", "outputs": "meta"}, files=_upload())
+	text = client.get("/metrics").text
+	assert 'magic_stage_duration_seconds_count{stage="merge"}' in text
+	assert "magic_merge_passes_count" in text
+	assert 'magic_requests_total{route="/magic/convert",status="200"}' in text
+	assert "magic_regions_per_image_bucket" in text
+
+
+def test_memory_admission_degrades_then_rejects():
+	import io
+
+	from PIL import Image
+
+	from backend.api.schemas import ConvertRequestOptions
+	from backend.services.admission import memory_admission
+
+	params = {"max_size": 1024, "colors": 4, "outputs": "meta"}
+	_, need, _ = memory_admission.plan(IMG.read_bytes(), ConvertRequestOptions(**{**params, "outputs": ["meta"]}))
+	budget = memory_admission.budget
+	try:
+		#too little memory for the run as asked: it still runs, tiled or smaller, and is not cached
+		memory_admission.budget = need - 1
+		r = client.post("/magic/convert", params=params, files=_upload())
+		assert r.status_code == 200 and r.headers["x-admission"] in ("tiled", "downscaled")
+		assert "etag" not in r.headers
+		#a small PNG declaring a huge canvas is refused before anything is decoded
+		buf = io.BytesIO()
+		Image.new("L", (8000, 8000)).save(buf, "PNG")
+		r = client.post("/magic/convert", params=params, files={"file": ("bomb.png", buf.getvalue(), "image/png")})
+		assert r.status_code == 413
+	finally:
+		memory_admission.budget = budget
+
+
+def test_memory_admission_lets_the_queue_through_when_a_waiter_gives_up():
+	import asyncio
+
+	from backend.services.admission import MemoryAdmission
+	from backend.services.executor import QueueFullError
+
+	async def scenario(give_up):
+		adm = MemoryAdmission(100, timeout=0.2)
+		adm.plan = lambda data, opts, degrade=True: (opts, data, "tiled" if data == 80 else None)
+
+		async def hold(need, seconds):
+			async with adm.admit(need, None):
+				await asyncio.sleep(seconds)
+
+		running = asyncio.create_task(hold(60, 1.0))
+		await asyncio.sleep(0.01)
+		#80 does not fit next to 60: it blocks the 30 queued behind it until it gives up
+		big = asyncio.create_task(hold(80, 0))
+		await asyncio.sleep(0.1)
+		small = asyncio.create_task(hold(30, 0))
+		await asyncio.sleep(0.01)
+		if give_up == "cancel":
+			big.cancel()
+		await asyncio.wait_for(small, 0.5)
+		if give_up == "timeout":
+			try:
+				await big
+				raise AssertionError("the big request should have timed out")
+			except QueueFullError:
+				pass
+		running.cancel()
+		return adm.stats()
+
+	for give_up in ("timeout", "cancel"):
+		stats = asyncio.run(scenario(give_up))
+		assert stats["degraded"] == 0 and stats["waiting"] == 0
+		assert stats["timed_out"] == (give_up == "timeout")
+
+
+def test_memory_admission_holds_memory_until_the_worker_is_done():
+	import asyncio
+	import threading
+
+	from backend.services.admission import MemoryAdmission
+	from backend.services.executor import ConversionExecutor
+
+	adm = MemoryAdmission(100)
+	adm.plan = lambda data, opts, degrade=True: (opts, data, None)
+	pool = ConversionExecutor("thread", workers=1)
+	release = threading.Event()
+
+	async def scenario():
+		async def convert():
+			async with adm.admit(60, None):
+				await pool.run(release.wait, 5)
+
+		task = asyncio.create_task(convert())
+		await asyncio.sleep(0.05)
+		task.cancel()
+		await asyncio.sleep(0.05)
+		#the request is gone but the worker still holds the image
+		held = adm.stats()["used_bytes"]
+		release.set()
+		for _ in range(100):
+			if adm.stats()["used_bytes"] == 0:
+				break
+			await asyncio.sleep(0.01)
+		return held, adm.stats()["used_bytes"]
+
+	try:
+		assert asyncio.run(scenario()) == (60, 0)
+	finally:
+		release.set()
+		pool.shutdown()
+
+
+def test_fixed_palette_by_name_and_inline():
+	params = {"max_size": 192, "outputs": "preview,meta"}
+	r = client.post("/magic/convert", params={**params, "palette": "crayons-8"}, files=_upload())
+	assert r.status_code == 200 and r.json()["meta"]["colors"] == 8
+	assert client.put("/magic/palettes/bw", json={"colors": ["#000000", "#FFFFFF"]}).status_code == 201
+	assert client.put("/magic/palettes/crayons-8", json={"colors": ["#000000", "#ffffff"]}).status_code == 409
+	assert client.get("/magic/palettes/bw").json()["colors"] == ["#000000", "#ffffff"]
+	named = client.post("/magic/convert", params={**params, "palette": "bw"}, files=_upload()).json()
+	inline = client.post("/magic/convert", params={**params, "palette": "000000,ffffff"}, files=_upload()).json()
+	assert named == inline and named["meta"]["colors"] == 2
+	assert client.delete("/magic/palettes/bw").status_code == 200
+	assert client.post("/magic/convert", params={**params, "palette": "bw"}, files=_upload()).status_code == 404
+	assert client.post("/magic/convert", params={**params, "palette": "zz0000,ffffff"}, files=_upload()).status_code == 422
+
+
+def test_sweep_returns_every_variant_matching_single_runs():
+	params = {"max_size": 192}
+	r = client.post("/magic/sweep", params={**params, "colors": "6,4", "merge_area": "100,200", "thumb_size": 64}, files=_upload())
+	assert r.status_code == 200
+	variants = r.json()["variants"]
+	assert [(v["options"]["colors"], v["options"]["merge_area"]) for v in variants] == [(4, 100), (4, 200), (6, 100), (6, 200)]
+	assert all(v["worksheet_png"] and v["preview_png"] for v in variants)
+	#the first palette is fitted cold, so it matches a plain conversion exactly
+	single = client.post("/magic/convert", params={**params, "colors": 4, "merge_area": 200, "outputs": "worksheet,meta"}, files=_upload())
+	assert variants[1]["meta"] == single.json()["meta"]
+	crowded = client.post("/magic/sweep", params={**params, "colors": "12", "merge_area": "1", "min_area": "5", "thumb_size": 64}, files=_upload())
+	single = client.post("/magic/convert", params={**params, "colors": 12, "merge_area": 1, "min_area": 5, "outputs": "worksheet,meta"}, files=_upload())
+	assert crowded.json()["variants"][0]["meta"]["numbers_overflow"] > 0
+	assert crowded.json()["variants"][0]["meta"] == single.json()["meta"]
+	too_many = client.post("/magic/sweep", params={"colors": ",".join(str(k) for k in range(2, 24)), "merge_area": "1,2,3"}, files=_upload())
+	assert too_many.status_code == 400
+
+
+def test_stream_sends_low_res_preview_then_result():
+	import json
+
+	r = client.post("/magic/convert/stream", params={"max_size": 384, "colors": 4}, files=_upload())
+	assert r.status_code == 200 and r.headers["content-type"].startswith("text/event-stream")
+	events = []
+	for block in r.text.strip().split("\n\n"):
+		head, data = block.split("\n", 1)
+		events.append((head[len("event: "):], json.loads(data[len("data: "):])))
+	assert [e for e, _ in events] == ["preview", "result"]
+	preview, result = events[0][1], events[1][1]
+	assert max(preview["meta"]["width"], preview["meta"]["height"]) == 256
+	assert max(result["meta"]["width"], result["meta"]["height"]) == 384
+	assert result["worksheet_png"] and result["meta"]["colors"] == 4
+
+
+def _frames_upload():
+	import io
+
+	from PIL import Image
+
+	base = Image.open(IMG).convert("RGB").resize((160, 120))
+	frames = [base.rotate(angle) for angle in (0, 10, 10, 20)]
+	buf = io.BytesIO()
+	frames[0].save(buf, "TIFF", save_all=True, append_images=frames[1:])
+	return {"file": ("frames.tiff", buf.getvalue(), "image/tiff")}
+
+
+def test_frames_zip_and_pdf_share_palette_and_reuse_repeats():
+	import io
+	import json
+	import zipfile
+
+	upload = _frames_upload()
+	params = {"max_size": 160, "colors": 5, "outputs": "worksheet,legend"}
+	r = client.post("/magic/convert/frames", params=params, files=upload)
+	assert r.status_code == 200 and r.headers["x-frame-count"] == "4"
+	zf = zipfile.ZipFile(io.BytesIO(r.content))
+	names = zf.namelist()
+	assert names[-1] == "meta.json" and "legend.png" in names
+	assert [n for n in names if n.endswith("worksheet.png")] == [f"frame_000{i}/worksheet.png" for i in range(1, 5)]
+	meta = json.loads(zf.read("meta.json"))
+	assert meta["frames"] == 4 and len(meta["palette"]) == 5
+	assert [item["reused"] for item in meta["items"]] == [False, False, True, False]
+	assert zf.read("frame_0003/worksheet.png") == zf.read("frame_0002/worksheet.png")
+	pdf = client.post("/magic/convert/frames", params={**params, "format": "pdf", "max_frames": 3}, files=upload)
+	assert pdf.status_code == 200 and pdf.content.startswith(b"%PDF-") and pdf.content.endswith(b"%%EOF\n")
+	assert b"/Count 3" in pdf.content and pdf.content.count(b"/Subtype /Image") == 2
+
+
+def test_frames_refuse_oversized_and_invalid_uploads_like_convert(monkeypatch):
+	import io
+
+	from PIL import Image
+
+	buf = io.BytesIO()
+	Image.new("RGB", (200, 200)).save(buf, "PNG")
+	bomb = {"file": ("bomb.png", buf.getvalue(), "image/png")}
+	monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+	params = {"max_size": 160, "colors": 4}
+	assert client.post("/magic/convert", params=params, files=bomb).status_code == 413
+	assert client.post("/magic/convert/frames", params=params, files=bomb).status_code == 413
+	junk = {"file": ("junk.gif", b"GIF89a not really", "image/gif")}
+	assert client.post("/magic/convert/frames", params=params, files=junk).status_code == 400
+
+
+def test_streamed_bodies_count_in_request_metrics(monkeypatch):
+	import re
+	import time
+
+	from backend.api import routes
+
+	convert = routes.convert_frame
+	calls = []
+
+	def slow_after_first(img, opts):
+		calls.append(1)
+		if len(calls) > 1:
+			#converted while the 200 response body is already streaming
+			time.sleep(0.15)
+		return convert(img, opts)
+
+	def frames_seconds():
+		found = re.search(r'magic_request_duration_seconds_sum\{route="/magic/convert/frames"\} ([0-9.e+-]+)', client.get("/metrics").text)
+		return float(found.group(1)) if found else 0.0
+
+	monkeypatch.setattr(routes, "convert_frame", slow_after_first)
+	before = frames_seconds()
+	r = client.post("/magic/convert/frames", params={"max_size": 160, "colors": 4, "outputs": "worksheet", "skip_threshold": 0}, files=_frames_upload())
+	assert r.status_code == 200 and len(calls) >= 3
+	assert frames_seconds() - before >= 0.15 * (len(calls) - 1)
+	assert 'magic_requests_in_flight{route="/magic/convert/frames"} 0' in client.get("/metrics").text
+
+
+def test_frames_run_on_process_workers(monkeypatch):
+	import io
+	import json
+	import zipfile
+
+	from backend.api import routes
+	from backend.services.executor import ConversionExecutor
+
+	pool = ConversionExecutor("process", workers=1)
+	monkeypatch.setattr(routes, "conversion_executor", pool)
+	try:
+		r = client.post("/magic/convert/frames", params={"max_size": 160, "colors": 4, "outputs": "worksheet"}, files=_frames_upload())
+	finally:
+		pool.shutdown()
+	assert r.status_code == 200
+	meta = json.loads(zipfile.ZipFile(io.BytesIO(r.content)).read("meta.json"))
+	assert meta["frames"] == 4 and "error" not in meta
+
+
+def test_frames_failing_midway_end_with_an_error_entry(monkeypatch):
+	import io
+	import json
+	import zipfile
+
+	from backend.api import routes
+
+	convert = routes.convert_frame
+	calls = []
+
+	def flaky(img, opts):
+		calls.append(1)
+		if len(calls) > 1:
+			raise RuntimeError("worker lost")
+		return convert(img, opts)
+
+	monkeypatch.setattr(routes, "convert_frame", flaky)
+	params = {"max_size": 160, "colors": 4, "outputs": "worksheet"}
+	r = client.post("/magic/convert/frames", params=params, files=_frames_upload())
+	assert r.status_code == 200
+	zf = zipfile.ZipFile(io.BytesIO(r.content))
+	assert json.loads(zf.read("error.json")) == {"frame": 1, "detail": "worker lost"}
+	meta = json.loads(zf.read("meta.json"))
+	assert meta["frames"] == 1 and meta["error"]["frame"] == 1
+	calls.clear()
+	pdf = client.post("/magic/convert/frames", params={**params, "format": "pdf"}, files=_frames_upload())
+	assert pdf.content.endswith(b"%%EOF\n") and b"/Count 2" in pdf.content and b"(worker lost) Tj" in pdf.content
+
+
+def test_jobs_submit_poll_fetch_and_cancel():
+	import time
+
+	#the job worker tasks need the app's event loop to outlive single requests
+	with TestClient(app) as c:
+		submitted = c.post("/magic/jobs", params={"max_size": 192, "colors": 4, "outputs": "worksheet"}, files=_upload())
+		assert submitted.status_code == 202
+		job_id = submitted.json()["id"]
+		assert submitted.headers["location"] == f"/magic/jobs/{job_id}"
+		for _ in range(200):
+			status = c.get(f"/magic/jobs/{job_id}").json()
+			if status["status"] not in ("queued", "running"):
+				break
+			time.sleep(0.02)
+		assert status["status"] == "done" and status["progress"] == 1.0
+		assert list(status["stages"])[:2] == ["decode", "downscale"]
+		png = c.get(status["result_url"], params={"format": "png"})
+		assert png.content.startswith(b"\x89PNG")
+		#finished jobs are deleted on DELETE, unknown ids are 404
+		assert c.delete(f"/magic/jobs/{job_id}").status_code == 200
+		assert c.get(f"/magic/jobs/{job_id}").status_code == 404
+		assert c.get("/magic/jobs").json()["done"] >= 1
+		assert _cancel_running_job(c, colors=11)["status"] == "cancelled"
+
+
+def _cancel_running_job(c, colors):
+	"""Submit a full-size job, cancel it once it reports a stage; its final status."""
+	import time
+
+	job_id = c.post("/magic/jobs", params={"max_size": 1024, "colors": colors, "return_pdf": True}, files=_upload()).json()["id"]
+	for _ in range(1000):
+		status = c.get(f"/magic/jobs/{job_id}").json()
+		if status["status"] != "queued" and status["stage"] is not None:
+			break
+		time.sleep(0.005)
+	#live progress: the stage shows while the job runs
+	assert status["status"] == "running" and status["stage"] in status["planned"]
+	assert c.delete(f"/magic/jobs/{job_id}").json()["status"] == "running"
+	for _ in range(1000):
+		status = c.get(f"/magic/jobs/{job_id}").json()
+		if status["status"] not in ("queued", "running"):
+			break
+		time.sleep(0.005)
+	return status
+
+
+def test_jobs_on_process_workers_report_progress_and_cancel(monkeypatch):
+	from backend.services.executor import ConversionExecutor
+	from backend.services.jobs import job_manager
+
+	pool = ConversionExecutor("process", workers=1)
+	monkeypatch.setattr(job_manager, "executor", pool)
+	try:
+		with TestClient(app) as c:
+			assert _cancel_running_job(c, colors=13)["status"] == "cancelled"
+	finally:
+		pool.shutdown()
+
+
+def test_jobs_waiting_for_a_busy_pool_can_be_cancelled(monkeypatch):
+	import threading
+	import time
+
+	from backend.services.executor import ConversionExecutor
+	from backend.services.jobs import job_manager
+
+	pool = ConversionExecutor("thread", workers=1, queue_depth=0)
+	monkeypatch.setattr(job_manager, "executor", pool)
+	release = threading.Event()
+	try:
+		with TestClient(app) as c:
+			#a synchronous conversion holds the only worker: the job waits for room
+			busy = c.portal.start_task_soon(pool.run, release.wait, 10)
+			job_id = c.post("/magic/jobs", params={"max_size": 192, "colors": 5}, files=_upload()).json()["id"]
+			for _ in range(200):
+				if c.get(f"/magic/jobs/{job_id}").json()["status"] == "running":
+					break
+				time.sleep(0.005)
+			assert c.delete(f"/magic/jobs/{job_id}").status_code == 200
+			for _ in range(200):
+				status = c.get(f"/magic/jobs/{job_id}").json()["status"]
+				if status != "running":
+					break
+				time.sleep(0.005)
+			assert status == "cancelled" and not busy.done()
+			release.set()
+			busy.result(5)
+	finally:
+		release.set()
+		pool.shutdown()
+
+
+def test_memory_job_store_evicts_oldest_results():
+	from backend.services.jobs import MemoryJobStore
+	from backend.services.magic import render_worksheet_artifacts
+	from backend.api.schemas import ConvertRequestOptions
+
+	artifacts = render_worksheet_artifacts(IMG.read_bytes(), ConvertRequestOptions(max_size=128, colors=3))
+	store = MemoryJobStore(max_result_bytes=2 * artifacts.nbytes + 600)
+	for job_id in ("a", "b", "c"):
+		store.put_result(job_id, artifacts)
+	assert store.get_result("a") is None and store.get_result("c") is artifacts
+	assert store.evictions == 1